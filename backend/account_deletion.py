@@ -0,0 +1,201 @@
+"""
+Account deletion pipeline.
+
+Requesting a deletion first marks the user document (`deleted_at`), which
+makes the API treat the account as gone: its tokens stop working, so nothing
+writes new data behind the job. Deleting an account removes the user's documents from every tracking
+collection, their progress photos (and unconfirmed uploads) from S3 and
+finally the user document. Content-addressed photo objects can be shared,
+so for those only the user's references are released (see photo_blobs.py).
+The work runs as a background job (on the task queue when one is given) in
+small batches: each batch issues one S3
+`delete_objects` call (up to 1000 keys) and one `delete_many`, then records
+its progress on the job document. Batches are idempotent, so a job interrupted
+by a restart simply picks up where its checkpoint left off, and a failed run is
+retried by the task queue from its checkpoint; the job is marked `failed` once
+MAX_ATTEMPTS runs have failed.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Callable, List, Optional
+
+from botocore.exceptions import ClientError
+from pymongo import ReturnDocument
+
+from photo_blobs import is_content_addressed
+
+logger = logging.getLogger(__name__)
+
+# Photos first (they reference S3 objects), the user document last.
+STAGES = ["progress_photos", "photo_uploads", "weight_entries", "water_intake", "weight_buckets", "water_buckets",
+          "workout_logs", "exercise_progress", "custom_plans", "exercise_index", "watermarks", "reminder_settings",
+          "reminder_schedule", "streaks", "leaderboard_entries", "users"]
+# Collections whose owner field isn't "user_id"
+OWNER_FIELDS = {"exercise_index": "owner_id"}
+# Collections whose documents point at an S3 object through "photo_url"
+PHOTO_STAGES = ("progress_photos", "photo_uploads")
+ACTIVE = ("queued", "running")
+
+BATCH_SIZE = 500
+LEASE = timedelta(seconds=60)
+MAX_ATTEMPTS = 5
+
+
+class AccountDeleter:
+    def __init__(self, db, s3_client, bucket: str, url_prefix: str,
+                 on_deleted: Optional[Callable[[str], None]] = None, queue=None, blobs=None):
+        self.db = db
+        self.jobs = db.deletion_jobs
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.url_prefix = url_prefix
+        self.on_deleted = on_deleted
+        self.worker_id = uuid.uuid4().hex
+        self.queue = queue
+        self.blobs = blobs
+        self._tasks = set()
+        if queue is not None:
+            queue.handler("account.delete")(self._run_task)
+
+    async def ensure_indexes(self):
+        await self.jobs.create_index("id", unique=True)
+        await self.jobs.create_index([("user_id", 1), ("status", 1)])
+
+    async def request(self, user_id: str) -> Optional[dict]:
+        """Create a deletion job for a user and start it. An active job is reused and a
+        failed one is re-queued from its last checkpoint. Returns None if the user is
+        already gone."""
+        now = datetime.now(timezone.utc)
+        marked = await self.db.users.update_one({"id": user_id}, {"$set": {"deleted_at": now}})
+        job = await self.jobs.find_one_and_update(
+            {"user_id": user_id, "status": {"$in": list(ACTIVE) + ["failed"]}},
+            {"$set": {"status": "queued", "error": None, "attempts": 0}},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+        )
+        if not job:
+            if not marked.matched_count:
+                return None
+            job = {
+                "id": str(uuid.uuid4()), "user_id": user_id, "status": "queued",
+                "stage": STAGES[0], "deleted": {name: 0 for name in STAGES}, "s3_deleted": 0,
+                "error": None, "attempts": 0, "created_at": now, "updated_at": now, "lease_until": now,
+            }
+            await self.jobs.insert_one(job.copy())
+        await self.start(job["id"])
+        return job
+
+    async def status(self, job_id: str, user_id: str) -> Optional[dict]:
+        return await self.jobs.find_one({"id": job_id, "user_id": user_id}, {"_id": 0, "lease_until": 0, "owner": 0})
+
+    async def start(self, job_id: str):
+        if self.queue is not None:
+            await self.queue.enqueue("account.delete", {"job_id": job_id}, dedupe_key=f"account.delete:{job_id}",
+                                     max_attempts=MAX_ATTEMPTS)
+            return
+        task = asyncio.create_task(self.run(job_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_task(self, payload: dict):
+        await self.run(payload["job_id"])
+
+    async def resume_pending(self):
+        """Restart jobs left unfinished by a previous process (called on startup)."""
+        async for job in self.jobs.find({"status": {"$in": list(ACTIVE)}}, {"id": 1}):
+            await self.start(job["id"])
+
+    async def _claim(self, job_id: str) -> Optional[dict]:
+        """Take or renew the job's lease so only one worker runs it at a time."""
+        now = datetime.now(timezone.utc)
+        return await self.jobs.find_one_and_update(
+            {"id": job_id, "status": {"$in": list(ACTIVE)},
+             "$or": [{"lease_until": {"$lte": now}}, {"owner": self.worker_id}]},
+            {"$set": {"status": "running", "owner": self.worker_id, "lease_until": now + LEASE, "updated_at": now},
+             "$inc": {"attempts": 1}},
+            projection={"_id": 0},
+        )
+
+    async def _checkpoint(self, job_id: str, stage: str, deleted: int, s3_deleted: int = 0):
+        now = datetime.now(timezone.utc)
+        await self.jobs.update_one(
+            {"id": job_id, "owner": self.worker_id},
+            {"$set": {"stage": stage, "updated_at": now, "lease_until": now + LEASE},
+             "$inc": {f"deleted.{stage}": deleted, "s3_deleted": s3_deleted}},
+        )
+
+    async def run(self, job_id: str):
+        job = await self._claim(job_id)
+        if not job:
+            return
+        user_id = job["user_id"]
+        stage = job["stage"]
+        try:
+            for stage in STAGES[STAGES.index(job["stage"]):]:
+                if stage in PHOTO_STAGES:
+                    await self._delete_photos(job_id, stage, user_id)
+                elif stage == "users":
+                    result = await self.db.users.delete_one({"id": user_id})
+                    await self._checkpoint(job_id, stage, result.deleted_count)
+                else:
+                    await self._delete_collection(job_id, stage, user_id)
+            await self.jobs.update_one({"id": job_id}, {"$set": {
+                "status": "done", "updated_at": datetime.now(timezone.utc)}})
+            if self.on_deleted:
+                self.on_deleted(user_id)
+            logger.info(f"Account deletion {job_id} finished")
+        except Exception as e:
+            # Only the queue retries; the job's attempts count its failed runs
+            attempts = job.get("attempts", 0) + 1
+            retry = self.queue is not None and attempts < MAX_ATTEMPTS
+            logger.error(f"Account deletion {job_id} failed at stage {stage} (attempt {attempts}): {e}")
+            now = datetime.now(timezone.utc)
+            await self.jobs.update_one({"id": job_id}, {"$set": {
+                "status": "queued" if retry else "failed", "error": str(e), "updated_at": now, "lease_until": now}})
+            if self.queue is not None:
+                raise  # retried, or dead-lettered along with the job
+
+    async def _delete_collection(self, job_id: str, name: str, user_id: str):
+        col = self.db[name]
+        owner = {OWNER_FIELDS.get(name, "user_id"): user_id}
+        while True:
+            batch = await col.find(owner, {"_id": 1}).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+            if not batch:
+                await self._checkpoint(job_id, name, 0)
+                return
+            result = await col.delete_many({"_id": {"$in": [d["_id"] for d in batch]}})
+            await self._checkpoint(job_id, name, result.deleted_count)
+
+    async def _delete_photos(self, job_id: str, name: str, user_id: str):
+        col = self.db[name]
+        while True:
+            batch = await col.find({"user_id": user_id}, {"_id": 1, "photo_url": 1}).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+            if not batch:
+                await self._checkpoint(job_id, name, 0)
+                return
+            keys = [d["photo_url"][len(self.url_prefix):] for d in batch
+                    if (d.get("photo_url") or "").startswith(self.url_prefix)]
+            shared = [k for k in keys if self.blobs is not None and is_content_addressed(k)]
+            owned = [k for k in keys if k not in shared]
+            s3_deleted = await asyncio.to_thread(self._delete_objects, owned) if owned else 0
+            result = await col.delete_many({"_id": {"$in": [d["_id"] for d in batch]}})
+            # Shared objects are released only after their documents are gone, so a
+            # retried batch can't release twice (a crash in between leaks, never loses)
+            if shared:
+                await self.blobs.schedule_collect(await self.blobs.release_many(shared))
+            await self._checkpoint(job_id, name, result.deleted_count, s3_deleted)
+
+    def _delete_objects(self, keys: List[str]) -> int:
+        """Bulk-delete S3 keys (<= 1000 per call). Raises if any key fails so the batch is retried."""
+        try:
+            response = self.s3.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True},
+            )
+        except ClientError as e:
+            raise RuntimeError(f"S3 delete_objects failed: {e}")
+        errors = response.get("Errors", [])
+        if errors:
+            raise RuntimeError(f"S3 delete_objects failed for {len(errors)} keys, e.g. {errors[0].get('Key')}: {errors[0].get('Message')}")
+        return len(keys)
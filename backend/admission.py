@@ -0,0 +1,155 @@
+"""
+Adaptive admission control.
+
+`AdmissionMiddleware` caps the number of requests a worker runs at once and
+adapts the cap to observed latency (AIMD): each request's latency is divided
+by a per-route baseline (a slowly-rising minimum), and after every window of
+samples the limit is cut by `backoff` if the 90th-percentile ratio exceeds
+`tolerance`, or raised by one if the window pressed against the limit.
+Normalizing per route keeps a 300 ms bcrypt login from looking like
+congestion next to a 3 ms water read.
+
+Requests are classified by `PriorityRoute` (first match wins). Each class may
+only use a fraction of the limit, so the cheap reads that the app needs to
+stay usable keep running while photo uploads and logins are turned away first,
+with a 503 and a jittered Retry-After. The decision happens before the
+request body is read.
+"""
+import json
+import random
+import time
+from typing import Dict, List, NamedTuple, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CRITICAL, NORMAL, SHEDDABLE = "critical", "normal", "sheddable"
+UNMATCHED_ROUTE = "<unmatched>"
+# Share of the concurrency limit each class may occupy
+SHARE = {CRITICAL: 1.0, NORMAL: 0.8, SHEDDABLE: 0.5}
+
+
+class PriorityRoute(NamedTuple):
+    priority: str
+    methods: Tuple[str, ...]
+    path: str  # exact path, or a prefix when it ends with "*"
+
+    def matches(self, method: str, path: str) -> bool:
+        if self.methods and method not in self.methods:
+            return False
+        if self.path.endswith("*"):
+            return path.startswith(self.path[:-1])
+        return path == self.path
+
+
+class AdaptiveLimit:
+    def __init__(self, initial: int = 64, min_limit: int = 8, max_limit: int = 512, tolerance: float = 2.0,
+                 backoff: float = 0.9, window: int = 100, window_seconds: float = 1.0):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.window = window
+        self.window_seconds = window_seconds
+        self.inflight = 0
+        self._baselines: Dict[str, float] = {}
+        self._ratios: List[float] = []
+        self._window_start = time.monotonic()
+        self._window_peak = 0
+        self._window_shed = False
+        self.admitted = {CRITICAL: 0, NORMAL: 0, SHEDDABLE: 0}
+        self.shed = {CRITICAL: 0, NORMAL: 0, SHEDDABLE: 0}
+        self.increases = 0
+        self.decreases = 0
+
+    def try_acquire(self, priority: str) -> bool:
+        if self.inflight >= self.limit * SHARE[priority]:
+            self.shed[priority] += 1
+            self._window_shed = True
+            return False
+        self.inflight += 1
+        self._window_peak = max(self._window_peak, self.inflight)
+        self.admitted[priority] += 1
+        return True
+
+    def release(self, route: str, seconds: float):
+        self.inflight -= 1
+        baseline = self._baselines.get(route)
+        if baseline is None or seconds < baseline:
+            self._baselines[route] = baseline = max(seconds, 1e-4)
+        else:
+            # Drift up slowly, so a route that got permanently slower isn't read as congestion forever
+            self._baselines[route] = baseline + (seconds - baseline) * 0.01
+        self._ratios.append(seconds / baseline)
+        now = time.monotonic()
+        if len(self._ratios) >= self.window or (len(self._ratios) >= 10 and now - self._window_start >= self.window_seconds):
+            self._adjust(now)
+
+    def _adjust(self, now: float):
+        ratios = sorted(self._ratios)
+        p90 = ratios[int(len(ratios) * 0.9)]
+        if p90 > self.tolerance:
+            limit = max(self.min_limit, int(self.limit * self.backoff))
+            if limit < self.limit:
+                self.decreases += 1
+            self.limit = limit
+        elif self._window_shed or self._window_peak >= self.limit * SHARE[SHEDDABLE]:
+            if self.limit < self.max_limit:
+                self.limit += 1
+                self.increases += 1
+        self._ratios = []
+        self._window_start = now
+        self._window_peak = self.inflight
+        self._window_shed = False
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit, "inflight": self.inflight, "admitted": dict(self.admitted),
+            "shed": dict(self.shed), "increases": self.increases, "decreases": self.decreases,
+        }
+
+
+class AdmissionMiddleware:
+    def __init__(self, app: ASGIApp, routes: List[PriorityRoute], limiter: AdaptiveLimit,
+                 prefix: str = "/api/", enabled: bool = True):
+        self.app = app
+        self.routes = routes
+        self.limiter = limiter
+        self.prefix = prefix
+        self.enabled = enabled
+
+    def classify(self, method: str, path: str) -> str:
+        for route in self.routes:
+            if route.matches(method, path):
+                return route.priority
+        return NORMAL
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (scope["type"] != "http" or not self.enabled or scope["method"] == "OPTIONS"
+                or not scope["path"].startswith(self.prefix)):
+            await self.app(scope, receive, send)
+            return
+        priority = self.classify(scope["method"], scope["path"])
+        if not self.limiter.try_acquire(priority):
+            await self._reject(send, priority)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # Unmatched paths (404 scans) share one baseline rather than one per raw path
+            route = getattr(scope.get("route"), "path", None) or UNMATCHED_ROUTE
+            key = f"{scope['method']} {route}"
+            self.limiter.release(key, time.perf_counter() - start)
+
+    async def _reject(self, send: Send, priority: str):
+        # Jitter so shed clients don't come back in lockstep; lower classes wait longer
+        retry_after = random.randint(1, 3) + (2 if priority == SHEDDABLE else 0)
+        body = json.dumps({"detail": "Server is busy, please retry shortly"}).encode()
+        start: Message = {
+            "type": "http.response.start", "status": 503,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"retry-after", str(retry_after).encode())],
+        }
+        await send(start)
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,120 @@
+"""
+Compares string dates + plain (user_id, date) indexes with BSON dates + the
+covering indexes used by the API, on weight entries.
+
+Loads the same synthetic history into two collections, then reports data and
+index size and the latency of the two hot reads: the latest-100 weight list
+and a 7-day range count (the dashboard's query shape). `explain` is used to
+confirm the covered variant examines no documents.
+
+    python bench/bench_dates.py --users 20000 --days 365
+
+Requires MONGO_URL; writes to BENCH_DB_NAME (default: fat2fit_bench), which is
+dropped first.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+from pymongo import MongoClient
+
+FIELDS = {"_id": 0, "id": 1, "user_id": 1, "date": 1, "weight": 1, "created_at": 1}
+
+
+def generate(db, users: int, days: int, batch: int = 20000):
+    start = date.today() - timedelta(days=days)
+    strings, natives = [], []
+    for u in range(users):
+        user_id = str(uuid.UUID(int=u))
+        for d in range(days):
+            day = start + timedelta(days=d)
+            created = datetime(day.year, day.month, day.day, 7, tzinfo=timezone.utc) + timedelta(seconds=random.randrange(3600))
+            entry_id, weight = str(uuid.uuid4()), round(random.uniform(50, 120), 1)
+            strings.append({"id": entry_id, "user_id": user_id, "weight": weight,
+                            "date": day.isoformat(), "created_at": created.isoformat()})
+            natives.append({"id": entry_id, "user_id": user_id, "weight": weight,
+                            "date": datetime(day.year, day.month, day.day, tzinfo=timezone.utc), "created_at": created})
+            if len(strings) >= batch:
+                db.weights_string.insert_many(strings, ordered=False)
+                db.weights_native.insert_many(natives, ordered=False)
+                strings, natives = [], []
+        if u and u % 10000 == 0:
+            print(f"  loaded {u} users")
+    if strings:
+        db.weights_string.insert_many(strings, ordered=False)
+        db.weights_native.insert_many(natives, ordered=False)
+
+
+def sizes(db, name: str) -> dict:
+    s = db.command("collStats", name)
+    return {"count": s["count"], "size_mb": s["size"] / 2**20, "index_mb": s["totalIndexSize"] / 2**20}
+
+
+def queries(db, users: int, samples: int):
+    week_start = date.today() - timedelta(days=7)
+    week_start_native = datetime(week_start.year, week_start.month, week_start.day, tzinfo=timezone.utc)
+    timings = {(layout, q): [] for layout in ("string", "native") for q in ("list", "count")}
+    for _ in range(samples):
+        user_id = str(uuid.UUID(int=random.randrange(users)))
+        for layout, col, since, projection in (
+            ("string", db.weights_string, week_start.isoformat(), {"_id": 0}),
+            ("native", db.weights_native, week_start_native, FIELDS),
+        ):
+            t = time.perf_counter()
+            list(col.find({"user_id": user_id}, projection).sort("date", -1).limit(100))
+            timings[(layout, "list")].append((time.perf_counter() - t) * 1000)
+
+            t = time.perf_counter()
+            col.count_documents({"user_id": user_id, "date": {"$gte": since}})
+            timings[(layout, "count")].append((time.perf_counter() - t) * 1000)
+    return timings
+
+
+def docs_examined(col, projection) -> int:
+    plan = col.find({"user_id": str(uuid.UUID(int=0))}, projection).sort("date", -1).limit(100).explain()
+    return plan["executionStats"]["totalDocsExamined"]
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--samples", type=int, default=2000)
+    args = parser.parse_args()
+
+    client = MongoClient(os.environ["MONGO_URL"], tz_aware=True)
+    client.drop_database(os.environ.get("BENCH_DB_NAME", "fat2fit_bench"))
+    db = client[os.environ.get("BENCH_DB_NAME", "fat2fit_bench")]
+    db.weights_string.create_index([("user_id", 1), ("date", -1)])
+    db.weights_native.create_index([("user_id", 1), ("date", -1), ("weight", 1), ("created_at", 1), ("id", 1)])
+
+    print(f"Loading {args.users} users x {args.days} days...")
+    t = time.perf_counter()
+    generate(db, args.users, args.days)
+    print(f"Loaded in {time.perf_counter() - t:.1f}s\n")
+
+    print(f"{'layout':<8} {'docs':>12} {'data MB':>10} {'index MB':>9} {'docs examined (list)':>21}")
+    for layout, projection in (("string", {"_id": 0}), ("native", FIELDS)):
+        col = db[f"weights_{layout}"]
+        s = sizes(db, col.name)
+        print(f"{layout:<8} {s['count']:>12} {s['size_mb']:>10.1f} {s['index_mb']:>9.1f} {docs_examined(col, projection):>21}")
+
+    timings = queries(db, args.users, args.samples)
+    print(f"\nQueries over {args.samples} random users (ms)")
+    print(f"{'layout':<8} {'query':<6} {'p50':>8} {'p95':>8} {'p99':>8} {'mean':>8}")
+    for (layout, q), values in timings.items():
+        print(f"{layout:<8} {q:<6} {pct(values, .5):>8.2f} {pct(values, .95):>8.2f} {pct(values, .99):>8.2f} {statistics.mean(values):>8.2f}")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmarks the progressive-overload engine on a synthetic workout history.
+
+Generates users x exercises x sessions x sets (default 10,000 x 8 x 42 x 3,
+about 10M sets) in memory, user by user, and reports:
+
+  - batch throughput: replaying every history through `apply_session`, which
+    is what `precompute_overload.py` does per user;
+  - incremental cost: folding one new session into an existing state, which is
+    what logging a workout does;
+  - rescan cost: recomputing one exercise from its full history, i.e. what a
+    suggestion would cost without stored state.
+
+No database is needed; Mongo round trips are the same single read + bulk
+write per logged workout in either case.
+
+    python bench/bench_overload.py --users 10000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from overload import apply_session, new_state  # noqa: E402
+
+EXERCISES = [("Barbell Squat", "Legs", 60), ("Bench Press", "Chest", 50), ("Barbell Row", "Back", 45),
+             ("Overhead Press", "Shoulders", 30), ("Deadlift", "Back/Legs", 80), ("Lat Pulldown", "Back", 40),
+             ("Leg Press", "Legs", 100), ("Bicep Curls", "Arms", 12)]
+
+
+def history(rng: random.Random, sessions: int, sets: int, start_weight: float):
+    """Sessions of a lifter who mostly follows the suggestion and sometimes misses."""
+    weight, reps = start_weight, 8
+    day = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for _ in range(sessions):
+        done = [{"reps": max(1, reps + rng.choice((-2, -1, 0, 0, 0, 1))), "weight": weight} for _ in range(sets)]
+        yield day, done
+        day += timedelta(days=rng.choice((2, 3, 4)))
+        if min(s["reps"] for s in done) >= 10:
+            weight, reps = weight + 2.5, 8
+        else:
+            reps = min(reps + 1, 10)
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--exercises", type=int, default=len(EXERCISES))
+    parser.add_argument("--sessions", type=int, default=42)
+    parser.add_argument("--sets", type=int, default=3)
+    parser.add_argument("--samples", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    exercises = EXERCISES[:args.exercises]
+    total_sets = args.users * len(exercises) * args.sessions * args.sets
+    print(f"Replaying {args.users} users x {len(exercises)} exercises x {args.sessions} sessions "
+          f"x {args.sets} sets = {total_sets:,} sets")
+
+    replay_s = 0.0
+    kept = []  # a sample of (final state, next session, full history) for the per-request timings
+    for u in range(args.users):
+        for name, group, start in exercises:
+            sessions = list(history(rng, args.sessions + 1, args.sets, start))
+            state = new_state(str(u), name, group, (8, 10))
+            t = time.perf_counter()
+            for day, sets in sessions[:-1]:
+                state = apply_session(state, sets, day)
+            replay_s += time.perf_counter() - t
+            if len(kept) < args.samples and rng.random() < 0.05:
+                kept.append((state, sessions[-1], sessions))
+        if u and u % 2000 == 0:
+            print(f"  {u} users")
+    print(f"\nBatch replay: {replay_s:.1f}s, {total_sets / replay_s:,.0f} sets/s, "
+          f"{args.users / replay_s:,.0f} users/s")
+
+    incremental, rescan = [], []
+    for state, (day, sets), sessions in kept:
+        t = time.perf_counter()
+        apply_session(state, sets, day)
+        incremental.append((time.perf_counter() - t) * 1e6)
+
+        t = time.perf_counter()
+        s = new_state("u", state["name"], state["muscle_group"], (8, 10))
+        for d, done in sessions:
+            s = apply_session(s, done, d)
+        rescan.append((time.perf_counter() - t) * 1e6)
+
+    print(f"\nPer new session over {len(kept)} samples (microseconds, CPU only)")
+    print(f"{'strategy':<12} {'p50':>8} {'p95':>8} {'p99':>8} {'mean':>8}")
+    for label, values in (("incremental", incremental), ("rescan", rescan)):
+        print(f"{label:<12} {pct(values, .5):>8.1f} {pct(values, .95):>8.1f} {pct(values, .99):>8.1f} {statistics.mean(values):>8.1f}")
+    print(f"\nRescan also reads ~{args.sessions} log documents per exercise from Mongo; incremental reads one state.")
+
+
+if __name__ == "__main__":
+    main()
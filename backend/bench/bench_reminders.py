@@ -0,0 +1,198 @@
+"""
+Benchmarks the reminder scheduler with 1M users.
+
+Every user gets water reminders (every 60-180 minutes from a start between
+07:00 and 10:00 until 21:00 local) and workout reminders (3-5 days a week)
+across a dozen time zones; a share of users reach their water goal or log a
+workout each day, so their reminders are skipped. Reports:
+
+  - scheduling: computing and inserting the first due time of every
+    (user, kind) into the timer wheel (`MemoryReminderStore`), and memory;
+  - a simulated day of once-a-minute ticks: per-tick latency, the busiest
+    minute, and sent / skipped totals. Each tick runs the same path as
+    `Reminders.tick` (due entries -> `decide` -> sender -> reschedule), with
+    the settings, water and workout lookups answered from memory.
+
+    python bench/bench_reminders.py --users 1000000 --hours 24
+
+With --mongo, the same users are loaded into a scratch database
+(MONGO_URL / BENCH_DB_NAME, default fat2fit_bench, dropped first) and the
+full `Reminders.tick` runs against `MongoReminderStore` for --mongo-minutes
+ticks starting at the busiest minute.
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from reminders import (KINDS, WATER, WORKOUT, MemoryReminderStore, MongoReminderStore,  # noqa: E402
+                       ReminderSender, Reminders, decide, local_day, make_entry, next_due, spread_days)
+from dates import to_day  # noqa: E402
+from tracking import DocumentTrackingStore  # noqa: E402
+
+ZONES = ["UTC", "Europe/London", "Europe/Berlin", "Europe/Istanbul", "Asia/Dubai", "Asia/Kolkata",
+         "Asia/Singapore", "Asia/Tokyo", "Australia/Sydney", "America/Sao_Paulo", "America/New_York",
+         "America/Los_Angeles"]
+
+
+class CountingSender(ReminderSender):
+    def __init__(self):
+        self.sent = 0
+        self.calls = 0
+
+    async def send(self, reminders):
+        self.sent += len(reminders)
+        self.calls += 1
+        return len(reminders)
+
+
+def make_settings(rng: random.Random, user_id: str) -> dict:
+    start = 7 * 60 + rng.randrange(0, 13) * 15
+    return {
+        "user_id": user_id, "timezone": rng.choice(ZONES),
+        WATER: {"enabled": True, "start": f"{start // 60:02d}:{start % 60:02d}", "end": "21:00",
+                "every_minutes": rng.choice([60, 90, 120, 180])},
+        WORKOUT: {"enabled": rng.random() < 0.6, "time": rng.choice(["07:00", "12:30", "18:00", "19:30"]),
+                  "days": spread_days(rng.choice([3, 4, 5]))},
+    }
+
+
+def rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def bench_memory(args, users: dict, start: datetime):
+    rng = random.Random(args.seed + 1)
+    store = MemoryReminderStore()
+    before = rss_mb()
+    t0 = time.perf_counter()
+    entries = []
+    for user_id, settings in users.items():
+        for kind in KINDS:
+            due = next_due(settings, kind, start)
+            if due is not None:
+                entries.append(make_entry(user_id, kind, due))
+    t1 = time.perf_counter()
+    await store.put(entries)
+    t2 = time.perf_counter()
+    print(f"scheduling: {len(entries)} entries, next_due {len(entries) / (t1 - t0):,.0f}/s, "
+          f"wheel insert {len(entries) / (t2 - t1):,.0f}/s, peak RSS +{rss_mb() - before:.0f} MB")
+    del entries
+
+    # Who is at their water goal / trained on a given local day (decided on first look)
+    water, worked_out = {}, set()
+
+    def lookups(batch, now):
+        for entry in batch:
+            key = (entry["user_id"], local_day(entry["due_at"], users[entry["user_id"]]["timezone"]))
+            if key not in water:
+                water[key] = {"glasses": 8 if rng.random() < args.goal_rate else rng.randint(0, 7), "goal": 8}
+                if rng.random() < args.workout_rate:
+                    worked_out.add(key)
+        return water, worked_out
+
+    sender = CountingSender()
+    counts = defaultdict(int)
+    tick_ms, busiest = [], (0, None)
+    for minute in range(int(args.hours * 60)):
+        now = start + timedelta(minutes=minute)
+        t = time.perf_counter()
+        processed = 0
+        while True:
+            batch = await store.due(now, args.batch)
+            if not batch:
+                break
+            settings = {e["user_id"]: users[e["user_id"]] for e in batch}
+            send, reschedule, drop = decide(batch, settings, *lookups(batch, now), now, counts)
+            if send:
+                await sender.send(send)
+            await store.put(reschedule)
+            await store.remove(drop)
+            processed += len(batch)
+            if len(batch) < args.batch:
+                break
+        tick_ms.append((time.perf_counter() - t) * 1000)
+        if processed > busiest[0]:
+            busiest = (processed, now)
+    tick_ms.sort()
+    print(f"simulated {args.hours:g}h of ticks: p50 {statistics.median(tick_ms):.2f} ms, "
+          f"p99 {tick_ms[int(len(tick_ms) * 0.99)]:.1f} ms, max {tick_ms[-1]:.1f} ms")
+    print(f"  busiest minute {busiest[1]:%H:%M} UTC: {busiest[0]} due reminders")
+    print(f"  sent {sender.sent} in {sender.calls} sender calls, skipped: goal met {counts['goal_met']}, "
+          f"already trained {counts['worked_out']}, late {counts['late']}")
+    return busiest[1]
+
+
+async def bench_mongo(args, users: dict, busiest: datetime):
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"], tz_aware=True)
+    db = client[os.environ.get("BENCH_DB_NAME", "fat2fit_bench")]
+    await client.drop_database(db.name)
+    tracking = DocumentTrackingStore(db)
+    await tracking.ensure_indexes()
+    sender = CountingSender()
+    reminders = Reminders(db, MongoReminderStore(db.reminder_schedule), sender, tracking, batch_size=args.batch)
+    await reminders.ensure_indexes()
+    await db.workout_logs.create_index([("user_id", 1), ("date", -1)])
+
+    t = time.perf_counter()
+    docs = list(users.values())
+    for i in range(0, len(docs), 10000):
+        await db.reminder_settings.insert_many([dict(d) for d in docs[i:i + 10000]], ordered=False)
+    rng = random.Random(args.seed + 2)
+    at_goal = [{"id": str(uuid.uuid4()), "user_id": u, "date": to_day(local_day(busiest, s["timezone"])),
+                "glasses": 8, "goal": 8} for u, s in users.items() if rng.random() < args.goal_rate]
+    for i in range(0, len(at_goal), 10000):
+        await db.water_intake.insert_many(at_goal[i:i + 10000], ordered=False)
+    entries = [make_entry(u, kind, due) for u, s in users.items() for kind in KINDS
+               if (due := next_due(s, kind, busiest - timedelta(seconds=1))) is not None]
+    for i in range(0, len(entries), 10000):
+        await reminders.store.put(entries[i:i + 10000])
+    print(f"mongo: loaded {len(docs)} settings, {len(at_goal)} at-goal water days and {len(entries)} schedule entries in {time.perf_counter() - t:.1f}s")
+
+    tick_ms = []
+    for minute in range(args.mongo_minutes):
+        t = time.perf_counter()
+        await reminders.tick(busiest + timedelta(minutes=minute))
+        tick_ms.append((time.perf_counter() - t) * 1000)
+    print(f"mongo ticks from the busiest minute: {', '.join(f'{ms:.0f}' for ms in tick_ms)} ms; "
+          f"sent {sender.sent} in {sender.calls} calls; {dict(reminders.counts)}")
+    client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--goal-rate", type=float, default=0.3, help="share of user-days at the water goal")
+    parser.add_argument("--workout-rate", type=float, default=0.4, help="share of user-days with a workout logged")
+    parser.add_argument("--mongo", action="store_true")
+    parser.add_argument("--mongo-minutes", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    t = time.perf_counter()
+    users = {f"user-{i:07d}": make_settings(rng, f"user-{i:07d}") for i in range(args.users)}
+    print(f"generated {args.users} users in {time.perf_counter() - t:.1f}s")
+    # Next Monday: the schedule's TTL index would drop entries dated in the past
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    start = today + timedelta(days=7 - today.weekday())
+    busiest = asyncio.run(bench_memory(args, users, start))
+    if args.mongo:
+        asyncio.run(bench_mongo(args, users, busiest))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Compares the per-day document layout with monthly buckets for water intake.
+
+Loads synthetic history for N users into a scratch database in both layouts,
+then reports document count, data/storage/index size and the latency of a
+90-day range read for random users. Also checks that the all-users range
+query of the nightly streak reconciliation (`water_goal_days`) is served by
+an index in both layouts.
+
+    python bench/bench_tracking_layout.py --users 100000 --days 365
+
+Requires MONGO_URL; writes to BENCH_DB_NAME (default: fat2fit_bench), which is
+dropped first.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import date, timedelta
+
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dates import to_day  # noqa: E402
+
+
+def generate(db, users: int, days: int, batch: int = 20000):
+    start = date.today() - timedelta(days=days)
+    docs, buckets = [], {}
+    for u in range(users):
+        user_id = str(uuid.UUID(int=u))
+        for d in range(days):
+            day = start + timedelta(days=d)
+            iso = day.isoformat()
+            glasses = random.randint(0, 12)
+            docs.append({"id": str(uuid.uuid4()), "user_id": user_id, "date": to_day(iso), "glasses": glasses, "goal": 8})
+            bucket = buckets.setdefault(iso[:7], {"_id": f"{user_id}:{iso[:7]}", "user_id": user_id,
+                                                  "month": iso[:7], "goal": 8, "days": {}})
+            bucket["days"][iso[8:]] = glasses
+            if len(docs) >= batch:
+                db.water_intake.insert_many(docs, ordered=False)
+                docs = []
+        db.water_buckets.insert_many(list(buckets.values()), ordered=False)
+        buckets = {}
+        if u and u % 10000 == 0:
+            print(f"  loaded {u} users")
+    if docs:
+        db.water_intake.insert_many(docs, ordered=False)
+
+
+def sizes(db, name: str) -> dict:
+    s = db.command("collStats", name)
+    return {"count": s["count"], "size_mb": s["size"] / 2**20,
+            "storage_mb": s["storageSize"] / 2**20, "index_mb": s["totalIndexSize"] / 2**20}
+
+
+def range_reads(db, users: int, days: int, samples: int, window: int = 90):
+    end = date.today() - timedelta(days=1)
+    first = end - timedelta(days=window - 1)
+    lo, hi = first.isoformat(), end.isoformat()
+    lo_day, hi_day = to_day(lo), to_day(hi)
+    timings = {"documents": [], "bucketed": []}
+    for _ in range(samples):
+        user_id = str(uuid.UUID(int=random.randrange(users)))
+
+        t = time.perf_counter()
+        rows = list(db.water_intake.find({"user_id": user_id, "date": {"$gte": lo_day, "$lte": hi_day}}, {"_id": 0}))
+        timings["documents"].append((time.perf_counter() - t) * 1000)
+
+        t = time.perf_counter()
+        got = list(db.water_buckets.find({"user_id": user_id, "month": {"$gte": lo[:7], "$lte": hi[:7]}}))
+        series = [(f"{b['month']}-{d}", v) for b in got for d, v in b["days"].items() if lo <= f"{b['month']}-{d}" <= hi]
+        timings["bucketed"].append((time.perf_counter() - t) * 1000)
+        assert len(series) == len(rows), (len(series), len(rows))
+    return timings
+
+
+def index_names(plan, winning: bool = False) -> set:
+    """Every indexName in the winning plans of an explain output, wherever the server nests them."""
+    if isinstance(plan, dict):
+        names = {plan["indexName"]} if winning and "indexName" in plan else set()
+        return names.union(*(index_names(v, winning or k == "winningPlan") for k, v in plan.items()
+                             if k != "rejectedPlans"))
+    if isinstance(plan, list):
+        return set().union(*(index_names(v, winning) for v in plan))
+    return set()
+
+
+def reconcile_plans(db, window: int = 7) -> dict:
+    """Index used by the leading $match of each layout's water_goal_days for one week."""
+    end = date.today() - timedelta(days=1)
+    lo, hi = (end - timedelta(days=window - 1)).isoformat(), end.isoformat()
+    matches = {
+        "documents": ("water_intake", {"date": {"$gte": to_day(lo), "$lte": to_day(hi)}}, "date_1"),
+        "bucketed": ("water_buckets", {"month": {"$gte": lo[:7], "$lte": hi[:7]}}, "month_1"),
+    }
+    used = {}
+    for layout, (name, match, index) in matches.items():
+        explain = db.command("aggregate", name, pipeline=[
+            {"$match": match}, {"$group": {"_id": "$user_id", "days": {"$sum": 1}}}], explain=True)
+        names = index_names(explain)
+        assert index in names, f"{layout} reconciliation does not use {index}: {names or 'collection scan'}"
+        used[layout] = index
+    return used
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--samples", type=int, default=2000)
+    args = parser.parse_args()
+
+    client = MongoClient(os.environ["MONGO_URL"])
+    client.drop_database(os.environ.get("BENCH_DB_NAME", "fat2fit_bench"))
+    db = client[os.environ.get("BENCH_DB_NAME", "fat2fit_bench")]
+    # Same indexes as DocumentTrackingStore / BucketedTrackingStore
+    db.water_intake.create_index([("user_id", 1), ("date", 1), ("glasses", 1), ("goal", 1), ("id", 1)])
+    db.water_intake.create_index("date")
+    db.water_buckets.create_index([("user_id", 1), ("month", -1)])
+    db.water_buckets.create_index("month")
+
+    print(f"Loading {args.users} users x {args.days} days...")
+    t = time.perf_counter()
+    generate(db, args.users, args.days)
+    print(f"Loaded in {time.perf_counter() - t:.1f}s\n")
+
+    print(f"{'layout':<10} {'docs':>12} {'data MB':>10} {'storage MB':>11} {'index MB':>9}")
+    for layout, name in (("documents", "water_intake"), ("bucketed", "water_buckets")):
+        s = sizes(db, name)
+        print(f"{layout:<10} {s['count']:>12} {s['size_mb']:>10.1f} {s['storage_mb']:>11.1f} {s['index_mb']:>9.1f}")
+
+    timings = range_reads(db, args.users, args.days, args.samples)
+    print(f"\n90-day range read over {args.samples} random users (ms)")
+    print(f"{'layout':<10} {'p50':>8} {'p95':>8} {'p99':>8} {'mean':>8}")
+    for layout, values in timings.items():
+        print(f"{layout:<10} {pct(values, .5):>8.2f} {pct(values, .95):>8.2f} {pct(values, .99):>8.2f} {statistics.mean(values):>8.2f}")
+
+    print("\nStreak reconciliation (water_goal_days) index")
+    for layout, index in reconcile_plans(db).items():
+        print(f"{layout:<10} {index}")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Load test for the admission controller on a simulated overloaded worker.
+
+Drives `AdmissionMiddleware` in-process with an open-loop mix of requests
+(arrivals don't wait for responses, like many phones retrying at once)
+against a fake app whose service time grows with concurrency, the way a
+worker's event loop and bcrypt/S3 thread pools do once they saturate:
+
+  - critical:  GET /api/water-intake, /api/dashboard (5 ms each when idle)
+  - normal:    GET /api/workout-logs (10 ms)
+  - sheddable: POST /api/auth/login (bcrypt, 250 ms), POST /api/progress-photos (150 ms)
+
+The offered load ramps from below capacity to `--overload` times capacity
+and back. Each run is repeated without admission control, and reports per
+class the share of requests that got a response within the client timeout
+(goodput), the 503 rate and latency percentiles, plus the limiter's counters.
+
+    python bench/load_admission.py --seconds 30 --overload 3
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from admission import AdaptiveLimit, AdmissionMiddleware, PriorityRoute, CRITICAL, SHEDDABLE  # noqa: E402
+
+# (method, path, share of traffic, idle service time in seconds)
+MIX = [
+    ("GET", "/api/water-intake", 0.35, 0.005),
+    ("GET", "/api/dashboard", 0.25, 0.005),
+    ("GET", "/api/workout-logs", 0.2, 0.010),
+    ("POST", "/api/auth/login", 0.12, 0.250),
+    ("POST", "/api/progress-photos", 0.08, 0.150),
+]
+ROUTES = [
+    PriorityRoute(CRITICAL, ("GET",), "/api/water-intake*"),
+    PriorityRoute(CRITICAL, ("GET",), "/api/dashboard"),
+    PriorityRoute(SHEDDABLE, ("POST",), "/api/progress-photos*"),
+    PriorityRoute(SHEDDABLE, ("POST",), "/api/auth/*"),
+]
+
+
+class SimulatedWorker:
+    """An ASGI app with `capacity` units of work per second: a request takes its
+    idle time while under `capacity` are running and proportionally longer above."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.inflight = 0
+
+    async def __call__(self, scope, receive, send):
+        self.inflight += 1
+        try:
+            await asyncio.sleep(scope["service"] * max(1.0, self.inflight / self.capacity))
+        finally:
+            self.inflight -= 1
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+
+def mean_service() -> float:
+    return sum(share * service for _, _, share, service in MIX)
+
+
+async def request(app, method: str, path: str, service: float, timeout: float, results, classify):
+    status = 0
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    scope = {"type": "http", "method": method, "path": path, "headers": [], "service": service}
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(app(scope, receive, send), timeout)
+    except asyncio.TimeoutError:
+        status = 0  # the client gave up; the work was wasted
+    results[classify(method, path)].append((status, time.perf_counter() - start))
+
+
+async def run(args, admission: bool) -> dict:
+    rng = random.Random(args.seed)
+    worker = SimulatedWorker(args.capacity)
+    limiter = AdaptiveLimit(initial=args.initial_limit, tolerance=args.tolerance)
+    middleware = AdmissionMiddleware(worker, ROUTES, limiter, enabled=admission)
+    results = defaultdict(list)
+    # Requests per second the worker can finish at its idle service times
+    capacity_rps = args.capacity / mean_service()
+    weights = [share for _, _, share, _ in MIX]
+    tasks = []
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < args.seconds:
+        # Ramp 0.5x -> overload -> 0.5x over the run
+        phase = 1 - abs(2 * elapsed / args.seconds - 1)
+        rate = capacity_rps * (0.5 + (args.overload - 0.5) * phase)
+        method, path, _, service = rng.choices(MIX, weights)[0]
+        tasks.append(asyncio.create_task(
+            request(middleware, method, path, service, args.timeout, results, middleware.classify)))
+        await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.gather(*tasks)
+    return {"results": results, "limiter": limiter.stats()}
+
+
+def report(name: str, outcome: dict):
+    print(f"\n{name}")
+    print(f"  {'class':<10} {'requests':>9} {'goodput':>8} {'503':>7} {'timeout':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for priority in ("critical", "normal", "sheddable"):
+        samples = outcome["results"].get(priority, [])
+        if not samples:
+            continue
+        ok = [seconds for status, seconds in samples if status == 200]
+        shed = sum(1 for status, _ in samples if status == 503)
+        timed_out = sum(1 for status, _ in samples if status == 0)
+        p50 = statistics.median(ok) * 1000 if ok else 0
+        p99 = sorted(ok)[int(len(ok) * 0.99)] * 1000 if ok else 0
+        print(f"  {priority:<10} {len(samples):>9} {len(ok) / len(samples):>8.1%} {shed / len(samples):>7.1%} "
+              f"{timed_out / len(samples):>8.1%} {p50:>8.1f} {p99:>8.1f}")
+    if outcome["limiter"]["admitted"]["critical"]:
+        print(f"  limiter: {outcome['limiter']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--capacity", type=int, default=16, help="requests the worker runs at full speed")
+    parser.add_argument("--overload", type=float, default=3.0, help="peak offered load / capacity")
+    parser.add_argument("--timeout", type=float, default=5.0, help="client timeout in seconds")
+    parser.add_argument("--initial-limit", type=int, default=64)
+    parser.add_argument("--tolerance", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"capacity {args.capacity} concurrent, ~{args.capacity / mean_service():.0f} req/s; "
+          f"peak offered load {args.overload}x over {args.seconds:.0f}s, client timeout {args.timeout}s")
+    report("without admission control", asyncio.run(run(args, admission=False)))
+    report("with admission control", asyncio.run(run(args, admission=True)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Cross-worker cache invalidation over MongoDB change streams.
+
+Each worker process tails one database-level change stream filtered to the
+collections its caches depend on, and calls the handlers registered for a
+collection with the owner of the changed document (`user_id`, or `id` for
+`users` and `workout_plans`). Writes made by any worker or pod, or directly
+in Mongo, thus evict the matching entries from every worker's local caches.
+
+The owner of an updated document comes from an `updateLookup`; for a delete
+it comes from the pre-image when the collection has
+`changeStreamPreAndPostImages` enabled (MongoDB 6.0+, attempted on start),
+otherwise handlers get `None` and drop everything they hold for that
+collection.
+
+The stream's resume token is kept after every batch, so a dropped connection
+or an elected primary resumes without missing events. If the token can't be
+resumed (it fell off the oplog) or the stream was down, events may have been
+missed and the reset handlers flush every cache. While the stream isn't
+running (including on a standalone mongod, which has no change streams),
+`ttl()` caps cache lifetimes at the fallback TTL.
+
+Needs a replica set; a single-node one is enough for local use:
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017 &
+    mongosh --eval 'rs.initiate()'
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+OWNER_FIELDS = {"users": "id", "workout_plans": "id"}
+# Resume tokens that can no longer be used; the stream restarts from now
+UNRESUMABLE = {260, 280, 286}  # InvalidResumeToken, ChangeStreamFatalError, ChangeStreamHistoryLost
+NO_CHANGE_STREAMS = 40573  # not a replica set / sharded cluster
+RETRY_MAX_SECONDS = 60.0
+
+
+class CacheBus:
+    def __init__(self, db, fallback_ttl: float = 30.0):
+        self.db = db
+        self.fallback_ttl = fallback_ttl
+        self._handlers: Dict[str, List[Callable[[Optional[str]], None]]] = defaultdict(list)
+        self._reset_handlers: List[Callable[[], None]] = []
+        self._token = None
+        self._task: Optional[asyncio.Task] = None
+        self.healthy = False
+        self.events = 0
+        self.resets = 0
+        self.errors = 0
+
+    def on(self, collections, handler: Callable[[Optional[str]], None]):
+        """Call `handler(owner_id)` when a document in any of `collections` changes."""
+        for name in [collections] if isinstance(collections, str) else collections:
+            self._handlers[name].append(handler)
+
+    def on_reset(self, handler: Callable[[], None]):
+        """Call `handler()` when changes may have been missed."""
+        self._reset_handlers.append(handler)
+
+    def ttl(self, ttl: float) -> float:
+        """`ttl` while invalidations are flowing, the fallback TTL otherwise."""
+        return ttl if self.healthy else min(ttl, self.fallback_ttl)
+
+    def _pipeline(self) -> list:
+        owners = {f"{doc}.{field}": 1 for doc in ("fullDocument", "fullDocumentBeforeChange")
+                  for field in ("id", "user_id")}
+        return [
+            {"$match": {"ns.coll": {"$in": list(self._handlers)},
+                        "operationType": {"$in": ["insert", "update", "replace", "delete"]}}},
+            {"$project": {"ns.coll": 1, "operationType": 1, **owners}},
+        ]
+
+    async def enable_pre_images(self, collections: Optional[Iterable[str]] = None):
+        """Best effort: lets deletes name their owner. Needs MongoDB 6.0+ and collMod rights."""
+        for name in collections or list(self._handlers):
+            try:
+                await self.db.command({"collMod": name, "changeStreamPreAndPostImages": {"enabled": True}})
+            except (PyMongoError, NotImplementedError) as e:
+                logger.info(f"Cache bus: no pre-images for {name} ({e}); deletes flush that cache")
+
+    def dispatch(self, change: dict):
+        name = change.get("ns", {}).get("coll")
+        field = OWNER_FIELDS.get(name, "user_id")
+        doc = change.get("fullDocument") or change.get("fullDocumentBeforeChange") or {}
+        owner = doc.get(field)
+        self.events += 1
+        for handler in self._handlers.get(name, []):
+            try:
+                handler(owner)
+            except Exception as e:
+                logger.error(f"Cache bus handler for {name} failed: {e}")
+
+    def reset(self):
+        self.resets += 1
+        for handler in self._reset_handlers:
+            try:
+                handler()
+            except Exception as e:
+                logger.error(f"Cache bus reset handler failed: {e}")
+
+    async def run(self):
+        delay = 1.0
+        missed = False
+        while True:
+            try:
+                async with self.db.watch(self._pipeline(), full_document="updateLookup",
+                                         full_document_before_change="whenAvailable",
+                                         resume_after=self._token, max_await_time_ms=1000) as stream:
+                    self.healthy = True
+                    delay = 1.0
+                    if missed:
+                        # Resumed from scratch after an outage: anything cached may be stale
+                        self.reset()
+                        missed = False
+                    while stream.alive:
+                        change = await stream.try_next()
+                        if change is not None:
+                            self.dispatch(change)
+                        self._token = stream.resume_token
+            except asyncio.CancelledError:
+                self.healthy = False
+                raise
+            except OperationFailure as e:
+                self.healthy = False
+                self.errors += 1
+                if e.code == NO_CHANGE_STREAMS:
+                    if delay < RETRY_MAX_SECONDS:
+                        logger.warning("Cache bus: change streams need a replica set; using the fallback TTL")
+                    delay = RETRY_MAX_SECONDS
+                elif e.code in UNRESUMABLE:
+                    logger.warning(f"Cache bus: resume token unusable ({e.code}); flushing caches")
+                    self._token = None
+                    missed = True
+                else:
+                    logger.error(f"Cache bus stream failed: {e}")
+                    missed = missed or self._token is None
+            except Exception as e:
+                self.healthy = False
+                self.errors += 1
+                logger.error(f"Cache bus stream failed: {e}")
+                missed = missed or self._token is None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX_SECONDS)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"healthy": self.healthy, "events": self.events, "resets": self.resets, "errors": self.errors}
@@ -6,13 +6,16 @@ from botocore.exceptions import ClientError
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 
+from photo_blobs import PhotoBlobs, is_content_addressed
+
 # Explicitly load .env from the same directory as this script
 load_dotenv(Path(__file__).parent / '.env')
 
 async def cleanup_database():
     """
     Cleans up the progress_photos collection to free up MongoDB disk space,
-    AND deletes the corresponding objects from S3.
+    AND deletes the corresponding objects from S3. Content-addressed objects are
+    reference-counted, so they are only deleted once no photo uses them.
     Run this locally after setting your env vars in a .env file.
     """
     mongo_url = os.environ.get('MONGO_URL')
@@ -37,12 +40,12 @@ async def cleanup_database():
         print("Nothing to clean up in MongoDB.")
     else:
         # 2. Collect all S3 URLs before deleting MongoDB docs
-        photos = await db.progress_photos.find({}, {"_id": 0, "photo_url": 1}).to_list(None)
+        photos = await db.progress_photos.find({}, {"_id": 1, "photo_url": 1}).to_list(None)
         s3_urls = [p["photo_url"] for p in photos if p.get("photo_url")]
 
-        # 3. Delete all MongoDB docs
+        # 3. Delete those MongoDB docs (photos added meanwhile keep their references)
         print("Deleting all progress photo documents from MongoDB...")
-        result = await db.progress_photos.delete_many({})
+        result = await db.progress_photos.delete_many({"_id": {"$in": [p["_id"] for p in photos]}})
         print(f"Deleted {result.deleted_count} documents from MongoDB.")
 
         # 4. Delete corresponding S3 objects
@@ -55,16 +58,24 @@ async def cleanup_database():
                 aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
             )
             prefix = f"https://{aws_bucket}.s3.{aws_region}.amazonaws.com/"
-            deleted = 0
+            blobs = PhotoBlobs(db.photo_blobs, s3, aws_bucket)
+            deleted = shared = 0
             for url in s3_urls:
                 try:
                     if url.startswith(prefix):
                         key = url[len(prefix):]
-                        s3.delete_object(Bucket=aws_bucket, Key=key)
-                        deleted += 1
+                        if is_content_addressed(key):
+                            # Drop this photo's reference; the object goes with the last one
+                            if await blobs.release(key) and await blobs.collect(key):
+                                deleted += 1
+                            else:
+                                shared += 1
+                        else:
+                            s3.delete_object(Bucket=aws_bucket, Key=key)
+                            deleted += 1
                 except ClientError as e:
                     print(f"  Warning: failed to delete {url}: {e}")
-            print(f"Deleted {deleted} objects from S3.")
+            print(f"Deleted {deleted} objects from S3 ({shared} references to shared objects released).")
         elif not aws_bucket:
             print("AWS_S3_BUCKET_NAME not set — skipping S3 cleanup.")
         else:
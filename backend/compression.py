@@ -0,0 +1,134 @@
+"""
+Response compression middleware (brotli or gzip).
+
+Picks the best encoding the client accepts: brotli when the optional `brotli`
+package is installed, otherwise gzip. Responses smaller than `minimum_size`,
+already-encoded responses and formats that don't compress (zip, images) are
+sent as they are. Streaming responses (e.g. the NDJSON export) are compressed
+chunk by chunk and flushed after each chunk, so they still stream.
+"""
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+SKIP_TYPES = ("application/zip", "image/", "video/", "audio/")
+
+
+class _Gzip:
+    name = "gzip"
+
+    def __init__(self, level: int):
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._z.compress(data) + self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._z.compress(data) + self._z.flush()
+
+
+class _Brotli:
+    name = "br"
+
+    def __init__(self, quality: int):
+        self._c = brotli.Compressor(quality=quality)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._c.process(data) + self._c.flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._c.process(data) + self._c.finish()
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Best supported coding with q > 0, preferring br over gzip on ties."""
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[coding.strip()] = q
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    scored = [(offered.get(c, offered.get("*", 0.0)), -i, c) for i, c in enumerate(candidates)]
+    q, _, coding = max(scored)
+    return coding if q > 0 else None
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        coding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+        encoder = _Brotli(self.brotli_quality) if coding == "br" else _Gzip(self.gzip_level)
+
+        start: Optional[Message] = None
+        passthrough = False
+        streaming = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, passthrough, streaming
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                passthrough = "content-encoding" in headers or content_type.startswith(SKIP_TYPES)
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body, more = message.get("body", b""), message.get("more_body", False)
+
+            if passthrough:
+                if start is not None:
+                    await send(start)
+                    start = None
+                await send(message)
+                return
+
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                headers.add_vary_header("Accept-Encoding")
+                if not more and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    start = None
+                    await send(message)
+                    return
+                headers["Content-Encoding"] = encoder.name
+                if more:
+                    streaming = True
+                    del headers["Content-Length"]
+                else:
+                    body = encoder.finish(body)
+                    headers["Content-Length"] = str(len(body))
+                await send(start)
+                start = None
+                if not streaming:
+                    await send({"type": "http.response.body", "body": body})
+                    return
+
+            data = encoder.chunk(body) if more else encoder.finish(body)
+            await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, send_compressed)
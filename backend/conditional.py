@@ -0,0 +1,61 @@
+"""
+Conditional GET for list endpoints.
+
+Each (user, list) pair has a watermark in the `watermarks` collection: a
+counter bumped after every write to that list. The weak ETag of a list is
+derived from the watermark alone, so a request carrying a matching
+`If-None-Match` is answered 304 after a single point read by `_id`, without
+running the list query.
+
+Writers must call `Watermarks.bump` *after* the write: a read that races the
+write then pairs fresh data with the old tag (a wasted download next time),
+never stale data with the new tag.
+"""
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+
+def weak_etag(*parts) -> str:
+    digest = hashlib.sha1(":".join(str(p) for p in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison against an If-None-Match header (list or "*")."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Return a 304 response if the client already has `etag`; otherwise set the
+    ETag on the outgoing response and return None."""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+class Watermarks:
+    def __init__(self, collection):
+        self.col = collection
+
+    async def get(self, user_id: str, name: str) -> int:
+        doc = await self.col.find_one({"_id": f"{user_id}:{name}"}, {"v": 1})
+        return doc["v"] if doc else 0
+
+    async def bump(self, user_id: str, name: str):
+        await self.col.update_one(
+            {"_id": f"{user_id}:{name}"},
+            {"$inc": {"v": 1}, "$setOnInsert": {"user_id": user_id}}, upsert=True,
+        )
+
+    async def etag(self, user_id: str, name: str, *extra) -> str:
+        """`extra` covers anything else the response depends on (e.g. the storage layout)."""
+        return weak_etag(user_id, name, await self.get(user_id, name), *extra)
@@ -0,0 +1,232 @@
+"""
+User-customised workout plans, stored copy-on-write against a template.
+
+A custom plan document keeps only what differs from its template:
+
+    {id, user_id, template_id, name, version, diff: {
+        "fields": {"name": "My PPL"},                         # top-level overrides
+        "days": {"1": {"name": ..., "exercises": {"2": {"weight_kg": 70}, "4": None},
+                       "replaced": {"3": <whole exercise>},
+                       "extra": [<appended exercise>, ...]},
+                 "3": None},                                  # day removed
+        "added_days": [<full day>, ...],
+    }}
+
+An edited exercise (same name, no field dropped) stores only the changed
+fields; a different exercise in the same position is stored whole under
+`replaced`, so it doesn't inherit the template's weight, notes or equipment.
+
+`resolve` rebuilds the effective plan from template + diff; results are cached
+per (plan id, version) so repeated reads cost one small document fetch.
+`update` writes conditionally on the version it read and retries on a
+concurrent edit, raising `PlanConflict` if it keeps losing.
+Templates are the seeded plans and rarely change, so they are cached until a
+change to `workout_plans` calls `invalidate_templates` (see cache_bus.py), or
+for at most `templates_ttl()` seconds, which falls back to a short TTL while
+change streams aren't available.
+"""
+import copy
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from dates import to_api, utc_now
+
+PLAN_FIELDS = ("name", "description", "days_per_week", "duration_weeks")
+EXERCISE_FIELDS = ("name", "sets", "reps", "weight_kg", "muscle_group", "rest_seconds", "notes", "equipment")
+LIST_FIELDS = {"_id": 0, "id": 1, "template_id": 1, "name": 1, "version": 1, "updated_at": 1}
+UPDATE_ATTEMPTS = 3
+TEMPLATES_TTL_SECONDS = 3600.0
+
+
+class PlanConflict(Exception):
+    """Raised by `update` when concurrent edits kept changing the plan under it."""
+
+
+def _exercise(ex: dict) -> dict:
+    return {k: ex[k] for k in EXERCISE_FIELDS if k in ex}
+
+
+def compute_diff(template: dict, plan: dict) -> dict:
+    """Smallest diff (in this format) that turns `template` into `plan`."""
+    diff: Dict = {"fields": {}, "days": {}, "added_days": []}
+    for f in PLAN_FIELDS:
+        if f in plan and plan[f] != template.get(f):
+            diff["fields"][f] = plan[f]
+
+    wanted = {d["day"]: d for d in plan.get("days", [])}
+    for base in template.get("days", []):
+        day = wanted.pop(base["day"], None)
+        if day is None:
+            diff["days"][str(base["day"])] = None
+            continue
+        change: Dict = {}
+        if day.get("name", base.get("name")) != base.get("name"):
+            change["name"] = day["name"]
+        exercises: Dict = {}
+        replaced: Dict = {}
+        base_ex, new_ex = base.get("exercises", []), day.get("exercises", [])
+        for i, old in enumerate(base_ex):
+            if i >= len(new_ex):
+                exercises[str(i)] = None
+                continue
+            new = _exercise(new_ex[i])
+            if new.get("name") != old.get("name") or set(_exercise(old)) - set(new):
+                replaced[str(i)] = new
+                continue
+            delta = {k: v for k, v in new.items() if old.get(k) != v}
+            if delta:
+                exercises[str(i)] = delta
+        if exercises:
+            change["exercises"] = exercises
+        if replaced:
+            change["replaced"] = replaced
+        if len(new_ex) > len(base_ex):
+            change["extra"] = [_exercise(e) for e in new_ex[len(base_ex):]]
+        if change:
+            diff["days"][str(base["day"])] = change
+    diff["added_days"] = [
+        {"day": d["day"], "name": d.get("name"), "exercises": [_exercise(e) for e in d.get("exercises", [])]}
+        for d in sorted(wanted.values(), key=lambda d: d["day"])
+    ]
+    return {k: v for k, v in diff.items() if v}
+
+
+def apply_diff(template: dict, diff: dict) -> dict:
+    plan = copy.deepcopy(template)
+    plan.update(diff.get("fields", {}))
+    days = []
+    for base in plan.get("days", []):
+        key = str(base["day"])
+        if key in diff.get("days", {}) and diff["days"][key] is None:
+            continue
+        change = diff.get("days", {}).get(key) or {}
+        if "name" in change:
+            base["name"] = change["name"]
+        edits, replaced = change.get("exercises", {}), change.get("replaced", {})
+        exercises = []
+        for i, ex in enumerate(base.get("exercises", [])):
+            if str(i) in replaced:
+                ex = copy.deepcopy(replaced[str(i)])
+            elif str(i) in edits:
+                if edits[str(i)] is None:
+                    continue
+                ex.update(edits[str(i)])
+            exercises.append(ex)
+        base["exercises"] = exercises + copy.deepcopy(change.get("extra", []))
+        days.append(base)
+    days.extend(copy.deepcopy(diff.get("added_days", [])))
+    plan["days"] = sorted(days, key=lambda d: d["day"])
+    return plan
+
+
+class CustomPlans:
+    def __init__(self, db, max_cached: int = 5000,
+                 templates_ttl: Callable[[], float] = lambda: TEMPLATES_TTL_SECONDS):
+        self.col = db.custom_plans
+        self.templates_col = db.workout_plans
+        self.max_cached = max_cached
+        self.templates_ttl = templates_ttl
+        self._templates: Dict[str, dict] = {}
+        self._templates_loaded_at: Optional[float] = None
+        self._resolved: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+
+    async def ensure_indexes(self):
+        await self.col.create_index("id", unique=True)
+        await self.col.create_index([("user_id", 1), ("updated_at", -1)])
+
+    def _expire_templates(self):
+        loaded_at = self._templates_loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at > self.templates_ttl():
+            self.invalidate_templates()
+
+    async def template(self, template_id: str) -> Optional[dict]:
+        self._expire_templates()
+        if template_id not in self._templates:
+            doc = await self.templates_col.find_one({"id": template_id}, {"_id": 0})
+            if not doc:
+                return None
+            if self._templates_loaded_at is None:
+                self._templates_loaded_at = time.monotonic()
+            self._templates[template_id] = doc
+        return self._templates[template_id]
+
+    def invalidate_templates(self):
+        """Forget cached templates and everything resolved from them."""
+        self._templates.clear()
+        self._templates_loaded_at = None
+        self._resolved.clear()
+
+    async def resolve(self, doc: dict) -> Optional[dict]:
+        self._expire_templates()
+        key = (doc["id"], doc["version"])
+        cached = self._resolved.get(key)
+        if cached is not None:
+            self.hits += 1
+            self._resolved.move_to_end(key)
+            return copy.deepcopy(cached)
+        self.misses += 1
+        template = await self.template(doc["template_id"])
+        if template is None:
+            return None
+        plan = apply_diff(template, doc.get("diff", {}))
+        plan.update(id=doc["id"], template_id=doc["template_id"], custom=True, version=doc["version"])
+        self._resolved[key] = plan
+        while len(self._resolved) > self.max_cached:
+            self._resolved.popitem(last=False)
+        return copy.deepcopy(plan)
+
+    async def fork(self, user_id: str, template_id: str, name: Optional[str] = None) -> Optional[dict]:
+        template = await self.template(template_id)
+        if template is None:
+            return None
+        diff = {"fields": {"name": name}} if name and name != template.get("name") else {}
+        now = utc_now()
+        doc = {"id": str(uuid.uuid4()), "user_id": user_id, "template_id": template_id,
+               "name": name or template.get("name"), "version": 1, "diff": diff,
+               "created_at": now, "updated_at": now}
+        await self.col.insert_one(doc.copy())
+        return doc
+
+    async def get(self, user_id: str, plan_id: str) -> Optional[dict]:
+        return await self.col.find_one({"id": plan_id, "user_id": user_id}, {"_id": 0})
+
+    async def list(self, user_id: str, limit: int = 100) -> List[dict]:
+        docs = await self.col.find({"user_id": user_id}, LIST_FIELDS).sort("updated_at", -1).to_list(limit)
+        return [to_api(d) for d in docs]
+
+    async def update(self, user_id: str, plan_id: str, changes: dict) -> Optional[dict]:
+        """Overlay `changes` (any of PLAN_FIELDS and `days`) on the current plan and store the new diff."""
+        for _ in range(UPDATE_ATTEMPTS):
+            doc = await self.get(user_id, plan_id)
+            if not doc:
+                return None
+            current = await self.resolve(doc)
+            template = await self.template(doc["template_id"])
+            if current is None or template is None:
+                return None
+            current.update(changes)
+            diff = compute_diff(template, current)
+            # Conditional on the version read, so a concurrent edit is re-read, not overwritten
+            updated = await self.col.find_one_and_update(
+                {"id": plan_id, "user_id": user_id, "version": doc["version"]},
+                {"$set": {"diff": diff, "name": current.get("name"), "updated_at": utc_now()}, "$inc": {"version": 1}},
+                projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+            )
+            if updated:
+                return updated
+            self.conflicts += 1
+        raise PlanConflict(f"Plan {plan_id} kept changing during the update")
+
+    async def delete(self, user_id: str, plan_id: str) -> bool:
+        result = await self.col.delete_one({"id": plan_id, "user_id": user_id})
+        return result.deleted_count > 0
+
+    def stats(self) -> dict:
+        return {"cached": len(self._resolved), "hits": self.hits, "misses": self.misses, "conflicts": self.conflicts}
@@ -0,0 +1,67 @@
+"""
+Date handling between the API and Mongo.
+
+Documents store `date` as a BSON date (midnight UTC of the calendar day) and
+timestamps such as `created_at` as BSON datetimes; the API keeps speaking
+"YYYY-MM-DD" and ISO-8601 strings. Convert with `to_day` on the way in and
+`to_api` on the way out. Run `migrate_dates.py`, with the API stopped, to
+convert existing string fields before starting this version.
+"""
+from datetime import datetime, timezone
+from typing import Annotated, Iterable, Optional
+
+from pydantic import AfterValidator, StringConstraints
+
+DAY_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+DAY_FIELDS = ("date",)
+TIME_FIELDS = ("created_at", "updated_at")
+
+
+def utc_now() -> datetime:
+    """Current time at the millisecond precision BSON keeps, so a response built
+    from it matches the same document read back later."""
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def to_day(value: str) -> datetime:
+    """'2024-05-03' -> 2024-05-03T00:00:00Z. Raises ValueError."""
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+
+def valid_day(value: str) -> str:
+    """Validator for request fields: 'YYYY-MM-DD' must also be a real calendar day."""
+    try:
+        to_day(value)
+    except ValueError:
+        raise ValueError("Not a valid calendar date")
+    return value
+
+
+# A "YYYY-MM-DD" request field; '2026-02-30' is a 422 rather than a 500 from `to_day`
+Day = Annotated[str, StringConstraints(pattern=DAY_PATTERN), AfterValidator(valid_day)]
+
+
+def day_str(value) -> Optional[str]:
+    return value.strftime("%Y-%m-%d") if isinstance(value, datetime) else value
+
+
+def iso(value) -> Optional[str]:
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return value
+
+
+def to_api(doc: Optional[dict], days: Iterable[str] = DAY_FIELDS, times: Iterable[str] = TIME_FIELDS) -> Optional[dict]:
+    """Render a document's date fields as strings (in place). Values that are
+    already strings, e.g. from rows not yet migrated, are left alone."""
+    if doc:
+        for f in days:
+            if f in doc:
+                doc[f] = day_str(doc[f])
+        for f in times:
+            if f in doc:
+                doc[f] = iso(doc[f])
+    return doc
@@ -0,0 +1,162 @@
+"""
+Exercise index for plan search.
+
+Plans nest `days[].exercises[]`, which Mongo can only filter by scanning every
+plan. `ExerciseIndex` flattens each plan into one small row per exercise in
+`exercise_index`, with normalised muscle groups, level and equipment, and
+compound indexes on the filter fields. Template rows carry a digest of the
+templates they were built from and are rebuilt on startup when it no longer
+matches; other plans are re-indexed whenever they are saved, so search cost
+depends on the number of matches rather than the number of plans.
+"""
+import hashlib
+import json
+import re
+from typing import Iterable, List, Optional
+
+# Bump when the row derivation changes; startup re-indexes the templates.
+INDEX_VERSION = 1
+
+# Specific muscles also match their broader group (searching "legs" finds quads)
+MUSCLE_PARENTS = {
+    "quads": "legs", "hamstrings": "legs", "glutes": "legs", "calves": "legs",
+    "biceps": "arms", "triceps": "arms",
+    "upper chest": "chest", "rear delts": "shoulders",
+    "posterior chain": "back",
+}
+
+# First match wins; checked against the lowercased exercise name
+EQUIPMENT_KEYWORDS = [
+    ("barbell", ("barbell", "bench press", "close grip bench", "deadlift", "squat", "pendlay", "t-bar",
+                 "power clean", "hip thrust", "overhead press")),
+    ("dumbbell", ("dumbbell", "db ", "arnold", "hammer", "concentration", "lateral raise", "reverse fly",
+                  "split squat", "lunge", "curls", "tricep extension")),
+    ("cable", ("cable", "pulldown", "pushdown", "face pull", "rope")),
+    ("machine", ("leg press", "leg curl", "leg extension", "calf raise")),
+    ("bodyweight", ("plank", "crunch", "pull-up", "dips", "ab wheel", "push-up")),
+]
+
+EQUIPMENT = [name for name, _ in EQUIPMENT_KEYWORDS]
+LEVELS = ["beginner", "intermediate", "advanced"]
+GROUP_BY = ("exercise", "day", "plan")
+
+
+def muscle_groups(value: Optional[str]) -> List[str]:
+    groups = []
+    for part in (value or "").split("/"):
+        part = part.strip().lower()
+        if part:
+            groups.append(part)
+            if part in MUSCLE_PARENTS:
+                groups.append(MUSCLE_PARENTS[part])
+    return sorted(set(groups))
+
+
+def infer_equipment(exercise: dict) -> str:
+    if exercise.get("equipment"):
+        return exercise["equipment"].lower()
+    name = exercise.get("name", "").lower() + " "
+    for equipment, keywords in EQUIPMENT_KEYWORDS:
+        if any(k in name for k in keywords):
+            return equipment
+    return "other"
+
+
+def templates_digest(plans: Iterable[dict]) -> str:
+    """Hash of the template contents and INDEX_VERSION; changes when either does."""
+    plans = sorted(plans, key=lambda plan: plan.get("id") or "")
+    body = json.dumps([INDEX_VERSION, plans], sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def index_rows(plan: dict, owner_id: Optional[str] = None) -> List[dict]:
+    rows = []
+    for day in plan.get("days", []):
+        for position, exercise in enumerate(day.get("exercises", [])):
+            rows.append({
+                "v": INDEX_VERSION, "owner_id": owner_id,
+                "plan_id": plan["id"], "plan_name": plan.get("name"), "level": (plan.get("level") or "").lower(),
+                "day": day.get("day"), "day_name": day.get("name"), "position": position,
+                "name": exercise.get("name"), "name_lc": exercise.get("name", "").lower(),
+                "muscle_group": exercise.get("muscle_group"), "muscles": muscle_groups(exercise.get("muscle_group")),
+                "equipment": infer_equipment(exercise),
+                "sets": exercise.get("sets"), "reps": exercise.get("reps"), "weight_kg": exercise.get("weight_kg"),
+            })
+    return rows
+
+
+class ExerciseIndex:
+    EXERCISE_FIELDS = {"_id": 0, "plan_id": 1, "day": 1, "name": 1, "muscle_group": 1,
+                       "equipment": 1, "sets": 1, "reps": 1, "weight_kg": 1}
+
+    def __init__(self, collection):
+        self.col = collection
+
+    async def ensure_indexes(self):
+        # Every query also filters on owner_id (templates + the caller's own plans)
+        await self.col.create_index([("muscles", 1), ("owner_id", 1), ("level", 1)])
+        await self.col.create_index([("equipment", 1), ("owner_id", 1), ("level", 1)])
+        await self.col.create_index([("owner_id", 1), ("level", 1), ("plan_id", 1)])
+        await self.col.create_index([("plan_id", 1), ("day", 1), ("position", 1)])
+
+    async def index_plan(self, plan: dict, owner_id: Optional[str] = None):
+        """Replace the rows of one plan. Call whenever a plan is created or edited."""
+        await self.col.delete_many({"plan_id": plan["id"]})
+        rows = index_rows(plan, owner_id)
+        if rows:
+            await self.col.insert_many(rows)
+
+    async def remove_plan(self, plan_id: str):
+        await self.col.delete_many({"plan_id": plan_id})
+
+    async def index_templates(self, plans: Iterable[dict]) -> bool:
+        """(Re)build the template rows unless they were built from exactly these plans
+        (same contents and INDEX_VERSION). Returns whether it rebuilt."""
+        plans = list(plans)
+        digest = templates_digest(plans)
+        if await self.col.find_one({"owner_id": None, "digest": digest}):
+            return False
+        await self.col.delete_many({"owner_id": None})
+        rows = [dict(row, digest=digest) for plan in plans for row in index_rows(plan)]
+        if rows:
+            await self.col.insert_many(rows)
+        return True
+
+    async def search(self, user_id: Optional[str] = None, muscle: Optional[str] = None,
+                     level: Optional[str] = None, equipment: Optional[str] = None, q: Optional[str] = None,
+                     group_by: str = "exercise", limit: int = 50) -> List[dict]:
+        """Matching exercises, or the days / plans that contain them."""
+        query = {"owner_id": {"$in": [None, user_id]} if user_id else None}
+        if muscle:
+            query["muscles"] = muscle.lower()
+        if level:
+            query["level"] = level.lower()
+        if equipment:
+            query["equipment"] = equipment.lower()
+        if q:
+            query["name_lc"] = {"$regex": re.escape(q.lower())}
+
+        if group_by == "exercise":
+            cursor = self.col.find(query, self.EXERCISE_FIELDS).sort([("plan_id", 1), ("day", 1), ("position", 1)])
+            return await cursor.to_list(limit)
+
+        if group_by == "day":
+            group = {"_id": {"plan_id": "$plan_id", "day": "$day"}, "plan_name": {"$first": "$plan_name"},
+                     "day_name": {"$first": "$day_name"}, "exercises": {"$push": "$name"}}
+            fields = {"plan_id": "$_id.plan_id", "plan_name": 1, "day": "$_id.day", "day_name": 1, "exercises": 1}
+        else:
+            group = {"_id": {"plan_id": "$plan_id"}, "plan_name": {"$first": "$plan_name"},
+                     "level": {"$first": "$level"}, "days": {"$addToSet": "$day"}, "matches": {"$sum": 1}}
+            fields = {"plan_id": "$_id.plan_id", "plan_name": 1, "level": 1, "days": 1, "matches": 1}
+        rows = await self.col.aggregate([
+            {"$match": query},
+            {"$sort": {"plan_id": 1, "day": 1, "position": 1}},
+            {"$group": group},
+            {"$sort": {"_id.plan_id": 1, "_id.day": 1}},
+            {"$limit": limit},
+            {"$project": {"_id": 0, **fields}},
+        ]).to_list(limit)
+        for row in rows:
+            if "days" in row:
+                row["days"].sort()
+        return rows
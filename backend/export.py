@@ -0,0 +1,149 @@
+"""
+Streaming export of a user's full history (GDPR data requests).
+
+Documents are read with Mongo cursors in `_id` order and written out as they
+arrive, so memory stays flat however long the history is. NDJSON lines carry a
+`cursor` token; passing the last one back as `?cursor=` resumes an interrupted
+export right after that record. The CSV variant streams a zip with one CSV per
+collection and always starts from the beginning.
+"""
+import csv
+import io
+import json
+import zipfile
+from datetime import datetime
+from typing import AsyncIterator, Optional, Tuple, Union
+
+from bson import ObjectId
+
+from dates import iso, to_api
+
+# (collection, field holding the owner's id)
+EXPORT_COLLECTIONS = [
+    ("users", "id"),
+    ("weight_entries", "user_id"),
+    ("water_intake", "user_id"),
+    ("weight_buckets", "user_id"),
+    ("water_buckets", "user_id"),
+    ("workout_logs", "user_id"),
+    ("custom_plans", "user_id"),
+    ("progress_photos", "user_id"),
+]
+
+EXCLUDED_FIELDS = {"password_hash": 0, "photo_base64": 0}
+
+CSV_FIELDS = {
+    "users": ["id", "name", "email", "height_cm", "weight_kg", "age", "gender", "goal", "created_at"],
+    "weight_entries": ["id", "date", "weight", "created_at"],
+    "water_intake": ["id", "date", "glasses", "goal"],
+    "weight_buckets": ["month", "days"],
+    "water_buckets": ["month", "goal", "days"],
+    "workout_logs": ["id", "date", "plan_name", "day_name", "exercises", "created_at"],
+    "custom_plans": ["id", "template_id", "name", "version", "diff", "created_at", "updated_at"],
+    "progress_photos": ["id", "date", "note", "photo_url", "created_at"],
+}
+
+BATCH_SIZE = 500
+FLUSH_BYTES = 64 * 1024
+
+
+def _json_default(value):
+    return iso(value) if isinstance(value, datetime) else str(value)
+
+
+def parse_cursor(token: Optional[str]) -> Optional[Tuple[int, Union[ObjectId, str]]]:
+    """Turn a `collection:_id` token into (collection index, last _id). Raises ValueError."""
+    if not token:
+        return None
+    name, _, last_id = token.partition(":")
+    names = [c for c, _ in EXPORT_COLLECTIONS]
+    if name not in names:
+        raise ValueError("Unknown collection in cursor")
+    if not last_id:
+        raise ValueError("Malformed cursor")
+    # Bucket documents use string ids ("<user>:<month>"); everything else uses ObjectIds
+    return names.index(name), ObjectId(last_id) if ObjectId.is_valid(last_id) else last_id
+
+
+async def iter_documents(db, user_id: str, resume: Optional[Tuple[int, Union[ObjectId, str]]] = None) -> AsyncIterator[Tuple[str, dict]]:
+    """Yield (collection, document) pairs for every document the user owns."""
+    start = resume[0] if resume else 0
+    for i, (name, owner_field) in enumerate(EXPORT_COLLECTIONS[start:], start):
+        query = {owner_field: user_id}
+        if resume and i == resume[0]:
+            query["_id"] = {"$gt": resume[1]}
+        cursor = db[name].find(query, EXCLUDED_FIELDS).sort("_id", 1).batch_size(BATCH_SIZE)
+        async for doc in cursor:
+            yield name, to_api(doc)
+
+
+async def stream_ndjson(db, user_id: str, resume=None) -> AsyncIterator[bytes]:
+    buf = []
+    size = 0
+    async for name, doc in iter_documents(db, user_id, resume):
+        token = f"{name}:{doc.pop('_id')}"
+        line = json.dumps({"collection": name, "cursor": token, "record": doc}, default=_json_default) + "\n"
+        buf.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield "".join(buf).encode()
+            buf, size = [], 0
+    buf.append(json.dumps({"done": True}) + "\n")
+    yield "".join(buf).encode()
+
+
+class _ZipSink(io.RawIOBase):
+    """Unseekable write target; zipfile then streams entries with data descriptors."""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+        self.pending = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        self.pending += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.pending = 0
+        return data
+
+
+def _csv_row(fields, doc) -> bytes:
+    out = io.StringIO()
+    row = []
+    for f in fields:
+        value = doc.get(f)
+        row.append(json.dumps(value, default=_json_default) if isinstance(value, (list, dict)) else value)
+    csv.writer(out).writerow(row)
+    return out.getvalue().encode()
+
+
+async def stream_csv_zip(db, user_id: str) -> AsyncIterator[bytes]:
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED)
+    entry, current = None, None
+    async for name, doc in iter_documents(db, user_id):
+        if name != current:
+            if entry:
+                entry.close()
+            current = name
+            entry = archive.open(f"{name}.csv", mode="w", force_zip64=True)
+            entry.write(_csv_row(CSV_FIELDS[name], {f: f for f in CSV_FIELDS[name]}))  # header
+        entry.write(_csv_row(CSV_FIELDS[name], doc))
+        if sink.pending >= FLUSH_BYTES:
+            yield sink.drain()
+    if entry:
+        entry.close()
+    archive.close()
+    yield sink.drain()
@@ -0,0 +1,185 @@
+"""
+Idempotency-Key support for mutating endpoints.
+
+The first response for a (user, route, key) triple is stored and replayed for
+retries, so a mobile client retrying `POST /workout-logs` or a photo upload
+does not create duplicates. Concurrent duplicates inside one worker share a
+single execution; across workers a pending record makes the loser return 409.
+A pending record is only held for `pending_seconds`: if its worker crashed
+mid-execution, a retry with the same body takes the key over after that.
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
+
+PENDING = "pending"
+DONE = "done"
+
+
+class IdempotencyStore:
+    """Interface for idempotency record backends."""
+
+    async def claim(self, key: str, fingerprint: str) -> Optional[dict]:
+        """Atomically create a pending record, or take over one whose lease has
+        passed. Returns None when the caller now owns the key, otherwise the
+        existing record."""
+        raise NotImplementedError
+
+    async def complete(self, key: str, body: Any):
+        raise NotImplementedError
+
+    async def release(self, key: str):
+        """Drop a pending record after a failed execution so the client may retry."""
+        raise NotImplementedError
+
+    async def ensure_indexes(self):
+        pass
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """Per-process LRU. Good for single-worker deployments and tests."""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: int = 86400, pending_seconds: float = 60):
+        self._records: "OrderedDict[str, dict]" = OrderedDict()
+        self._max = max_entries
+        self._ttl = ttl_seconds
+        self._pending = pending_seconds
+
+    async def claim(self, key: str, fingerprint: str) -> Optional[dict]:
+        now = time.monotonic()
+        record = self._records.get(key)
+        if record and now - record["ts"] < self._ttl:
+            self._records.move_to_end(key)
+            if record["status"] == PENDING and record["fingerprint"] == fingerprint and record["pending_until"] <= now:
+                record["pending_until"] = now + self._pending
+                return None
+            return record
+        self._records[key] = {"status": PENDING, "fingerprint": fingerprint, "ts": now,
+                              "pending_until": now + self._pending}
+        self._records.move_to_end(key)
+        while len(self._records) > self._max:
+            self._records.popitem(last=False)
+        return None
+
+    async def complete(self, key: str, body: Any):
+        record = self._records.get(key)
+        if record:
+            record.update(status=DONE, body=body)
+
+    async def release(self, key: str):
+        self._records.pop(key, None)
+
+
+class MongoIdempotencyStore(IdempotencyStore):
+    """Records in a collection whose TTL index expires them after `ttl_seconds`."""
+
+    def __init__(self, collection, ttl_seconds: int = 86400, pending_seconds: float = 60):
+        self._col = collection
+        self._ttl = ttl_seconds
+        self._pending = timedelta(seconds=pending_seconds)
+
+    async def ensure_indexes(self):
+        await self._col.create_index("created_at", expireAfterSeconds=self._ttl)
+
+    async def claim(self, key: str, fingerprint: str) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        try:
+            await self._col.insert_one({
+                "_id": key, "status": PENDING, "fingerprint": fingerprint,
+                "created_at": now, "pending_until": now + self._pending,
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+        # The owner crashed mid-execution: a retry with the same body takes over
+        taken = await self._col.update_one(
+            {"_id": key, "status": PENDING, "fingerprint": fingerprint, "pending_until": {"$lte": now}},
+            {"$set": {"pending_until": now + self._pending}},
+        )
+        if taken.matched_count:
+            return None
+        return await self._col.find_one({"_id": key})
+
+    async def complete(self, key: str, body: Any):
+        await self._col.update_one({"_id": key}, {"$set": {"status": DONE, "body": body}})
+
+    async def release(self, key: str):
+        await self._col.delete_one({"_id": key, "status": PENDING})
+
+
+def fingerprint(payload: Any) -> str:
+    if isinstance(payload, BaseModel):
+        raw = payload.model_dump_json()
+    else:
+        raw = repr(payload)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class Idempotency:
+    def __init__(self, store: IdempotencyStore):
+        self.store = store
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self.replayed = 0
+        self.coalesced = 0
+
+    async def run(
+        self,
+        key: Optional[str],
+        user_id: str,
+        route: str,
+        payload: Any,
+        execute: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """Run `execute` once per Idempotency-Key; requests without a key run as usual."""
+        if not key:
+            return await execute()
+
+        scoped = f"{user_id}:{route}:{key}"
+        fp = fingerprint(payload)
+        inflight = self._inflight.get(scoped)
+        if inflight:
+            if inflight[0] != fp:
+                raise HTTPException(status_code=422, detail="Idempotency-Key reused with a different request body")
+            self.coalesced += 1
+            return await asyncio.shield(inflight[1])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[scoped] = (fp, future)
+        try:
+            body = await self._execute_once(scoped, fp, execute)
+            future.set_result(body)
+            return body
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; don't log it as unretrieved
+            raise
+        finally:
+            del self._inflight[scoped]
+
+    async def _execute_once(self, scoped: str, fp: str, execute: Callable[[], Awaitable[Any]]) -> Any:
+        existing = await self.store.claim(scoped, fp)
+        if existing:
+            if existing["fingerprint"] != fp:
+                raise HTTPException(status_code=422, detail="Idempotency-Key reused with a different request body")
+            if existing["status"] != DONE:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress")
+            self.replayed += 1
+            return existing["body"]
+        try:
+            body = jsonable_encoder(await execute())
+        except BaseException:
+            await self.store.release(scoped)
+            raise
+        await self.store.complete(scoped, body)
+        return body
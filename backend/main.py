@@ -1,11 +1,13 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Header, Query, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import json
+import time
+import asyncio
 import logging
-import base64
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional
@@ -14,15 +16,48 @@ from datetime import datetime, timezone, timedelta
 import jwt
 import bcrypt
 import boto3
-from botocore.exceptions import ClientError
-from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
+from google.auth import jwt as google_jwt
+from rate_limit import RateLimitMiddleware, Rule, per_minute
+from admission import AdaptiveLimit, AdmissionMiddleware, PriorityRoute, CRITICAL, SHEDDABLE
+from idempotency import Idempotency, MemoryIdempotencyStore, MongoIdempotencyStore
+from read_cache import CachedValue, UserReadCache
+from cache_bus import CacheBus
+from users import UserRepository
+import export
+import rollups
+from account_deletion import AccountDeleter
+from tasks import TaskQueue, MemoryJobStore, MongoJobStore
+from tracking import make_tracking_store
+from exercises import ExerciseIndex, GROUP_BY
+from custom_plans import CustomPlans, PlanConflict
+from overload import ProgressionEngine
+from compression import CompressionMiddleware
+from photo_blobs import PhotoBlobs, content_key, decode_base64, is_content_addressed
+from photo_uploads import CONTENT_TYPES as PHOTO_CONTENT_TYPES, SHA256_PATTERN, PhotoUploads, UploadError
+from conditional import Watermarks, not_modified, weak_etag
+from dates import Day, iso, to_api, to_day, utc_now
+from request_log import AccessLogMiddleware, MongoCommandMonitor, instrument_boto3, setup_logging, track
+from profiler import FORMATS as PROFILE_FORMATS, Profiler, ProfilerBusy, ProfilingMiddleware
+from reminders import (MemoryReminderStore, MongoReminderStore, Reminders, KINDS as REMINDER_KINDS, TIME_PATTERN,
+                       make_sender, next_due, spread_days)
+from streaks import (KINDS as LEADERBOARD_KINDS, MAX_LIMIT as LEADERBOARD_MAX_LIMIT, MAX_RADIUS as LEADERBOARD_MAX_RADIUS,
+                     WEEK_PATTERN, MemoryLeaderboardStore, MongoLeaderboardStore, Streaks, week_of, week_start)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# --- Logging ---
+# Records go through a queue to a background thread; LOG_FORMAT=text for the
+# plain format. Access records are sampled, errors and slow requests are not.
+log_listener = setup_logging(fmt=os.environ.get('LOG_FORMAT', 'json'))
+logger = logging.getLogger(__name__)
+ACCESS_LOG_SAMPLE_RATE = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', '1.0'))
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '1000'))
+mongo_monitor = MongoCommandMonitor(slow_ms=float(os.environ.get('SLOW_QUERY_MS', '100')))
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[mongo_monitor])
 db = client[os.environ['DB_NAME']]
 
 SECRET_KEY = os.environ.get('JWT_SECRET')
@@ -32,6 +67,7 @@ if not SECRET_KEY:
 ALGORITHM = "HS256"
 TOKEN_EXPIRE_HOURS = 72
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 # --- S3 Config ---
 AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
@@ -42,8 +78,165 @@ s3_client = boto3.client(
     aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
     aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
 )
+instrument_boto3(s3_client)
+S3_URL_PREFIX = f"https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/"
+
+# --- Idempotency ---
+# Replays the first response for a repeated Idempotency-Key (24h TTL). A key
+# whose first request never finished can be retried after the pending lease.
+IDEMPOTENCY_PENDING_SECONDS = float(os.environ.get('IDEMPOTENCY_PENDING_SECONDS', '60'))
+idempotency = Idempotency(
+    MemoryIdempotencyStore(pending_seconds=IDEMPOTENCY_PENDING_SECONDS) if os.environ.get('IDEMPOTENCY_STORE') == 'memory'
+    else MongoIdempotencyStore(db.idempotency_keys, pending_seconds=IDEMPOTENCY_PENDING_SECONDS)
+)
+
+# --- Read Cache ---
+# Coalesces identical concurrent reads and caches them briefly per user.
+# Every write to a user's data must call read_cache.invalidate(user_id).
+read_cache = UserReadCache(ttl_seconds=float(os.environ.get('READ_CACHE_TTL_SECONDS', '5')))
+# Rollups only change on a write, so they are kept much longer.
+ROLLUP_CACHE_TTL_SECONDS = float(os.environ.get('ROLLUP_CACHE_TTL_SECONDS', '3600'))
+
+# --- Users ---
+# Slim profile objects cached per process; profile writes refresh the entry.
+users = UserRepository(db.users, ttl_seconds=float(os.environ.get('PROFILE_CACHE_TTL_SECONDS', '30')))
+
+# --- Tracking Storage ---
+# "documents" (one doc per day) or "bucketed" (one doc per user per month);
+# run migrate_tracking.py before switching an existing database to buckets.
+TRACKING_LAYOUT = os.environ.get('TRACKING_LAYOUT', 'documents')
+tracking = make_tracking_store(db, TRACKING_LAYOUT)
+
+# --- Conditional GET ---
+# Per-user list watermarks behind the ETags of /weight-entries and /workout-logs.
+# Bump after every write to the list.
+watermarks = Watermarks(db.watermarks)
+
+# --- Exercise Index ---
+# One row per plan exercise, for server-side plan search.
+exercise_index = ExerciseIndex(db.exercise_index)
+
+# --- Custom Plans ---
+# User plans stored as diffs against a template, resolved through a cache.
+custom_plans = CustomPlans(db, templates_ttl=lambda: cache_bus.ttl(PLANS_CACHE_TTL_SECONDS))
+
+# --- Background Tasks ---
+# Jobs run in-process by default; set TASK_WORKER_IN_PROCESS=0 when a separate
+# `python worker.py` process consumes the queue.
+task_queue = TaskQueue(
+    MemoryJobStore() if os.environ.get('TASK_STORE') == 'memory' else MongoJobStore(db.jobs),
+    concurrency=int(os.environ.get('TASK_CONCURRENCY', '4')),
+)
+RUN_TASK_WORKER = os.environ.get('TASK_WORKER_IN_PROCESS', '1') == '1'
+
+# --- Progression ---
+# Per-exercise progressive-overload state, updated as workouts are logged.
+progression = ProgressionEngine(db, queue=task_queue, rep_ranges_ttl=lambda: cache_bus.ttl(PLANS_CACHE_TTL_SECONDS))
+
+# --- Cache Invalidation ---
+# Every worker tails a change stream and evicts what other workers (or pods)
+# changed. Without one (standalone Mongo, CACHE_BUS_ENABLED=0) long-lived
+# entries fall back to CACHE_FALLBACK_TTL_SECONDS.
+cache_bus = CacheBus(db, fallback_ttl=float(os.environ.get('CACHE_FALLBACK_TTL_SECONDS', '30')))
+CACHE_BUS_ENABLED = os.environ.get('CACHE_BUS_ENABLED', '1') == '1'
+USER_DATA_COLLECTIONS = ("weight_entries", "water_intake", "weight_buckets", "water_buckets", "workout_logs")
+
+def forget_user_data(user_id: Optional[str]):
+    if user_id:
+        read_cache.invalidate(user_id)
+    else:
+        read_cache.clear()
+
+def forget_profile(user_id: Optional[str]):
+    if user_id:
+        forget_user(user_id)
+    else:
+        read_cache.clear()
+        users.clear()
+
+def forget_workout_plans(_plan_id: Optional[str] = None):
+    plans_cache.invalidate()
+    custom_plans.invalidate_templates()
+    progression.invalidate_rep_ranges()
+
+def flush_caches():
+    forget_profile(None)
+    forget_workout_plans()
+
+cache_bus.on(USER_DATA_COLLECTIONS, forget_user_data)
+cache_bus.on("users", forget_profile)
+cache_bus.on("workout_plans", forget_workout_plans)
+cache_bus.on_reset(flush_caches)
+
+# --- Photo Storage ---
+# Photo objects are keyed by the SHA-256 of their bytes and reference-counted,
+# so identical images are stored once.
+photo_blobs = PhotoBlobs(db.photo_blobs, s3_client, AWS_S3_BUCKET, queue=task_queue)
+
+# --- Workout Plans ---
+async def load_workout_plans():
+    plans = await db.workout_plans.find({}, {"_id": 0}).to_list(100)
+    return plans, weak_etag("workout_plans", json.dumps(plans, sort_keys=True, default=str))
+
+plans_cache = CachedValue(load_workout_plans)
+PLANS_CACHE_TTL_SECONDS = float(os.environ.get('PLANS_CACHE_TTL_SECONDS', '3600'))
+
+# --- Account Deletion ---
+def forget_user(user_id: str):
+    read_cache.invalidate(user_id)
+    users.invalidate(user_id)
+
+account_deleter = AccountDeleter(
+    db, s3_client, AWS_S3_BUCKET,
+    url_prefix=S3_URL_PREFIX, on_deleted=forget_user, queue=task_queue, blobs=photo_blobs,
+)
+
+# --- Photo Uploads ---
+# Clients upload straight to S3 with a presigned POST, then confirm; unconfirmed
+# uploads are swept by a self-rescheduling background task.
+photo_uploads = PhotoUploads(
+    db, s3_client, AWS_S3_BUCKET, url_prefix=S3_URL_PREFIX,
+    max_bytes=int(os.environ.get('PHOTO_UPLOAD_MAX_BYTES', str(10 * 1024 * 1024))),
+    ttl_seconds=int(os.environ.get('PHOTO_UPLOAD_TTL_SECONDS', '900')), queue=task_queue, blobs=photo_blobs,
+)
+
+# --- Reminders ---
+# Water/workout reminders from a schedule of next-due times, processed once a
+# minute by the background task queue. REMINDER_STORE=memory keeps the
+# schedule in-process (single worker with TASK_STORE=memory only).
+REMINDERS_ENABLED = os.environ.get('REMINDERS_ENABLED', '1') == '1'
+reminders = Reminders(
+    db, MongoReminderStore(db.reminder_schedule) if os.environ.get('REMINDER_STORE', 'mongo') == 'mongo'
+    else MemoryReminderStore(),
+    make_sender(os.environ.get('REMINDER_SENDER', 'log')), tracking, queue=task_queue,
+    batch_size=int(os.environ.get('REMINDER_BATCH_SIZE', '1000')),
+)
+
+# --- Streaks & Leaderboards ---
+# Streak counters and this week's leaderboards are updated as workouts and
+# water are logged; a nightly task (at LEADERBOARD_RECONCILE_HOUR UTC) rebuilds
+# the recent boards from the logs. LEADERBOARD_STORE=memory keeps the boards
+# in-process (single worker only).
+streaks = Streaks(
+    db, MongoLeaderboardStore(db) if os.environ.get('LEADERBOARD_STORE', 'mongo') == 'mongo'
+    else MemoryLeaderboardStore(),
+    tracking, queue=task_queue, reconcile_hour=int(os.environ.get('LEADERBOARD_RECONCILE_HOUR', '3')),
+)
+
+# --- Profiler ---
+# Off by default. When enabled, the users in ADMIN_USER_IDS can sample this
+# worker for a while (POST /api/admin/profile) or profile one request by
+# sending `X-Profile: collapsed|speedscope`.
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '0') == '1'
+ADMIN_USER_IDS = {u.strip() for u in os.environ.get('ADMIN_USER_IDS', '').split(',') if u.strip()}
+profiler = Profiler(
+    interval=float(os.environ.get('PROFILER_INTERVAL_MS', '5')) / 1000,
+    request_interval=float(os.environ.get('PROFILER_REQUEST_INTERVAL_MS', '1')) / 1000,
+    max_overhead=float(os.environ.get('PROFILER_MAX_OVERHEAD', '0.02')),
+    max_seconds=float(os.environ.get('PROFILER_MAX_SECONDS', '60')),
+)
 
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
@@ -107,28 +300,69 @@ class ProfileUpdate(BaseModel):
     age: Optional[int] = None
     gender: Optional[str] = None
     goal: Optional[str] = None
+    show_name_on_leaderboards: Optional[bool] = None
 
 class WeightEntryCreate(BaseModel):
     weight: float
-    date: str
+    date: Day
 
 class WaterAction(BaseModel):
-    date: str
+    date: Day
 
 class WorkoutLogCreate(BaseModel):
-    date: str
+    date: Day
     plan_name: str
     day_name: str
     exercises: List[dict]
 
+class PlanDay(BaseModel):
+    day: int
+    name: str
+    exercises: List[dict]
+
+class CustomPlanCreate(BaseModel):
+    template_id: str
+    name: Optional[str] = None
+
+class CustomPlanUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    days_per_week: Optional[int] = None
+    duration_weeks: Optional[int] = None
+    days: Optional[List[PlanDay]] = None
+
 class ProgressPhotoCreate(BaseModel):
     photo_base64: str  # full data URI, e.g. "data:image/jpeg;base64,..."
-    date: str
+    date: Day
     note: Optional[str] = ""
 
+class PhotoUploadCreate(BaseModel):
+    content_type: str = "image/jpeg"
+    sha256: str = Field(..., pattern=SHA256_PATTERN)  # hex digest of the file; S3 checks it on upload
+    date: Day
+    note: Optional[str] = ""
+
+class WaterReminder(BaseModel):
+    enabled: bool = False
+    start: str = Field("09:00", pattern=TIME_PATTERN)
+    end: str = Field("21:00", pattern=TIME_PATTERN)
+    every_minutes: int = Field(120, ge=15, le=720)
+
+class WorkoutReminder(BaseModel):
+    enabled: bool = False
+    time: str = Field("18:00", pattern=TIME_PATTERN)
+    days: Optional[List[int]] = None  # weekdays, 0 = Monday
+    days_per_week: Optional[int] = Field(None, ge=1, le=7)  # used when `days` is omitted
+
+class ReminderSettings(BaseModel):
+    timezone: str = "UTC"  # IANA name, e.g. "Europe/London"
+    water: WaterReminder = Field(default_factory=WaterReminder)
+    workout: WorkoutReminder = Field(default_factory=WorkoutReminder)
+
 # --- S3 Helpers ---
-def upload_photo_to_s3(photo_base64: str, photo_id: str) -> str:
-    """Decode base64 image and upload to S3. Returns the public HTTPS URL."""
+async def upload_photo_to_s3(photo_base64: str) -> str:
+    """Decode base64 image and store it under its content hash (once per distinct
+    image). Returns the public HTTPS URL."""
     # Strip data URI prefix if present: "data:image/jpeg;base64,<data>"
     if ',' in photo_base64:
         header, data = photo_base64.split(',', 1)
@@ -137,17 +371,20 @@ def upload_photo_to_s3(photo_base64: str, photo_id: str) -> str:
         data = photo_base64
         content_type = 'image/jpeg'
 
-    image_bytes = base64.b64decode(data)
+    image_bytes, digest = await asyncio.to_thread(decode_base64, data)
     ext = content_type.split('/')[-1]  # e.g. "jpeg", "png"
-    key = f"progress-photos/{photo_id}.{ext}"
-
-    s3_client.put_object(
-        Bucket=AWS_S3_BUCKET,
-        Key=key,
-        Body=image_bytes,
-        ContentType=content_type,
-    )
-    return f"https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{key}"
+    key = content_key(digest, ext)
+
+    async def put():
+        await asyncio.to_thread(
+            s3_client.put_object,
+            Bucket=AWS_S3_BUCKET,
+            Key=key,
+            Body=image_bytes,
+            ContentType=content_type,
+        )
+    await photo_blobs.acquire(key, put, size=len(image_bytes), content_type=content_type)
+    return f"{S3_URL_PREFIX}{key}"
 
 def generate_s3_presigned_url(photo_url: str, expires_in: int = 3600) -> Optional[str]:
     """Generate a presigned URL for an S3 object. Returns the URL or None on failure."""
@@ -169,23 +406,65 @@ def generate_s3_presigned_url(photo_url: str, expires_in: int = 3600) -> Optiona
         logger.warning(f"Failed to generate presigned URL for {photo_url}: {e}")
         return photo_url  # Fallback to public URL if signing fails
 
+async def release_photo(photo_url: str):
+    """Drop a deleted photo's reference to its object; the object goes with the last one."""
+    key = photo_url[len(S3_URL_PREFIX):] if photo_url.startswith(S3_URL_PREFIX) else None
+    if key and is_content_addressed(key):
+        if await photo_blobs.release(key):
+            await photo_blobs.schedule_collect([key])
+    else:
+        # Stored before content addressing: one object per photo
+        await task_queue.enqueue("s3.delete_photo", {"photo_url": photo_url})
+
 def delete_photo_from_s3(photo_url: str):
-    """Delete a photo from S3 given its full URL. Silently ignores errors."""
-    try:
-        # Extract the S3 key from the URL
-        prefix = f"https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/"
-        if photo_url.startswith(prefix):
-            key = photo_url[len(prefix):]
-            s3_client.delete_object(Bucket=AWS_S3_BUCKET, Key=key)
-    except ClientError as e:
-        logging.getLogger(__name__).warning(f"S3 delete failed for {photo_url}: {e}")
+    """Delete a photo from S3 given its full URL. ClientErrors propagate so the task is retried."""
+    # Extract the S3 key from the URL
+    prefix = f"https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/"
+    if photo_url.startswith(prefix):
+        key = photo_url[len(prefix):]
+        s3_client.delete_object(Bucket=AWS_S3_BUCKET, Key=key)
+
+# --- Task Handlers ---
+@task_queue.handler("s3.delete_photo")
+async def delete_photo_task(payload: dict):
+    await asyncio.to_thread(delete_photo_from_s3, payload["photo_url"])
+
+# --- Google Certs ---
+# Google's signing certs are cached in-process and refreshed in the background
+# once stale, so only a cold start (or a key rotation) fetches on the request path.
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_CERTS_TTL_SECONDS = 3600
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+_google_certs = {"certs": None, "fetched_at": 0.0, "refresh": None}
+
+def fetch_google_certs() -> dict:
+    response = google_requests.Request()(GOOGLE_CERTS_URL, method="GET")
+    if response.status != 200:
+        raise RuntimeError(f"Could not fetch Google certs: HTTP {response.status}")
+    return json.loads(response.data)
+
+async def refresh_google_certs() -> dict:
+    certs = await asyncio.to_thread(fetch_google_certs)
+    _google_certs.update(certs=certs, fetched_at=time.monotonic())
+    return certs
+
+async def get_google_certs(kid: Optional[str] = None) -> dict:
+    certs = _google_certs["certs"]
+    if certs is None or (kid and kid not in certs):
+        return await refresh_google_certs()
+    stale = time.monotonic() - _google_certs["fetched_at"] > GOOGLE_CERTS_TTL_SECONDS
+    if stale and (_google_certs["refresh"] is None or _google_certs["refresh"].done()):
+        _google_certs["refresh"] = asyncio.create_task(refresh_google_certs())
+    return certs
 
 # --- Auth Helpers ---
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    with track("bcrypt"):
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
 
 def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode(), hashed.encode())
+    with track("bcrypt"):
+        return bcrypt.checkpw(password.encode(), hashed.encode())
 
 def create_token(user_id: str) -> str:
     payload = {
@@ -194,7 +473,9 @@ def create_token(user_id: str) -> str:
     }
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+async def get_token_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    """The user a valid token was issued to, whether or not the account still
+    exists (for following an account deletion)."""
     token = credentials.credentials
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -207,12 +488,33 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+async def get_current_user(user_id: str = Depends(get_token_user)) -> str:
+    # Tokens outlive accounts: reject them once deletion starts (cached profile lookup)
+    if await users.get_profile(user_id) is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    return user_id
+
+def token_user_id(token: str) -> Optional[str]:
+    """Best-effort user_id from a bearer token, for keying rate limits."""
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("user_id")
+    except jwt.InvalidTokenError:
+        return None
+
+def is_admin_token(token: str) -> bool:
+    return token_user_id(token) in ADMIN_USER_IDS
+
+async def get_admin_user(user_id: str = Depends(get_current_user)) -> str:
+    if user_id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user_id
+
 def user_response(user: dict) -> dict:
     return {
         "id": user["id"], "name": user["name"], "email": user["email"],
         "height_cm": user.get("height_cm"), "weight_kg": user.get("weight_kg"),
         "age": user.get("age"), "gender": user.get("gender"),
-        "goal": user.get("goal"), "created_at": user["created_at"]
+        "goal": user.get("goal"), "created_at": iso(user["created_at"])
     }
 
 # --- Auth Routes ---
@@ -222,7 +524,7 @@ async def signup(data: UserCreate):
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
     user_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
+    now = utc_now()
     user_doc = {
         "id": user_id, "name": data.name, "email": data.email,
         "password_hash": hash_password(data.password),
@@ -238,6 +540,8 @@ async def login(data: UserLogin):
     user = await db.users.find_one({"email": data.email}, {"_id": 0})
     if not user or not verify_password(data.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if user.get("deleted_at"):
+        raise HTTPException(status_code=403, detail="Account is being deleted")
     token = create_token(user["id"])
     return {"token": token, "user": user_response(user)}
 
@@ -248,12 +552,15 @@ async def google_login(data: GoogleLogin):
         env_ids = os.environ.get("GOOGLE_CLIENT_IDS", "")
         client_ids = [cid.strip() for cid in env_ids.split(",") if cid.strip()]
         
-        # Verify the ID token with optional audience check
-        id_info = id_token.verify_oauth2_token(
-            data.id_token, 
-            google_requests.Request(),
-            audience=client_ids if client_ids else None
-        )
+        # Verify the ID token against cached certs with optional audience check
+        try:
+            kid = jwt.get_unverified_header(data.id_token).get("kid")
+        except jwt.InvalidTokenError:
+            raise ValueError("Malformed token")
+        certs = await get_google_certs(kid)
+        id_info = google_jwt.decode(data.id_token, certs=certs, audience=client_ids if client_ids else None)
+        if id_info.get("iss") not in GOOGLE_ISSUERS:
+            raise ValueError("Wrong issuer")
 
         email = id_info.get("email")
         name = id_info.get("name")
@@ -265,7 +572,7 @@ async def google_login(data: GoogleLogin):
         if not user:
             # Create a new user if they don't exist
             user_id = str(uuid.uuid4())
-            now = datetime.now(timezone.utc).isoformat()
+            now = utc_now()
             user = {
                 "id": user_id, 
                 "name": name or "Athlete", 
@@ -275,10 +582,14 @@ async def google_login(data: GoogleLogin):
                 "gender": None, "goal": None, "created_at": now
             }
             await db.users.insert_one(user.copy())
+        elif user.get("deleted_at"):
+            raise HTTPException(status_code=403, detail="Account is being deleted")
         
         token = create_token(user["id"])
         return {"token": token, "user": user_response(user)}
 
+    except HTTPException:
+        raise
     except ValueError:
         # Invalid token
         raise HTTPException(status_code=401, detail="Invalid Google token")
@@ -288,89 +599,170 @@ async def google_login(data: GoogleLogin):
 
 @api_router.get("/auth/me")
 async def get_me(user_id: str = Depends(get_current_user)):
-    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+    user = await users.get_profile(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    return user.to_dict()
 
 # --- Profile ---
 @api_router.put("/profile")
 async def update_profile(data: ProfileUpdate, user_id: str = Depends(get_current_user)):
     update_data = {k: v for k, v in data.model_dump().items() if v is not None}
+    user = await users.update_profile(user_id, update_data)
     if update_data:
-        await db.users.update_one({"id": user_id}, {"$set": update_data})
-    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
-    return user
+        read_cache.invalidate(user_id)
+    return user.to_dict() if user else None
 
 # --- Weight Tracker ---
 @api_router.get("/weight-entries")
-async def get_weight_entries(user_id: str = Depends(get_current_user)):
-    entries = await db.weight_entries.find({"user_id": user_id}, {"_id": 0}).sort("date", -1).to_list(100)
-    return entries
+async def get_weight_entries(request: Request, response: Response, user_id: str = Depends(get_current_user)):
+    cached = not_modified(request, response, await watermarks.etag(user_id, "weight_entries", TRACKING_LAYOUT))
+    if cached:
+        return cached
+
+    async def fetch():
+        return await tracking.list_weights(user_id, 100)
+    return await read_cache.get("get_weight_entries", user_id, (), fetch)
 
 @api_router.post("/weight-entries")
 async def create_weight_entry(data: WeightEntryCreate, user_id: str = Depends(get_current_user)):
-    existing = await db.weight_entries.find_one({"user_id": user_id, "date": data.date})
-    now = datetime.now(timezone.utc).isoformat()
-    if existing:
-        await db.weight_entries.update_one(
-            {"user_id": user_id, "date": data.date},
-            {"$set": {"weight": data.weight, "created_at": now}}
-        )
-        entry = await db.weight_entries.find_one({"user_id": user_id, "date": data.date}, {"_id": 0})
-        return entry
-    entry_id = str(uuid.uuid4())
-    entry = {"id": entry_id, "user_id": user_id, "weight": data.weight, "date": data.date, "created_at": now}
-    await db.weight_entries.insert_one(entry)
-    return {k: v for k, v in entry.items() if k != "_id"}
+    entry = await tracking.save_weight(user_id, data.date, data.weight)
+    read_cache.invalidate(user_id)
+    await watermarks.bump(user_id, "weight_entries")
+    return entry
 
 @api_router.delete("/weight-entries/{entry_id}")
 async def delete_weight_entry(entry_id: str, user_id: str = Depends(get_current_user)):
-    result = await db.weight_entries.delete_one({"id": entry_id, "user_id": user_id})
-    if result.deleted_count == 0:
+    deleted = await tracking.delete_weight(user_id, entry_id)
+    read_cache.invalidate(user_id)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Entry not found")
+    await watermarks.bump(user_id, "weight_entries")
     return {"status": "deleted"}
 
 # --- Water Intake ---
 @api_router.get("/water-intake")
-async def get_water_intake(date: str, user_id: str = Depends(get_current_user)):
-    intake = await db.water_intake.find_one({"user_id": user_id, "date": date}, {"_id": 0})
-    if not intake:
-        return {"id": str(uuid.uuid4()), "date": date, "glasses": 0, "goal": 8}
-    return intake
+async def get_water_intake(date: Day, user_id: str = Depends(get_current_user)):
+    async def fetch():
+        intake = await tracking.get_water(user_id, date)
+        if not intake:
+            return {"id": str(uuid.uuid4()), "date": date, "glasses": 0, "goal": 8}
+        return intake
+    return await read_cache.get("get_water_intake", user_id, (date,), fetch)
+
+async def record_streaks(update, user_id: str):
+    try:
+        await update
+    except Exception as e:
+        # Streaks and boards are rebuilt from the logs nightly; never fail the write itself
+        logger.error(f"Streak update failed for {user_id}: {e}")
 
 @api_router.post("/water-intake/add")
-async def add_water(data: WaterAction, user_id: str = Depends(get_current_user)):
-    intake = await db.water_intake.find_one({"user_id": user_id, "date": data.date})
-    if intake:
-        await db.water_intake.update_one(
-            {"user_id": user_id, "date": data.date},
-            {"$set": {"glasses": intake.get("glasses", 0) + 1}}
-        )
-        updated = await db.water_intake.find_one({"user_id": user_id, "date": data.date}, {"_id": 0})
-        return updated
-    new_intake = {"id": str(uuid.uuid4()), "user_id": user_id, "date": data.date, "glasses": 1, "goal": 8}
-    await db.water_intake.insert_one(new_intake)
-    return {k: v for k, v in new_intake.items() if k != "_id"}
+async def add_water(data: WaterAction, user_id: str = Depends(get_current_user),
+                    idempotency_key: Optional[str] = Header(None)):
+    async def execute():
+        intake = await tracking.add_water(user_id, data.date)
+        await record_streaks(streaks.record_water(user_id, intake, 1), user_id)
+        read_cache.invalidate(user_id)
+        return intake
+    return await idempotency.run(idempotency_key, user_id, "add_water", data, execute)
 
 @api_router.post("/water-intake/remove")
 async def remove_water(data: WaterAction, user_id: str = Depends(get_current_user)):
-    intake = await db.water_intake.find_one({"user_id": user_id, "date": data.date})
-    if intake and intake.get("glasses", 0) > 0:
-        await db.water_intake.update_one(
-            {"user_id": user_id, "date": data.date},
-            {"$set": {"glasses": intake["glasses"] - 1}}
-        )
-        updated = await db.water_intake.find_one({"user_id": user_id, "date": data.date}, {"_id": 0})
+    updated = await tracking.remove_water(user_id, data.date)
+    if updated:
+        await record_streaks(streaks.record_water(user_id, updated, -1), user_id)
+        read_cache.invalidate(user_id)
         return updated
     return {"id": str(uuid.uuid4()), "date": data.date, "glasses": 0, "goal": 8}
 
+# --- Reminders ---
+def reminder_response(settings: dict) -> dict:
+    now = utc_now()
+    upcoming = {kind: next_due(settings, kind, now) for kind in REMINDER_KINDS}
+    return {**settings, "next": {kind: iso(due) for kind, due in upcoming.items()}}
+
+@api_router.get("/reminders")
+async def get_reminders(user_id: str = Depends(get_current_user)):
+    return reminder_response(await reminders.get_settings(user_id))
+
+@api_router.put("/reminders")
+async def update_reminders(data: ReminderSettings, user_id: str = Depends(get_current_user)):
+    settings = data.model_dump()
+    workout = settings["workout"]
+    days_per_week = workout.pop("days_per_week")
+    if workout["days"] is None:
+        workout["days"] = spread_days(days_per_week) if days_per_week else [0, 2, 4]
+    try:
+        saved = await reminders.update_settings(user_id, settings)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return reminder_response(saved)
+
+# --- Streaks & Leaderboards ---
+@api_router.get("/streaks")
+async def get_streaks(user_id: str = Depends(get_current_user)):
+    """Current and longest runs of workout days and water-goal days."""
+    return await streaks.get(user_id)
+
+@api_router.get("/leaderboards/{kind}")
+async def get_leaderboard(kind: str, week: Optional[str] = Query(None, pattern=WEEK_PATTERN),
+                          limit: int = Query(10, ge=1, le=LEADERBOARD_MAX_LIMIT),
+                          around: int = Query(2, ge=0, le=LEADERBOARD_MAX_RADIUS),
+                          user_id: str = Depends(get_current_user)):
+    """Top `limit` players of an ISO week (default: this one) and the caller's
+    rank with `around` neighbours on each side. Players are named only if they
+    set `show_name_on_leaderboards` on their profile."""
+    if kind not in LEADERBOARD_KINDS:
+        raise HTTPException(status_code=400, detail="kind must be 'workouts' or 'water'")
+    if week is None:
+        week = week_of(utc_now())
+    try:
+        week_start(week)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid week")
+    return await streaks.leaderboard(kind, week, user_id, limit, around)
+
+# --- Rollups ---
+@api_router.get("/stats/rollups")
+async def get_rollups(start: Day, end: Day, period: str = "day", user_id: str = Depends(get_current_user)):
+    """Water and weight aggregates per day, week or month for start..end (inclusive)."""
+    if period not in rollups.PERIODS:
+        raise HTTPException(status_code=400, detail="period must be 'day', 'week' or 'month'")
+    first, last = to_day(start).date(), to_day(end).date()
+    if first > last:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (last - first).days >= rollups.MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {rollups.MAX_RANGE_DAYS} days")
+
+    async def fetch():
+        series = await tracking.daily_series(user_id, start, end)
+        return rollups.summarize(series, first, last, period)
+    return await read_cache.get("get_rollups", user_id, (start, end, period), fetch, ttl=cache_bus.ttl(ROLLUP_CACHE_TTL_SECONDS))
+
 # --- Workout Plans ---
 @api_router.get("/workout-plans")
-async def get_workout_plans():
-    plans = await db.workout_plans.find({}, {"_id": 0}).to_list(100)
+async def get_workout_plans(request: Request, response: Response):
+    plans, etag = await plans_cache.get(ttl=cache_bus.ttl(PLANS_CACHE_TTL_SECONDS))
+    cached = not_modified(request, response, etag)
+    if cached:
+        return cached
     return plans
 
+# Declared before /workout-plans/{plan_id} so "search" isn't taken as a plan id
+@api_router.get("/workout-plans/search")
+async def search_workout_plans(muscle: Optional[str] = None, level: Optional[str] = None,
+                               equipment: Optional[str] = None, q: Optional[str] = Query(None, max_length=50),
+                               group_by: str = "exercise", limit: int = Query(50, ge=1, le=100),
+                               credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """Filter exercises by muscle group, level, equipment and name. `group_by=day|plan`
+    returns the matching days or plans instead. Signed-in users also search their own plans."""
+    if group_by not in GROUP_BY:
+        raise HTTPException(status_code=400, detail="group_by must be 'exercise', 'day' or 'plan'")
+    user_id = token_user_id(credentials.credentials) if credentials else None
+    return await exercise_index.search(user_id, muscle=muscle, level=level, equipment=equipment, q=q,
+                                       group_by=group_by, limit=limit)
+
 @api_router.get("/workout-plans/{plan_id}")
 async def get_workout_plan(plan_id: str):
     plan = await db.workout_plans.find_one({"id": plan_id}, {"_id": 0})
@@ -378,34 +770,100 @@ async def get_workout_plan(plan_id: str):
         raise HTTPException(status_code=404, detail="Plan not found")
     return plan
 
+# --- Custom Plans ---
+@api_router.get("/custom-plans")
+async def get_custom_plans(user_id: str = Depends(get_current_user)):
+    return await custom_plans.list(user_id)
+
+@api_router.post("/custom-plans")
+async def create_custom_plan(data: CustomPlanCreate, user_id: str = Depends(get_current_user)):
+    """Fork a template. The new plan stores nothing but its differences from the template."""
+    doc = await custom_plans.fork(user_id, data.template_id, data.name)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Template not found")
+    plan = await custom_plans.resolve(doc)
+    await exercise_index.index_plan(plan, owner_id=user_id)
+    return plan
+
+@api_router.get("/custom-plans/{plan_id}")
+async def get_custom_plan(plan_id: str, user_id: str = Depends(get_current_user)):
+    doc = await custom_plans.get(user_id, plan_id)
+    plan = await custom_plans.resolve(doc) if doc else None
+    if not plan:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    return plan
+
+@api_router.put("/custom-plans/{plan_id}")
+async def update_custom_plan(data: CustomPlanUpdate, plan_id: str, user_id: str = Depends(get_current_user)):
+    changes = data.model_dump(exclude_none=True)
+    try:
+        doc = await custom_plans.update(user_id, plan_id, changes)
+    except PlanConflict:
+        raise HTTPException(status_code=409, detail="Plan was changed concurrently, please retry")
+    if not doc:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    plan = await custom_plans.resolve(doc)
+    await exercise_index.index_plan(plan, owner_id=user_id)
+    return plan
+
+@api_router.delete("/custom-plans/{plan_id}")
+async def delete_custom_plan(plan_id: str, user_id: str = Depends(get_current_user)):
+    if not await custom_plans.delete(user_id, plan_id):
+        raise HTTPException(status_code=404, detail="Plan not found")
+    await exercise_index.remove_plan(plan_id)
+    return {"status": "deleted"}
+
 # --- Workout Logs ---
 @api_router.get("/workout-logs")
-async def get_workout_logs(user_id: str = Depends(get_current_user)):
+async def get_workout_logs(request: Request, response: Response, user_id: str = Depends(get_current_user)):
+    cached = not_modified(request, response, await watermarks.etag(user_id, "workout_logs"))
+    if cached:
+        return cached
     logs = await db.workout_logs.find({"user_id": user_id}, {"_id": 0}).sort("date", -1).to_list(100)
-    return logs
+    return [to_api(log) for log in logs]
 
 @api_router.post("/workout-logs")
-async def create_workout_log(data: WorkoutLogCreate, user_id: str = Depends(get_current_user)):
-    log_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
-    log_doc = {
-        "id": log_id, "user_id": user_id, "date": data.date,
-        "plan_name": data.plan_name, "day_name": data.day_name,
-        "exercises": data.exercises, "created_at": now
-    }
-    await db.workout_logs.insert_one(log_doc)
-    return {k: v for k, v in log_doc.items() if k != "_id"}
+async def create_workout_log(data: WorkoutLogCreate, user_id: str = Depends(get_current_user),
+                             idempotency_key: Optional[str] = Header(None)):
+    async def execute():
+        log_id = str(uuid.uuid4())
+        now = utc_now()
+        log_doc = {
+            "id": log_id, "user_id": user_id, "date": to_day(data.date),
+            "plan_name": data.plan_name, "day_name": data.day_name,
+            "exercises": data.exercises, "created_at": now
+        }
+        await db.workout_logs.insert_one(log_doc)
+        await record_streaks(streaks.record_workout(user_id, log_doc["date"]), user_id)
+        read_cache.invalidate(user_id)
+        await watermarks.bump(user_id, "workout_logs")
+        try:
+            await progression.record(user_id, log_doc)
+        except Exception as e:
+            # Suggestions can be rebuilt from the logs; never fail the log itself
+            logger.error(f"Progression update failed for {user_id}: {e}")
+        return to_api({k: v for k, v in log_doc.items() if k != "_id"})
+    return await idempotency.run(idempotency_key, user_id, "create_workout_log", data, execute)
+
+# --- Progression ---
+@api_router.get("/progression/suggestions")
+async def get_progression_suggestions(exercise: Optional[List[str]] = Query(None), user_id: str = Depends(get_current_user)):
+    """Next-session weight and reps per exercise, optionally filtered by `?exercise=` names."""
+    return await progression.suggestions(user_id, exercise)
 
 # --- Progress Photos ---
+PHOTO_LIST_FIELDS = {"_id": 0, "id": 1, "user_id": 1, "date": 1, "note": 1, "photo_url": 1, "created_at": 1}
+PHOTO_LIST_INDEX = [("user_id", 1), ("date", -1), ("id", 1), ("note", 1), ("photo_url", 1), ("created_at", 1)]
+
 @api_router.get("/progress-photos")
 async def get_progress_photos(user_id: str = Depends(get_current_user)):
-    # Exclude the legacy photo_base64 field entirely; new docs use photo_url
-    photos = await db.progress_photos.find(
-        {"user_id": user_id}, {"_id": 0, "photo_base64": 0}
-    ).sort("date", -1).to_list(100)
+    # Only indexed fields, so the list is served from the (user_id, date, ...) index;
+    # the legacy photo_base64 field is never read
+    photos = await db.progress_photos.find({"user_id": user_id}, PHOTO_LIST_FIELDS).sort("date", -1).to_list(100)
     
     # Generate signed URLs for all photos
     for p in photos:
+        to_api(p)
         if p.get("photo_url"):
             p["photo_url"] = generate_s3_presigned_url(p["photo_url"])
             
@@ -420,34 +878,58 @@ async def get_progress_photo(photo_id: str, user_id: str = Depends(get_current_u
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
     
+    to_api(photo)
     if photo.get("photo_url"):
         photo["photo_url"] = generate_s3_presigned_url(photo["photo_url"])
         
     return photo
 
 @api_router.post("/progress-photos")
-async def create_progress_photo(data: ProgressPhotoCreate, user_id: str = Depends(get_current_user)):
-    photo_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
+async def create_progress_photo(data: ProgressPhotoCreate, user_id: str = Depends(get_current_user),
+                                idempotency_key: Optional[str] = Header(None)):
+    async def execute():
+        photo_id = str(uuid.uuid4())
+        now = utc_now()
+
+        if not AWS_S3_BUCKET:
+            raise HTTPException(status_code=500, detail="S3 bucket not configured")
+
+        try:
+            photo_url = await upload_photo_to_s3(data.photo_base64)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to upload photo: {str(e)}")
+
+        photo_doc = {
+            "id": photo_id,
+            "user_id": user_id,
+            "date": to_day(data.date),
+            "photo_url": photo_url,  # S3 URL instead of base64 blob
+            "note": data.note or "",
+            "created_at": now,
+        }
+        await db.progress_photos.insert_one(photo_doc)
+        return {"id": photo_id, "date": data.date, "note": data.note or "", "created_at": iso(now), "has_photo": True, "photo_url": photo_url}
+    return await idempotency.run(idempotency_key, user_id, "create_progress_photo", data, execute)
 
+@api_router.post("/progress-photos/uploads")
+async def create_photo_upload(data: PhotoUploadCreate, user_id: str = Depends(get_current_user)):
+    """Presigned POST for uploading a photo straight to S3; confirm it afterwards."""
     if not AWS_S3_BUCKET:
         raise HTTPException(status_code=500, detail="S3 bucket not configured")
+    if data.content_type not in PHOTO_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"content_type must be one of {', '.join(PHOTO_CONTENT_TYPES)}")
+    return await photo_uploads.create(user_id, data.content_type, data.date, data.note, data.sha256)
 
+@api_router.post("/progress-photos/uploads/{upload_id}/confirm")
+async def confirm_photo_upload(upload_id: str, user_id: str = Depends(get_current_user)):
     try:
-        photo_url = upload_photo_to_s3(data.photo_base64, photo_id)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to upload photo: {str(e)}")
-
-    photo_doc = {
-        "id": photo_id,
-        "user_id": user_id,
-        "date": data.date,
-        "photo_url": photo_url,  # S3 URL instead of base64 blob
-        "note": data.note or "",
-        "created_at": now,
-    }
-    await db.progress_photos.insert_one(photo_doc)
-    return {"id": photo_id, "date": data.date, "note": data.note or "", "created_at": now, "has_photo": True, "photo_url": photo_url}
+        photo = await photo_uploads.confirm(user_id, upload_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status, detail=e.detail)
+    photo = to_api(photo)
+    photo["has_photo"] = True
+    photo["photo_url"] = generate_s3_presigned_url(photo["photo_url"])
+    return photo
 
 @api_router.delete("/progress-photos/{photo_id}")
 async def delete_progress_photo(photo_id: str, user_id: str = Depends(get_current_user)):
@@ -455,43 +937,180 @@ async def delete_progress_photo(photo_id: str, user_id: str = Depends(get_curren
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
 
-    # Delete from S3 first
-    if photo.get("photo_url"):
-        delete_photo_from_s3(photo["photo_url"])
+    result = await db.progress_photos.delete_one({"id": photo_id, "user_id": user_id})
 
-    await db.progress_photos.delete_one({"id": photo_id, "user_id": user_id})
+    # The S3 object is removed in the background (retried on failure) once no
+    # photo references it; only the request that deleted the document releases
+    if result.deleted_count and photo.get("photo_url"):
+        await release_photo(photo["photo_url"])
     return {"status": "deleted"}
 
 # --- Dashboard ---
 @api_router.get("/dashboard")
 async def get_dashboard(user_id: str = Depends(get_current_user)):
     today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
-    water = await db.water_intake.find_one({"user_id": user_id, "date": today}, {"_id": 0})
-    if not water:
-        water = {"glasses": 0, "goal": 8}
-    latest_weight = await db.weight_entries.find({"user_id": user_id}, {"_id": 0}).sort("date", -1).to_list(1)
-    weight_history = await db.weight_entries.find({"user_id": user_id}, {"_id": 0}).sort("date", -1).to_list(7)
-    week_start = (datetime.now(timezone.utc) - timedelta(days=datetime.now(timezone.utc).weekday())).strftime("%Y-%m-%d")
-    workout_count = await db.workout_logs.count_documents({"user_id": user_id, "date": {"$gte": week_start}})
+
+    async def fetch():
+        profile = await users.get_profile(user_id)
+        user = profile.to_dict() if profile else None
+        water = await tracking.get_water(user_id, today)
+        if not water:
+            water = {"glasses": 0, "goal": 8}
+        weight_history = await tracking.list_weights(user_id, 7)
+        latest_weight = weight_history[:1]
+        monday = to_day(today) - timedelta(days=to_day(today).weekday())
+        workout_count = await db.workout_logs.count_documents({"user_id": user_id, "date": {"$gte": monday}})
+        return {
+            "user": user, "water": water,
+            "latest_weight": latest_weight[0] if latest_weight else None,
+            "weight_history": list(reversed(weight_history)),
+            "workouts_this_week": workout_count, "streaks": await streaks.get(user_id, to_day(today)),
+            "today": today
+        }
+    return await read_cache.get("get_dashboard", user_id, (today,), fetch)
+
+# --- Account Deletion ---
+@api_router.delete("/account", status_code=202)
+async def delete_account(user_id: str = Depends(get_token_user)):
+    """Start deleting the account and all of its data (or restart a failed
+    deletion). Poll the returned job for progress."""
+    job = await account_deleter.request(user_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="User not found")
+    forget_user(user_id)
+    return {"job_id": job["id"], "status": job["status"]}
+
+@api_router.get("/account/deletion/{job_id}")
+async def get_account_deletion(job_id: str, user_id: str = Depends(get_token_user)):
+    job = await account_deleter.status(job_id, user_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return job
+
+# --- Data Export ---
+@api_router.get("/export")
+async def export_data(format: str = "ndjson", cursor: Optional[str] = None, user_id: str = Depends(get_current_user)):
+    """Stream the user's full history. NDJSON exports can be resumed with the last `cursor` seen."""
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    if format == "csv" and cursor:
+        raise HTTPException(status_code=400, detail="cursor is only supported for format=ndjson")
+    try:
+        resume = export.parse_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d")
+    if format == "csv":
+        return StreamingResponse(
+            export.stream_csv_zip(db, user_id), media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="fat2fit-export-{stamp}.zip"'},
+        )
+    return StreamingResponse(
+        export.stream_ndjson(db, user_id, resume), media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="fat2fit-export-{stamp}.ndjson"'},
+    )
+
+# --- Profiling ---
+@api_router.post("/admin/profile")
+async def profile_worker(seconds: float = Query(10, gt=0), format: str = "collapsed",
+                         user_id: str = Depends(get_admin_user)):
+    """Sample this worker's threads for `seconds` and return the stacks."""
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be 'collapsed' or 'speedscope'")
+    try:
+        profile = await profiler.profile(seconds)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker")
+    body, content_type = profile.render(format)
+    return Response(content=body, media_type=content_type, headers=profile.headers())
+
+# --- Metrics ---
+@api_router.get("/metrics")
+async def get_metrics(user_id: str = Depends(get_admin_user)):
+    """Process-local counters for the caching and retry layers (admins only:
+    they include query shapes and internal queue/cache state)."""
     return {
-        "user": user, "water": water,
-        "latest_weight": latest_weight[0] if latest_weight else None,
-        "weight_history": list(reversed(weight_history)),
-        "workouts_this_week": workout_count, "today": today
+        "read_cache": read_cache.stats(),
+        "users": users.stats(),
+        "custom_plans": custom_plans.stats(),
+        "idempotency": {"replayed": idempotency.replayed, "coalesced": idempotency.coalesced},
+        "tasks": await task_queue.store.stats(),
+        "photo_blobs": await photo_blobs.stats(),
+        "cache_bus": cache_bus.stats(),
+        "slow_mongo_commands": mongo_monitor.slow_commands,
+        "admission": admission_limit.stats(),
+        "profiler": profiler.stats(),
+        "reminders": await reminders.stats(),
+        "leaderboards": streaks.stats(),
     }
 
 # Include router
 app.include_router(api_router)
 
+# --- Rate Limiting ---
+# Route budgets stack on top of the catch-all "/api/*" budget. Auth routes are
+# keyed per IP (bcrypt / Google cert fetches), uploads per user.
+RATE_LIMIT_RULES = [
+    Rule("login", ("POST",), "/api/auth/login", per_ip=per_minute(20)),
+    Rule("signup", ("POST",), "/api/auth/signup", per_ip=per_minute(5, burst=10)),
+    Rule("google", ("POST",), "/api/auth/google", per_ip=per_minute(20)),
+    Rule("photos", ("POST",), "/api/progress-photos", per_ip=per_minute(30), per_user=per_minute(10), max_concurrent=2),
+    Rule("photo_uploads", ("POST",), "/api/progress-photos/uploads*", per_user=per_minute(20)),
+    Rule("export", ("GET",), "/api/export", per_user=per_minute(2, burst=4), max_concurrent=1),
+    Rule("api", (), "/api/*", per_ip=per_minute(600, burst=120), per_user=per_minute(300, burst=60), max_concurrent=16),
+]
+
+# Innermost: profiles cover the app and the profile itself gets compressed
+app.add_middleware(ProfilingMiddleware, profiler=profiler, authorize=is_admin_token, enabled=PROFILER_ENABLED)
+
+# Under the rate limiter and admission control, so rejected and 304 responses skip it
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')))
+
+app.add_middleware(
+    RateLimitMiddleware, rules=RATE_LIMIT_RULES, identify_user=token_user_id,
+    trust_forwarded_for=os.environ.get('TRUST_PROXY_HEADERS', '0') == '1',
+    enabled=os.environ.get('RATE_LIMIT_ENABLED', '1') == '1',
+)
+
+# --- Admission Control ---
+# When latency climbs the worker admits fewer requests at once; cheap reads keep
+# the whole limit, unlisted routes 80% of it and the routes below 50%.
+ADMISSION_CLASSES = [
+    PriorityRoute(CRITICAL, ("GET",), "/api/water-intake*"),
+    PriorityRoute(CRITICAL, ("GET",), "/api/dashboard"),
+    PriorityRoute(CRITICAL, ("GET",), "/api/auth/me"),
+    PriorityRoute(CRITICAL, ("GET",), "/api/weight-entries"),
+    PriorityRoute(CRITICAL, ("GET",), "/api/metrics"),
+    PriorityRoute(SHEDDABLE, ("POST",), "/api/progress-photos*"),
+    PriorityRoute(SHEDDABLE, ("POST",), "/api/auth/*"),
+    PriorityRoute(SHEDDABLE, ("GET",), "/api/export"),
+]
+admission_limit = AdaptiveLimit(
+    initial=int(os.environ.get('ADMISSION_INITIAL_LIMIT', '64')),
+    min_limit=int(os.environ.get('ADMISSION_MIN_LIMIT', '8')),
+    max_limit=int(os.environ.get('ADMISSION_MAX_LIMIT', '512')),
+    tolerance=float(os.environ.get('ADMISSION_TOLERANCE', '2.0')),
+)
+
+# Outside the rate limiter so a shed request costs no tokens; inside CORS so
+# browsers can read the 503
+app.add_middleware(
+    AdmissionMiddleware, routes=ADMISSION_CLASSES, limiter=admission_limit,
+    enabled=os.environ.get('ADMISSION_ENABLED', '1') == '1',
+)
+
 app.add_middleware(
     CORSMiddleware, allow_credentials=True,
     allow_origins=os.environ.get('ALLOWED_ORIGINS', 'http://localhost:8081,http://10.0.2.2:8000').split(','),
     allow_methods=["*"], allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+# Outermost, so the request ID and timing cover every other layer
+app.add_middleware(AccessLogMiddleware, sample_rate=ACCESS_LOG_SAMPLE_RATE, slow_ms=SLOW_REQUEST_MS)
 
 # --- Seed Workout Plans ---
 async def seed_workout_plans():
@@ -630,14 +1249,43 @@ async def seed_workout_plans():
 @app.on_event("startup")
 async def startup():
     await seed_workout_plans()
+    plans, _ = await plans_cache.get()
+    await exercise_index.ensure_indexes()
+    await custom_plans.ensure_indexes()
+    await progression.ensure_indexes()
+    await exercise_index.index_templates(plans)
     await db.users.create_index("email", unique=True)
     await db.users.create_index("id", unique=True)
-    await db.weight_entries.create_index([("user_id", 1), ("date", -1)])
-    await db.water_intake.create_index([("user_id", 1), ("date", 1)])
+    await tracking.ensure_indexes()
     await db.workout_logs.create_index([("user_id", 1), ("date", -1)])
-    await db.progress_photos.create_index([("user_id", 1), ("date", -1)])
+    await db.progress_photos.create_index(PHOTO_LIST_INDEX)
+    await db.watermarks.create_index("user_id")
+    # Exports walk each user's documents in _id order
+    for name in ("weight_entries", "water_intake", "weight_buckets", "water_buckets", "workout_logs", "progress_photos",
+                 "custom_plans"):
+        await db[name].create_index([("user_id", 1), ("_id", 1)])
+    await idempotency.store.ensure_indexes()
+    await account_deleter.ensure_indexes()
+    await photo_uploads.ensure_indexes()
+    await photo_blobs.ensure_indexes()
+    await task_queue.store.ensure_indexes()
+    await reminders.ensure_indexes()
+    await streaks.ensure_indexes()
+    if RUN_TASK_WORKER:
+        task_queue.start()
+    await account_deleter.resume_pending()
+    await photo_uploads.schedule_sweep()
+    if REMINDERS_ENABLED:
+        await reminders.schedule()
+    await streaks.schedule()
+    if CACHE_BUS_ENABLED:
+        await cache_bus.enable_pre_images()
+        cache_bus.start()
     logger.info("Fat2FitXpress API started")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await task_queue.stop()
+    await cache_bus.stop()
     client.close()
+    log_listener.stop()
@@ -0,0 +1,125 @@
+import os
+import asyncio
+from datetime import datetime, timezone
+from pathlib import Path
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+from tracking import DocumentTrackingStore
+
+load_dotenv(Path(__file__).parent / '.env')
+
+# collection -> (calendar-day fields, timestamp fields)
+DATE_FIELDS = {
+    "users": ([], ["created_at"]),
+    "weight_entries": (["date"], ["created_at"]),
+    "water_intake": (["date"], []),
+    "workout_logs": (["date"], ["created_at"]),
+    "progress_photos": (["date"], ["created_at"]),
+}
+
+# Covering index of the photo list (PHOTO_LIST_INDEX in main.py)
+PHOTO_LIST_INDEX = [("user_id", 1), ("date", -1), ("id", 1), ("note", 1), ("photo_url", 1), ("created_at", 1)]
+
+# Index keys made redundant by the covering indexes
+SUPERSEDED_INDEXES = {
+    "weight_entries": [("user_id", 1), ("date", -1)],
+    "water_intake": [("user_id", 1), ("date", 1)],
+    "progress_photos": [("user_id", 1), ("date", -1)],
+}
+
+BATCH_SIZE = 1000
+
+
+def to_date(field: str, fmt: str = None) -> dict:
+    """Server-side string -> BSON date. Strings Mongo can't parse are left as they are."""
+    spec = {"dateString": f"${field}", "timezone": "UTC", "onError": f"${field}"}
+    if fmt:
+        spec["format"] = fmt
+    return {"$dateFromString": spec}
+
+
+async def convert_leftovers(col, field: str) -> int:
+    """Python fallback for timestamps $dateFromString rejected (e.g. microsecond offsets)."""
+    ops = []
+    converted = 0
+    async for doc in col.find({field: {"$type": "string"}}, {field: 1}):
+        try:
+            value = datetime.fromisoformat(doc[field])
+        except ValueError:
+            print(f"  Warning: {col.name}.{field} = {doc[field]!r} is not a date, left as is")
+            continue
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {field: value}}))
+        if len(ops) >= BATCH_SIZE:
+            converted += (await col.bulk_write(ops, ordered=False)).modified_count
+            ops = []
+    if ops:
+        converted += (await col.bulk_write(ops, ordered=False)).modified_count
+    return converted
+
+
+async def drop_superseded(col, key):
+    """Drop an index whose keys are a prefix of a longer index on the same collection."""
+    indexes = await col.index_information()
+    names = [name for name, info in indexes.items() if info["key"] == key]
+    if names and any(len(info["key"]) > len(key) and info["key"][:len(key)] == key for info in indexes.values()):
+        await col.drop_index(names[0])
+        print(f"  Dropped superseded index {col.name}.{names[0]}")
+
+
+async def migrate_dates():
+    """
+    Converts the string `date` ("YYYY-MM-DD") and `created_at` (ISO-8601) fields
+    to BSON dates, creates the covering indexes and drops the ones they replace.
+    Safe to re-run; only string values are touched.
+
+    Run it with the API stopped, before starting the version that stores BSON
+    dates: that version only matches BSON dates and the previous one only
+    strings, so while both kinds exist either would miss documents (and water
+    upserts would create a second document for the same day).
+    """
+    mongo_url = os.environ.get('MONGO_URL')
+    db_name = os.environ.get('DB_NAME', 'fat2fitxpress')
+    if not mongo_url:
+        print("Error: MONGO_URL not found in environment.")
+        return
+
+    client = AsyncIOMotorClient(mongo_url, tz_aware=True)
+    db = client[db_name]
+    print(f"Connecting to {db_name}...")
+
+    for name, (day_fields, time_fields) in DATE_FIELDS.items():
+        col = db[name]
+        for field in day_fields:
+            result = await col.update_many({field: {"$type": "string"}},
+                                           [{"$set": {field: to_date(field, "%Y-%m-%d")}}])
+            print(f"{name}.{field}: converted {result.modified_count} documents")
+        for field in time_fields:
+            result = await col.update_many({field: {"$type": "string"}}, [{"$set": {field: to_date(field)}}])
+            leftovers = await convert_leftovers(col, field)
+            print(f"{name}.{field}: converted {result.modified_count + leftovers} documents")
+
+    # weight_buckets keep [weight, created_at] pairs
+    result = await db.weight_buckets.update_many({}, [{"$set": {"days": {"$arrayToObject": {"$map": {
+        "input": {"$objectToArray": "$days"},
+        "in": {"k": "$$this.k", "v": [
+            {"$arrayElemAt": ["$$this.v", 0]},
+            {"$convert": {"input": {"$arrayElemAt": ["$$this.v", 1]}, "to": "date",
+                          "onError": {"$arrayElemAt": ["$$this.v", 1]}}},
+        ]},
+    }}}}}])
+    print(f"weight_buckets: rewrote {result.modified_count} documents")
+
+    await DocumentTrackingStore(db).ensure_indexes()
+    await db.progress_photos.create_index(PHOTO_LIST_INDEX)
+    for name, key in SUPERSEDED_INDEXES.items():
+        await drop_superseded(db[name], key)
+
+    client.close()
+    print("Migration complete.")
+
+if __name__ == "__main__":
+    asyncio.run(migrate_dates())
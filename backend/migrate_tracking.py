@@ -0,0 +1,76 @@
+import os
+import asyncio
+from pathlib import Path
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+
+from tracking import BucketedTrackingStore
+
+load_dotenv(Path(__file__).parent / '.env')
+
+DATE_MATCH = {"date": {"$type": "date"}}
+
+def bucket_pipeline(value, into: str, extra_group: dict = None, extra_fields: dict = None):
+    """Group per-day documents into one document per (user, month) and $merge them
+    into `into`. Days already present in a bucket (written after the switch) win."""
+    group = {
+        "_id": {"user_id": "$user_id", "month": {"$dateToString": {"date": "$date", "format": "%Y-%m"}}},
+        "days": {"$push": {"k": {"$dateToString": {"date": "$date", "format": "%d"}}, "v": value}},
+        **(extra_group or {}),
+    }
+    project = {
+        "_id": {"$concat": ["$_id.user_id", ":", "$_id.month"]},
+        "user_id": "$_id.user_id", "month": "$_id.month",
+        "days": {"$arrayToObject": "$days"},
+        **(extra_fields or {}),
+    }
+    return [
+        {"$match": DATE_MATCH},
+        {"$sort": {"date": 1}},
+        {"$group": group},
+        {"$project": project},
+        {"$merge": {
+            "into": into, "on": "_id", "whenNotMatched": "insert",
+            "whenMatched": [{"$set": {"days": {"$mergeObjects": ["$$new.days", "$days"]}}}],
+        }},
+    ]
+
+async def bucket_tracking(db):
+    """Bucket both collections of `db` and index the buckets."""
+    water_docs = await db.water_intake.count_documents({})
+    print(f"Bucketing {water_docs} water_intake documents...")
+    await db.water_intake.aggregate(bucket_pipeline(
+        "$glasses", "water_buckets",
+        extra_group={"goal": {"$last": "$goal"}}, extra_fields={"goal": {"$ifNull": ["$goal", 8]}},
+    )).to_list(None)
+    print(f"water_buckets now holds {await db.water_buckets.count_documents({})} documents.")
+
+    weight_docs = await db.weight_entries.count_documents({})
+    print(f"Bucketing {weight_docs} weight_entries documents...")
+    await db.weight_entries.aggregate(bucket_pipeline(["$weight", "$created_at"], "weight_buckets")).to_list(None)
+    print(f"weight_buckets now holds {await db.weight_buckets.count_documents({})} documents.")
+
+    await BucketedTrackingStore(db).ensure_indexes()
+
+async def migrate_tracking():
+    """
+    Copies water_intake and weight_entries into the monthly bucket collections
+    used by TRACKING_LAYOUT=bucketed. Safe to re-run; source collections are left untouched.
+    Run migrate_dates.py first: only documents with BSON dates are copied.
+    """
+    mongo_url = os.environ.get('MONGO_URL')
+    db_name = os.environ.get('DB_NAME', 'fat2fitxpress')
+    if not mongo_url:
+        print("Error: MONGO_URL not found in environment.")
+        return
+
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[db_name]
+    print(f"Connecting to {db_name}...")
+    await bucket_tracking(db)
+
+    client.close()
+    print("Migration complete. Set TRACKING_LAYOUT=bucketed to serve from the new layout.")
+
+if __name__ == "__main__":
+    asyncio.run(migrate_tracking())
@@ -0,0 +1,212 @@
+"""
+Progressive-overload suggestions.
+
+Each (user, exercise) has a small state document in `exercise_progress` that is
+folded forward one session at a time by `apply_session` (double progression:
+add reps within the plan's rep range, then add weight and drop back to the
+bottom of the range; repeated misses deload by 10%). Logging a workout updates
+the states of its exercises in one read and one bulk write, so a suggestion
+never needs a history rescan. `rebuild_user` replays a user's full history and
+is used for back-dated logs and by `precompute_overload.py`.
+"""
+import re
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from dates import to_api, utc_now
+
+DEFAULT_REP_RANGE = (8, 12)
+REP_RANGES_TTL_SECONDS = 3600.0
+DELOAD_AFTER_MISSES = 2
+DELOAD_FACTOR = 0.9
+LOWER_BODY = ("leg", "quad", "hamstring", "glute", "calve", "back/legs", "posterior")
+
+
+def exercise_key(name: str) -> str:
+    return re.sub(r"\s+", " ", (name or "").strip().lower())
+
+
+def parse_rep_range(reps) -> Tuple[int, int]:
+    """'8-10' -> (8, 10); '12' -> (12, 12); time-based or missing -> default."""
+    numbers = [int(n) for n in re.findall(r"\d+", str(reps or ""))]
+    if not numbers or str(reps).rstrip().endswith("s"):
+        return DEFAULT_REP_RANGE
+    return (numbers[0], numbers[-1]) if len(numbers) > 1 else (numbers[0], numbers[0])
+
+
+def weight_step(muscle_group: Optional[str]) -> float:
+    group = (muscle_group or "").lower()
+    return 5.0 if any(k in group for k in LOWER_BODY) else 2.5
+
+
+def round_to(weight: float, step: float = 1.25) -> float:
+    return round(round(weight / step) * step, 2)
+
+
+def new_state(user_id: str, name: str, muscle_group: Optional[str], rep_range: Tuple[int, int]) -> dict:
+    return {
+        "user_id": user_id, "exercise": exercise_key(name), "name": name, "muscle_group": muscle_group,
+        "rep_range": list(rep_range), "sessions": 0, "last_date": None,
+        "last_weight": 0.0, "last_reps": [], "best_e1rm": 0.0, "misses": 0,
+        "suggestion": None,
+    }
+
+
+def apply_session(state: dict, sets: List[dict], date) -> dict:
+    """Fold one logged session into the state and set the next suggestion. Pure; O(sets)."""
+    done = []
+    for s in sets:
+        try:
+            reps, weight = int(float(s.get("reps") or 0)), float(s.get("weight") or 0)
+        except (AttributeError, TypeError, ValueError):
+            continue
+        if reps > 0:
+            done.append((reps, weight))
+    if not done:
+        return state
+    lo, hi = state["rep_range"]
+    working = max(w for _, w in done)
+    reps = [r for r, w in done if w == working]
+    e1rm = max(w * (1 + r / 30) for r, w in done)
+
+    state = dict(state, sessions=state["sessions"] + 1, last_date=date, last_weight=working,
+                 last_reps=reps, best_e1rm=round(max(state["best_e1rm"], e1rm), 2))
+    if working == 0:
+        # Bodyweight: progress reps only
+        state["misses"] = 0
+        state["suggestion"] = {"weight": 0.0, "reps": min(reps) + 1, "reason": "add_reps"}
+    elif min(reps) >= hi:
+        state["misses"] = 0
+        step = weight_step(state.get("muscle_group"))
+        state["suggestion"] = {"weight": round_to(working + step), "reps": lo, "reason": "add_weight"}
+    elif min(reps) >= lo:
+        state["misses"] = 0
+        state["suggestion"] = {"weight": working, "reps": min(min(reps) + 1, hi), "reason": "add_reps"}
+    else:
+        state["misses"] = state["misses"] + 1
+        if state["misses"] >= DELOAD_AFTER_MISSES:
+            state["misses"] = 0
+            state["suggestion"] = {"weight": round_to(working * DELOAD_FACTOR), "reps": lo, "reason": "deload"}
+        else:
+            state["suggestion"] = {"weight": working, "reps": lo, "reason": "repeat"}
+    return state
+
+
+class ProgressionEngine:
+    STATE_FIELDS = {"_id": 0, "exercise": 1, "name": 1, "muscle_group": 1, "rep_range": 1, "sessions": 1,
+                    "last_date": 1, "last_weight": 1, "last_reps": 1, "best_e1rm": 1, "misses": 1,
+                    "suggestion": 1, "updated_at": 1}
+
+    def __init__(self, db, queue=None, rep_ranges_ttl: Callable[[], float] = lambda: REP_RANGES_TTL_SECONDS):
+        self.db = db
+        self.col = db.exercise_progress
+        self.queue = queue
+        self.rep_ranges_ttl = rep_ranges_ttl
+        self._rep_ranges: Optional[Dict[str, Tuple[int, int]]] = None
+        self._rep_ranges_loaded_at = 0.0
+        self.conflicts = 0
+        if queue is not None:
+            queue.handler("progression.rebuild")(self._rebuild_task)
+
+    async def ensure_indexes(self):
+        await self.col.create_index([("user_id", 1), ("exercise", 1)], unique=True)
+
+    async def rep_range(self, name: str) -> Tuple[int, int]:
+        """Rep range prescribed for the exercise in the seeded plans (first match).
+        Cached until `invalidate_rep_ranges` or for `rep_ranges_ttl()` seconds."""
+        if self._rep_ranges is None or time.monotonic() - self._rep_ranges_loaded_at > self.rep_ranges_ttl():
+            ranges = {}
+            async for plan in self.db.workout_plans.find({}, {"_id": 0, "days.exercises.name": 1, "days.exercises.reps": 1}):
+                for day in plan.get("days", []):
+                    for ex in day.get("exercises", []):
+                        ranges.setdefault(exercise_key(ex.get("name")), parse_rep_range(ex.get("reps")))
+            self._rep_ranges, self._rep_ranges_loaded_at = ranges, time.monotonic()
+        return self._rep_ranges.get(exercise_key(name), DEFAULT_REP_RANGE)
+
+    def invalidate_rep_ranges(self):
+        self._rep_ranges = None
+
+    async def _fold(self, user_id: str, states: Dict[str, dict], exercises: Iterable[dict], date: datetime):
+        for ex in exercises:
+            key = exercise_key(ex.get("name"))
+            if not key or not isinstance(ex.get("sets"), list):
+                continue
+            if key not in states:
+                states[key] = new_state(user_id, ex["name"], ex.get("muscle_group"), await self.rep_range(ex["name"]))
+            states[key] = apply_session(states[key], ex["sets"], date)
+
+    async def _save(self, states: Iterable[dict], read: Optional[Dict[str, int]] = None) -> bool:
+        """Write the states. With `read` (exercise -> `sessions` when it was read; new states
+        count as 0) each write is conditional on that count, and False means a concurrent
+        fold got there first for at least one of them."""
+        now = utc_now()
+        ops = []
+        for s in states:
+            query = {"user_id": s["user_id"], "exercise": s["exercise"]}
+            if read is not None:
+                query["sessions"] = read.get(s["exercise"], 0)
+            ops.append(UpdateOne(query, {"$set": {**s, "updated_at": now}}, upsert=True))
+        if not ops:
+            return True
+        try:
+            result = await self.col.bulk_write(ops, ordered=False)
+        except BulkWriteError:
+            # Upsert of a state another fold created (or moved on) in the meantime
+            return False
+        return result.matched_count + result.upserted_count == len(ops)
+
+    async def record(self, user_id: str, log: dict) -> bool:
+        """Fold a new workout log into the user's states. A log older than a state it
+        touches can't be folded forward, so a full rebuild is queued instead; so is one when
+        a concurrent log for the same exercise was saved between our read and write."""
+        date = log["date"]
+        keys = [exercise_key(ex.get("name")) for ex in log.get("exercises", [])]
+        states = {s["exercise"]: s async for s in self.col.find(
+            {"user_id": user_id, "exercise": {"$in": keys}}, {"_id": 0, "updated_at": 0})}
+        if any(s["last_date"] and s["last_date"] > date for s in states.values()):
+            await self.queue_rebuild(user_id)
+            return False
+        read = {key: s["sessions"] for key, s in states.items()}
+        await self._fold(user_id, states, log.get("exercises", []), date)
+        if not await self._save(states.values(), read):
+            self.conflicts += 1
+            await self.queue_rebuild(user_id)
+            return False
+        return True
+
+    async def queue_rebuild(self, user_id: str):
+        if self.queue is not None:
+            await self.queue.enqueue("progression.rebuild", {"user_id": user_id},
+                                     dedupe_key=f"progression.rebuild:{user_id}")
+        else:
+            await self.rebuild_user(user_id)
+
+    async def rebuild_user(self, user_id: str) -> int:
+        """Recompute every state of one user from their full history. Returns sessions folded."""
+        states: Dict[str, dict] = {}
+        sessions = 0
+        cursor = self.db.workout_logs.find({"user_id": user_id}, {"_id": 0, "date": 1, "exercises": 1}).sort(
+            [("date", 1), ("created_at", 1)])
+        async for log in cursor:
+            await self._fold(user_id, states, log.get("exercises", []), log["date"])
+            sessions += 1
+        await self.col.delete_many({"user_id": user_id, "exercise": {"$nin": list(states)}})
+        await self._save(states.values())
+        return sessions
+
+    async def _rebuild_task(self, payload: dict):
+        await self.rebuild_user(payload["user_id"])
+
+    async def active_users(self, since: datetime) -> List[str]:
+        return await self.db.workout_logs.distinct("user_id", {"date": {"$gte": since}})
+
+    async def suggestions(self, user_id: str, names: Optional[List[str]] = None) -> List[dict]:
+        query = {"user_id": user_id}
+        if names:
+            query["exercise"] = {"$in": [exercise_key(n) for n in names]}
+        states = await self.col.find(query, self.STATE_FIELDS).sort("exercise", 1).to_list(500)
+        return [to_api(s, days=("last_date",)) for s in states]
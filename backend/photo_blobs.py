@@ -0,0 +1,149 @@
+"""
+Content-addressed photo storage.
+
+Photo bytes are stored once per distinct content, under
+`progress-photos/sha256/<digest>.<ext>`, with a reference count per object in
+`photo_blobs` (`_id` is the S3 key). Each `progress_photos` document holds one
+reference: `acquire` adds one (uploading the bytes only if nobody holds them),
+`release` drops one and reports when the last one went, after which `collect`
+deletes the object.
+
+`acquire` takes its reference before uploading (a new blob is inserted as
+`pending` and later uploaders of a pending blob upload too, which is harmless
+for identical bytes). `collect` only locks blobs with no references, by
+setting `refs` to -1, and an acquire that races it waits on the duplicate
+`_id` until the blob is gone. So an object is never deleted while a photo
+points at it.
+
+Photos stored before this (random `progress-photos/<id>.<ext>` keys) have no
+blob document; `is_content_addressed` tells the two apart.
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from dates import utc_now
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "progress-photos/sha256/"
+ACQUIRE_ATTEMPTS = 50
+
+
+def content_key(digest: str, ext: str) -> str:
+    return f"{KEY_PREFIX}{digest}.{ext}"
+
+
+def is_content_addressed(key: str) -> bool:
+    return key.startswith(KEY_PREFIX)
+
+
+def decode_base64(data: str, chunk_chars: int = 4 * 64 * 1024) -> Tuple[bytes, str]:
+    """Decode base64 a slice at a time, hashing as it goes. Returns (bytes, sha256 hex)."""
+    data = "".join(data.split())  # base64 may be line-wrapped
+    digest, out = hashlib.sha256(), io.BytesIO()
+    for i in range(0, len(data), chunk_chars):  # chunk_chars is a multiple of 4
+        part = base64.b64decode(data[i:i + chunk_chars])
+        digest.update(part)
+        out.write(part)
+    return out.getvalue(), digest.hexdigest()
+
+
+class PhotoBlobs:
+    def __init__(self, collection, s3_client, bucket: str, queue=None):
+        self.col = collection
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.queue = queue
+        self.deduplicated = 0
+        if queue is not None:
+            queue.handler("photo_blobs.collect")(self._collect_task)
+
+    async def ensure_indexes(self):
+        await self.col.create_index("refs")
+
+    async def acquire(self, key: str, put: Callable[[], Awaitable[None]], size: int = 0,
+                      content_type: Optional[str] = None) -> bool:
+        """Take a reference to `key`, calling `put` to store the bytes unless a live
+        blob already holds them. Returns True if the bytes were stored, False if
+        deduplicated."""
+        for _ in range(ACQUIRE_ATTEMPTS):
+            held = await self.col.find_one_and_update(
+                {"_id": key, "refs": {"$gte": 0}}, {"$inc": {"refs": 1}, "$unset": {"released_at": ""}},
+                projection={"pending": 1},
+            )
+            if held and not held.get("pending"):
+                self.deduplicated += 1
+                return False
+            if not held:
+                try:
+                    await self.col.insert_one({"_id": key, "refs": 1, "pending": True, "size": size,
+                                               "content_type": content_type, "created_at": utc_now()})
+                except DuplicateKeyError:
+                    # Inserted concurrently (the retry increments it) or being collected
+                    # (the retry inserts once the lock is gone)
+                    await asyncio.sleep(0.05)
+                    continue
+            # We hold a reference, so the blob can't be collected while the bytes are
+            # stored; a pending blob's first uploader may have failed, so upload too
+            try:
+                await put()
+            except Exception:
+                if await self.release(key):
+                    await self.schedule_collect([key])
+                raise
+            await self.col.update_one({"_id": key}, {"$unset": {"pending": ""}})
+            return True
+        raise RuntimeError(f"Could not acquire photo blob {key}")
+
+    async def release(self, key: str) -> bool:
+        """Drop one reference. Returns True if it was the last one and the object
+        should be collected."""
+        blob = await self.col.find_one_and_update(
+            {"_id": key, "refs": {"$gt": 0}}, {"$inc": {"refs": -1}},
+            projection={"refs": 1}, return_document=ReturnDocument.AFTER,
+        )
+        if blob and blob["refs"] == 0:
+            await self.col.update_one({"_id": key, "refs": 0}, {"$set": {"released_at": utc_now()}})
+            return True
+        return False
+
+    async def release_many(self, keys: Iterable[str]) -> List[str]:
+        """`release` for each key (one reference per occurrence). Returns the keys to collect."""
+        return [key for key in keys if await self.release(key)]
+
+    async def collect(self, key: str) -> bool:
+        """Delete an unreferenced blob and its object. Safe to retry."""
+        locked = await self.col.find_one_and_update(
+            {"_id": key, "refs": {"$lte": 0}}, {"$set": {"refs": -1}}, projection={"_id": 1},
+        )
+        if not locked:
+            return False  # re-acquired (or already collected)
+        await asyncio.to_thread(self.s3.delete_object, Bucket=self.bucket, Key=key)
+        await self.col.delete_one({"_id": key, "refs": -1})
+        return True
+
+    async def schedule_collect(self, keys: Iterable[str]):
+        for key in keys:
+            if self.queue is not None:
+                await self.queue.enqueue("photo_blobs.collect", {"key": key}, dedupe_key=f"photo_blobs.collect:{key}")
+            else:
+                await self.collect(key)
+
+    async def _collect_task(self, payload: dict):
+        await self.collect(payload["key"])
+
+    async def stats(self) -> dict:
+        totals = await self.col.aggregate([
+            {"$group": {"_id": None, "blobs": {"$sum": 1}, "refs": {"$sum": {"$max": ["$refs", 0]}},
+                        "bytes": {"$sum": "$size"}}},
+        ]).to_list(1)
+        totals = totals[0] if totals else {"blobs": 0, "refs": 0, "bytes": 0}
+        totals.pop("_id", None)
+        return {**totals, "deduplicated_since_start": self.deduplicated}
@@ -0,0 +1,230 @@
+"""
+Direct-to-S3 progress photo uploads.
+
+Instead of posting base64 through the API, the client asks for an upload
+(`create`), gets a presigned POST restricted to one `progress-photos/` key,
+one content type and a size range, sends the file straight to S3 and then
+calls `confirm`. The client also sends the SHA-256 of the file, which the
+POST policy pins as the object's `x-amz-checksum-sha256`, so S3 rejects an
+upload whose bytes don't match it. Confirming HEADs the object, checks its
+size, type and S3-verified checksum and moves it to the content-addressed key
+built from that checksum in `photo_blobs` before inserting the
+`progress_photos` document, so the API never receives the image bytes.
+
+Pending uploads live in `photo_uploads` until they are confirmed. The
+`photo_uploads.sweep` task deletes the ones that were never confirmed (and
+their S3 objects, if the client got that far); it re-queues itself every
+`SWEEP_INTERVAL`. Confirming is allowed for `CONFIRM_GRACE` after the POST
+policy expires, and the sweep waits `SWEEP_GRACE` (longer) before touching
+an upload, so the two never race.
+"""
+import asyncio
+import base64
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from dates import iso, to_day, utc_now
+from photo_blobs import content_key
+
+logger = logging.getLogger(__name__)
+
+SHA256_PATTERN = r"^[0-9a-fA-F]{64}$"
+CONTENT_TYPES = {"image/jpeg": "jpeg", "image/png": "png", "image/webp": "webp", "image/heic": "heic"}
+CONFIRM_GRACE = timedelta(minutes=10)
+SWEEP_GRACE = timedelta(hours=1)
+SWEEP_INTERVAL = timedelta(minutes=15)
+SWEEP_BATCH = 500
+
+
+class UploadError(Exception):
+    """Raised by `confirm`; `status` is the HTTP status to answer with."""
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def s3_checksum(sha256_hex: str) -> str:
+    """Hex SHA-256 -> the base64 form S3 uses for `x-amz-checksum-sha256`."""
+    return base64.b64encode(bytes.fromhex(sha256_hex)).decode()
+
+
+# --- S3 side (sync; run in a thread) ---
+def presigned_post(s3, bucket: str, key: str, content_type: str, max_bytes: int, expires_in: int,
+                   sha256: Optional[str] = None) -> dict:
+    """A POST policy for exactly `key`, `content_type` and 1..max_bytes bytes, and
+    with `sha256` (hex) for exactly those bytes: S3 checks the checksum on upload."""
+    fields = {"Content-Type": content_type}
+    if sha256:
+        fields.update({"x-amz-checksum-algorithm": "SHA256", "x-amz-checksum-sha256": s3_checksum(sha256)})
+    return s3.generate_presigned_post(
+        Bucket=bucket, Key=key,
+        Fields=fields,
+        Conditions=[*({name: value} for name, value in fields.items()), ["content-length-range", 1, max_bytes]],
+        ExpiresIn=expires_in,
+    )
+
+
+def verify_object(s3, bucket: str, key: str, content_type: str, max_bytes: int,
+                  sha256: Optional[str] = None) -> Tuple[int, Optional[str]]:
+    """HEAD the uploaded object and return its size and S3-verified SHA-256 (hex,
+    None if S3 has no checksum for it). Raises UploadError if it is missing or
+    doesn't match what the upload was issued for."""
+    try:
+        head = s3.head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            raise UploadError(409, "Photo has not been uploaded yet")
+        raise
+    size = head.get("ContentLength", 0)
+    if not 0 < size <= max_bytes:
+        raise UploadError(400, f"Photo must be between 1 and {max_bytes} bytes")
+    if head.get("ContentType") != content_type:
+        raise UploadError(400, f"Photo content type must be {content_type}")
+    checksum = head.get("ChecksumSHA256")
+    if sha256 and checksum != s3_checksum(sha256):
+        raise UploadError(400, "Photo checksum does not match the upload")
+    return size, base64.b64decode(checksum).hex() if checksum else None
+
+
+class PhotoUploads:
+    def __init__(self, db, s3_client, bucket: str, url_prefix: str, max_bytes: int = 10 * 1024 * 1024,
+                 ttl_seconds: int = 900, queue=None, blobs=None):
+        self.db = db
+        self.col = db.photo_uploads
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.url_prefix = url_prefix
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.queue = queue
+        self.blobs = blobs
+        if queue is not None:
+            queue.handler("photo_uploads.sweep")(self._sweep_task)
+
+    async def ensure_indexes(self):
+        await self.col.create_index("id", unique=True)
+        await self.col.create_index("expires_at")
+
+    async def create(self, user_id: str, content_type: str, date: str, note: str = "",
+                     sha256: Optional[str] = None) -> dict:
+        """Issue a presigned POST. `sha256` is the hex digest of the file the client will send."""
+        photo_id = str(uuid.uuid4())
+        key = f"progress-photos/{photo_id}.{CONTENT_TYPES[content_type]}"
+        sha256 = sha256.lower() if sha256 else None
+        post = await asyncio.to_thread(presigned_post, self.s3, self.bucket, key, content_type,
+                                       self.max_bytes, self.ttl_seconds, sha256)
+        now = utc_now()
+        expires_at = now + timedelta(seconds=self.ttl_seconds)
+        await self.col.insert_one({
+            "id": photo_id, "user_id": user_id, "key": key, "photo_url": self.url_prefix + key,
+            "content_type": content_type, "sha256": sha256, "date": to_day(date), "note": note or "",
+            "created_at": now, "expires_at": expires_at,
+        })
+        return {"upload_id": photo_id, "url": post["url"], "fields": post["fields"],
+                "max_bytes": self.max_bytes, "expires_at": iso(expires_at)}
+
+    async def confirm(self, user_id: str, upload_id: str) -> dict:
+        """Verify the uploaded object and create its photo document. Confirming an
+        already-confirmed upload returns the same photo."""
+        photo = await self._confirmed(user_id, upload_id)
+        if photo:
+            return photo
+        upload = await self.col.find_one({"id": upload_id, "user_id": user_id}, {"_id": 0})
+        if not upload:
+            raise UploadError(404, "Upload not found")
+        if upload["expires_at"] + CONFIRM_GRACE < utc_now():
+            raise UploadError(410, "Upload expired")
+
+        try:
+            size, digest = await asyncio.to_thread(verify_object, self.s3, self.bucket, upload["key"],
+                                                   upload["content_type"], self.max_bytes, upload.get("sha256"))
+        except UploadError as e:
+            if e.status == 400:
+                # The object can never be confirmed; don't keep it until the sweep
+                await asyncio.to_thread(self._delete_object, upload["key"])
+                await self.col.delete_one({"id": upload_id})
+            elif photo := await self._confirmed(user_id, upload_id):
+                return photo
+            raise
+
+        key = upload["key"]
+        # Uploads issued without a checksum keep their own key
+        blobs = self.blobs if digest else None
+        if blobs is not None:
+            try:
+                key = content_key(digest, CONTENT_TYPES[upload["content_type"]])
+                await blobs.acquire(key, lambda: asyncio.to_thread(self._copy_object, upload["key"], key),
+                                    size=size, content_type=upload["content_type"])
+            except ClientError:
+                # A concurrent confirm of the same upload finished and deleted the object
+                if photo := await self._confirmed(user_id, upload_id):
+                    return photo
+                raise
+
+        photo = {
+            "id": upload_id, "user_id": user_id, "date": upload["date"], "photo_url": self.url_prefix + key,
+            "note": upload["note"], "size": size, "created_at": utc_now(),
+        }
+        result = await self.db.progress_photos.update_one({"id": upload_id}, {"$setOnInsert": photo}, upsert=True)
+        if blobs is not None:
+            if result.upserted_id is None and await blobs.release(key):
+                # A concurrent confirm of the same upload got there first
+                await blobs.schedule_collect([key])
+            await asyncio.to_thread(self._delete_object, upload["key"])
+        await self.col.delete_one({"id": upload_id})
+        return await self.db.progress_photos.find_one({"id": upload_id}, {"_id": 0, "photo_base64": 0})
+
+    async def _confirmed(self, user_id: str, upload_id: str) -> Optional[dict]:
+        return await self.db.progress_photos.find_one({"id": upload_id, "user_id": user_id},
+                                                      {"_id": 0, "photo_base64": 0})
+
+    def _delete_object(self, key: str):
+        self.s3.delete_object(Bucket=self.bucket, Key=key)
+
+    def _copy_object(self, source: str, key: str):
+        self.s3.copy_object(Bucket=self.bucket, Key=key, CopySource={"Bucket": self.bucket, "Key": source},
+                            MetadataDirective="COPY")
+
+    def _delete_objects(self, keys):
+        response = self.s3.delete_objects(Bucket=self.bucket, Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True})
+        errors = response.get("Errors", [])
+        if errors:
+            raise RuntimeError(f"S3 delete_objects failed for {len(errors)} keys, e.g. {errors[0].get('Key')}")
+
+    async def sweep(self, now: Optional[datetime] = None) -> int:
+        """Delete uploads that were never confirmed, with their S3 objects. Returns
+        the number of uploads removed."""
+        cutoff = (now or utc_now()) - SWEEP_GRACE
+        removed = 0
+        while True:
+            batch = await self.col.find({"expires_at": {"$lt": cutoff}}, {"_id": 0, "id": 1, "key": 1}).limit(
+                SWEEP_BATCH).to_list(SWEEP_BATCH)
+            if not batch:
+                return removed
+            # Confirmed but interrupted before the upload was removed: keep the object
+            # only if the photo points at it (not when it was moved to a content key)
+            photo_urls = {p["id"]: p.get("photo_url") async for p in self.db.progress_photos.find(
+                {"id": {"$in": [u["id"] for u in batch]}}, {"_id": 0, "id": 1, "photo_url": 1})}
+            keys = [u["key"] for u in batch if photo_urls.get(u["id"]) != self.url_prefix + u["key"]]
+            if keys:
+                await asyncio.to_thread(self._delete_objects, keys)
+            result = await self.col.delete_many({"id": {"$in": [u["id"] for u in batch]}})
+            removed += result.deleted_count
+            if len(batch) < SWEEP_BATCH:
+                return removed
+
+    async def schedule_sweep(self, delay: float = 0):
+        if self.queue is not None:
+            await self.queue.enqueue("photo_uploads.sweep", delay=delay, dedupe_key="photo_uploads.sweep")
+
+    async def _sweep_task(self, payload: dict):
+        removed = await self.sweep()
+        if removed:
+            logger.info(f"Swept {removed} unconfirmed photo uploads")
+        await self.schedule_sweep(SWEEP_INTERVAL.total_seconds())
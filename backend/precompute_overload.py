@@ -0,0 +1,48 @@
+import os
+import asyncio
+import time
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+
+from overload import ProgressionEngine
+
+load_dotenv(Path(__file__).parent / '.env')
+
+async def precompute_overload():
+    """
+    Rebuilds progressive-overload suggestions from the full workout history of
+    every user who logged a workout in the last ACTIVE_DAYS (default 30) days.
+    Safe to re-run, e.g. nightly or after changing the progression rules.
+    """
+    mongo_url = os.environ.get('MONGO_URL')
+    db_name = os.environ.get('DB_NAME', 'fat2fitxpress')
+    if not mongo_url:
+        print("Error: MONGO_URL not found in environment.")
+        return
+
+    client = AsyncIOMotorClient(mongo_url, tz_aware=True)
+    db = client[db_name]
+    engine = ProgressionEngine(db)
+    await engine.ensure_indexes()
+
+    since = datetime.now(timezone.utc) - timedelta(days=int(os.environ.get('ACTIVE_DAYS', '30')))
+    users = await engine.active_users(since)
+    print(f"Rebuilding suggestions for {len(users)} active users...")
+
+    slots = asyncio.Semaphore(int(os.environ.get('PRECOMPUTE_CONCURRENCY', '8')))
+    sessions = 0
+
+    async def rebuild(user_id):
+        nonlocal sessions
+        async with slots:
+            sessions += await engine.rebuild_user(user_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(rebuild(u) for u in users))
+    print(f"Folded {sessions} sessions in {time.perf_counter() - start:.1f}s.")
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(precompute_overload())
@@ -0,0 +1,290 @@
+"""
+On-demand sampling profiler.
+
+A `Sampler` thread wakes every `interval` seconds, reads the stacks of the
+worker's threads from `sys._current_frames()` and counts identical stacks.
+Nothing is hooked into the code being profiled, so the cost is the sampling
+itself, which holds the GIL while it walks the frames. That cost is measured
+on every sample and the sleep stretched so it never exceeds `max_overhead` of
+wall time, whatever the stack depth or thread count. Runs are capped at
+`max_seconds`, and only one profile runs per worker at a time.
+
+Two modes:
+  - `Profiler.profile(seconds)`: every thread of the worker for a while (the
+    admin endpoint). Stacks are rooted at the thread's name; an idle event
+    loop shows up as its selector wait.
+  - `ProfilingMiddleware`: one request, when an authorized caller sends
+    `X-Profile: collapsed` (or `speedscope`). Only that request's task is
+    sampled: its live stack while it runs on the loop, its chain of awaits
+    (ending in `[await]`) while it's suspended on I/O or a thread, so the
+    profile adds up to the request's wall time. The response body is replaced
+    by the profile; the handler's status is in `X-Profiled-Status`.
+
+Profiles come out as collapsed stacks (`frame;frame;frame count` lines, for
+flamegraph.pl / speedscope / inferno) or as speedscope JSON.
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+PROFILE_HEADER = "X-Profile"
+FORMATS = ("collapsed", "speedscope")
+AWAIT_FRAME = "[await]"
+
+Stack = Tuple[str, ...]
+Take = Callable[[], Iterable[Stack]]
+
+
+class ProfilerBusy(Exception):
+    """Another profile is already running in this worker."""
+
+
+def _short_path(filename: str) -> str:
+    for marker in ("site-packages" + os.sep, "lib" + os.sep + "python"):
+        at = filename.rfind(marker)
+        if at != -1:
+            return filename[at + len(marker):]
+    return os.path.basename(filename)
+
+
+class _FrameNames:
+    """`function (file:line)` per code object, computed once per code object."""
+
+    def __init__(self):
+        self._names: Dict[object, str] = {}
+
+    def __call__(self, code) -> str:
+        name = self._names.get(code)
+        if name is None:
+            qualname = getattr(code, "co_qualname", code.co_name)  # co_qualname is 3.11+
+            name = self._names[code] = f"{qualname} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+        return name
+
+    def stack(self, frame) -> list:
+        """Frames from `frame` up to the thread's root, root first."""
+        names = []
+        while frame is not None:
+            names.append(self(frame.f_code))
+            frame = frame.f_back
+        names.reverse()
+        return names
+
+
+def _await_chain(coro) -> list:
+    """Frames of a suspended coroutine and everything it awaits, outermost first."""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return frames
+
+
+class Profile:
+    def __init__(self, stacks: Counter, interval: float, duration: float, samples: int, overhead: float, name: str):
+        # `samples` counts snapshots; a whole-worker snapshot adds one stack per thread
+        self.stacks = stacks
+        self.interval = interval
+        self.duration = duration
+        self.samples = samples
+        self.overhead = overhead
+        self.name = name
+
+    def collapsed(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def speedscope(self) -> dict:
+        frames, index = [], {}
+        samples, weights = [], []
+        # One weighted sample per distinct stack; weights are in seconds of wall time
+        per_sample = self.duration / self.samples if self.samples else self.interval
+        for stack, count in self.stacks.most_common():
+            ids = []
+            for name in stack:
+                if name not in index:
+                    index[name] = len(frames)
+                    frames.append({"name": name})
+                ids.append(index[name])
+            samples.append(ids)
+            weights.append(count * per_sample)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled", "name": self.name, "unit": "seconds",
+                "startValue": 0, "endValue": sum(weights), "samples": samples, "weights": weights,
+            }],
+            "name": self.name,
+            "exporter": "fat2fit profiler",
+        }
+
+    def headers(self) -> Dict[str, str]:
+        return {"X-Profile-Samples": str(self.samples), "X-Profile-Seconds": f"{self.duration:.3f}",
+                "X-Profile-Overhead": f"{self.overhead:.4f}"}
+
+    def render(self, fmt: str) -> Tuple[bytes, str]:
+        """(body, content type) in `fmt`, one of FORMATS."""
+        if fmt == "speedscope":
+            return json.dumps(self.speedscope()).encode(), "application/json"
+        return self.collapsed().encode(), "text/plain; charset=utf-8"
+
+
+class Sampler(threading.Thread):
+    """Counts the stacks `take()` returns every `interval` seconds until stopped,
+    keeping its own GIL time under `max_overhead` of wall time."""
+
+    def __init__(self, take: Take, interval: float, max_overhead: float, max_seconds: float):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.take = take
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.max_seconds = max_seconds
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.cost = 0.0
+        self.elapsed = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        deadline = start + self.max_seconds
+        delay = self.interval
+        while not self._stop_event.wait(delay):
+            before = time.perf_counter()
+            if before >= deadline:
+                break
+            self.stacks.update(self.take())
+            self.samples += 1
+            spent = time.perf_counter() - before
+            self.cost += spent
+            # Sleep long enough that sampling stays under the cap on average
+            delay = max(self.interval, spent / self.max_overhead - spent)
+        self.elapsed = time.perf_counter() - start
+
+    def stop(self) -> "Sampler":
+        self._stop_event.set()
+        self.join()
+        return self
+
+    def profile(self, name: str) -> Profile:
+        overhead = self.cost / self.elapsed if self.elapsed else 0.0
+        return Profile(self.stacks, self.interval, self.elapsed, self.samples, overhead, name)
+
+
+class Profiler:
+    def __init__(self, interval: float = 0.005, request_interval: float = 0.001, max_overhead: float = 0.02,
+                 max_seconds: float = 60.0):
+        self.interval = interval
+        self.request_interval = request_interval
+        self.max_overhead = max_overhead
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self.profiles = 0
+
+    def _start(self, take: Take, interval: float, seconds: float) -> Sampler:
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        sampler = Sampler(take, interval, self.max_overhead, min(seconds, self.max_seconds))
+        sampler.start()
+        self.profiles += 1
+        return sampler
+
+    def _finish(self, sampler: Sampler, name: str) -> Profile:
+        try:
+            return sampler.stop().profile(name)
+        finally:
+            self._lock.release()
+
+    async def profile(self, seconds: float) -> Profile:
+        """Sample every thread of this worker for `seconds` (capped at max_seconds)."""
+        seconds = min(seconds, self.max_seconds)
+        names = _FrameNames()
+
+        def take() -> list:
+            own = threading.get_ident()  # the sampler thread
+            threads = {t.ident: t.name for t in threading.enumerate()}
+            return [(threads.get(ident, str(ident)), *names.stack(frame))
+                    for ident, frame in sys._current_frames().items() if ident != own]
+
+        sampler = self._start(take, self.interval, seconds)
+        await asyncio.sleep(seconds)
+        return self._finish(sampler, f"worker {os.getpid()}, {seconds:g}s")
+
+    def start_task(self, task: asyncio.Task) -> Sampler:
+        """Start sampling one task (running or awaiting); `finish` it for the profile."""
+        loop = task.get_loop()
+        loop_thread = threading.get_ident()
+        names = _FrameNames()
+
+        def take() -> list:
+            if task.done():
+                return []
+            if asyncio.current_task(loop) is task:
+                frame = sys._current_frames().get(loop_thread)
+                return [tuple(names.stack(frame))] if frame is not None else []
+            # Suspended: the coroutine chain from the task's root down to what it awaits
+            chain = _await_chain(task.get_coro())
+            return [(*(names(f.f_code) for f in chain), AWAIT_FRAME)] if chain else []
+
+        # Finer than whole-worker sampling: most requests take a few ms
+        return self._start(take, self.request_interval, self.max_seconds)
+
+    def finish(self, sampler: Sampler, name: str) -> Profile:
+        return self._finish(sampler, name)
+
+    def stats(self) -> dict:
+        return {"profiles": self.profiles, "running": self._lock.locked(),
+                "interval_ms": self.interval * 1000, "max_overhead": self.max_overhead}
+
+
+class ProfilingMiddleware:
+    """Profiles a single request that sends `X-Profile` with a bearer token
+    `authorize(token)` accepts."""
+
+    def __init__(self, app: ASGIApp, profiler: Profiler, authorize: Callable[[str], bool], enabled: bool = False):
+        self.app = app
+        self.profiler = profiler
+        self.authorize = authorize
+        self.enabled = enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        headers = Headers(scope=scope) if scope["type"] == "http" and self.enabled else {}
+        fmt = headers.get(PROFILE_HEADER)
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        if fmt not in FORMATS or scheme.lower() != "bearer" or not token or not self.authorize(token):
+            await self.app(scope, receive, send)
+            return
+        try:
+            sampler = self.profiler.start_task(asyncio.current_task())
+        except ProfilerBusy:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def capture(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            profile = self.profiler.finish(sampler, f"{scope['method']} {scope['path']}")
+        body, content_type = profile.render(fmt)
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode()),
+            (b"x-profiled-status", str(status).encode()),
+            *((name.lower().encode(), value.encode()) for name, value in profile.headers().items()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,219 @@
+"""
+Token-bucket rate limiting and per-user concurrency caps.
+
+The limiter runs as a raw ASGI middleware so a rejected request is answered
+before FastAPI reads or parses its body (bcrypt in the auth routes, multi-MB
+base64 payloads on photo uploads). Buckets are kept in a pluggable store; the
+default is an in-process sharded dict, and `RedisBucketStore` shows the shape
+of a shared backend for multi-worker deployments.
+"""
+import json
+import math
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+
+class Limit(NamedTuple):
+    rate: float      # tokens refilled per second
+    burst: int       # bucket capacity
+
+
+class Rule(NamedTuple):
+    name: str
+    methods: Tuple[str, ...]
+    path: str                         # exact path, or a prefix when it ends with "*"
+    per_ip: Optional[Limit] = None
+    per_user: Optional[Limit] = None
+    max_concurrent: Optional[int] = None  # in-flight cap per user (or IP when anonymous)
+
+    def matches(self, method: str, path: str) -> bool:
+        if self.methods and method not in self.methods:
+            return False
+        if self.path.endswith("*"):
+            return path.startswith(self.path[:-1])
+        return path == self.path
+
+
+def per_minute(count: int, burst: Optional[int] = None) -> Limit:
+    return Limit(rate=count / 60.0, burst=burst or count)
+
+
+# --- Stores ---
+class BucketStore:
+    """Interface for token-bucket backends."""
+
+    async def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        """Consume `cost` tokens from `key`. Returns 0 if allowed, otherwise the
+        number of seconds until the request would have been allowed."""
+        raise NotImplementedError
+
+
+class MemoryBucketStore(BucketStore):
+    """In-process store. Buckets are spread across shards so idle buckets can be
+    evicted a shard at a time instead of walking one huge dict."""
+
+    def __init__(self, shards: int = 64, idle_seconds: float = 600.0, sweep_every: int = 1000):
+        self._shards: List[Dict[str, List[float]]] = [{} for _ in range(shards)]
+        self._idle = idle_seconds
+        self._sweep_every = sweep_every
+        self._ops = 0
+        self._next_sweep = 0
+
+    def _shard(self, key: str) -> Dict[str, List[float]]:
+        return self._shards[hash(key) % len(self._shards)]
+
+    async def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        shard = self._shard(key)
+        bucket = shard.get(key)
+        if bucket is None:
+            bucket = shard[key] = [float(limit.burst), now]
+        else:
+            bucket[0] = min(float(limit.burst), bucket[0] + (now - bucket[1]) * limit.rate)
+            bucket[1] = now
+
+        self._ops += 1
+        if self._ops % self._sweep_every == 0:
+            self._sweep(now)
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0.0
+        return (cost - bucket[0]) / limit.rate
+
+    def _sweep(self, now: float):
+        shard = self._shards[self._next_sweep]
+        self._next_sweep = (self._next_sweep + 1) % len(self._shards)
+        stale = [k for k, (_, ts) in shard.items() if now - ts > self._idle]
+        for k in stale:
+            del shard[k]
+
+    def __len__(self) -> int:
+        return sum(len(s) for s in self._shards)
+
+
+_REDIS_TOKEN_BUCKET = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 't') or ARGV[2])
+local ts = tonumber(redis.call('HGET', KEYS[1], 'ts') or ARGV[4])
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBucketStore(BucketStore):
+    """Shared store for multi-worker deployments. Takes any asyncio Redis client
+    exposing `eval(script, numkeys, *keys_and_args)` (e.g. `redis.asyncio.Redis`)."""
+
+    def __init__(self, redis, prefix: str = "rl:"):
+        self._redis = redis
+        self._prefix = prefix
+
+    async def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        wait = await self._redis.eval(
+            _REDIS_TOKEN_BUCKET, 1, self._prefix + key,
+            limit.rate, limit.burst, cost, time.time(),
+        )
+        return float(wait)
+
+
+# --- Middleware ---
+class RateLimitMiddleware:
+    """Applies every rule matching the request's method and path, so a route
+    budget stacks on top of the catch-all budget. `identify_user` maps a bearer
+    token to a user_id, or None."""
+
+    def __init__(
+        self,
+        app,
+        rules: List[Rule],
+        store: Optional[BucketStore] = None,
+        identify_user: Optional[Callable[[str], Optional[str]]] = None,
+        trust_forwarded_for: bool = False,
+        enabled: bool = True,
+    ):
+        self.app = app
+        self.rules = rules
+        self.store = store or MemoryBucketStore()
+        self.identify_user = identify_user
+        self.trust_forwarded_for = trust_forwarded_for
+        self.enabled = enabled
+        self._inflight: Dict[str, int] = {}
+        self.rejected = 0
+
+    def _client_ip(self, scope, headers: Dict[bytes, bytes]) -> str:
+        if self.trust_forwarded_for and b"x-forwarded-for" in headers:
+            return headers[b"x-forwarded-for"].decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def _user_id(self, headers: Dict[bytes, bytes]) -> Optional[str]:
+        auth = headers.get(b"authorization")
+        if not auth or not self.identify_user:
+            return None
+        scheme, _, token = auth.decode("latin-1").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        return self.identify_user(token)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        method, path = scope["method"], scope["path"]
+        matched = [r for r in self.rules if r.matches(method, path)]
+        if not matched:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        ip = self._client_ip(scope, headers)
+        user_id = self._user_id(headers)
+
+        for rule in matched:
+            if rule.per_ip:
+                wait = await self.store.take(f"{rule.name}:ip:{ip}", rule.per_ip)
+                if wait:
+                    await self._reject(send, wait)
+                    return
+            if rule.per_user and user_id:
+                wait = await self.store.take(f"{rule.name}:user:{user_id}", rule.per_user)
+                if wait:
+                    await self._reject(send, wait)
+                    return
+
+        caps = [(f"{r.name}:{user_id or ip}", r.max_concurrent) for r in matched if r.max_concurrent]
+        for key, cap in caps:
+            if self._inflight.get(key, 0) >= cap:
+                await self._reject(send, 1, "Too many concurrent requests")
+                return
+        for key, _ in caps:
+            self._inflight[key] = self._inflight.get(key, 0) + 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            for key, _ in caps:
+                remaining = self._inflight[key] - 1
+                if remaining:
+                    self._inflight[key] = remaining
+                else:
+                    del self._inflight[key]
+
+    async def _reject(self, send, wait: float, detail: str = "Too many requests"):
+        self.rejected += 1
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(wait))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,137 @@
+"""
+Request coalescing and a short per-user cache for hot reads.
+
+App start fires the dashboard, profile, weight and water reads in parallel,
+often from several devices. `UserReadCache.get` serves a fresh cached result
+if there is one, otherwise joins an identical in-flight query (single-flight)
+or runs it once. Each user's entries carry a generation number that writes
+bump, so a result read before a write is never cached or shared after it.
+
+`CachedValue` is the same idea for one process-wide value (e.g. the seeded
+workout plans).
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class SingleFlight:
+    """Shares one in-flight call among concurrent callers with the same key."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        self.leaders += 1
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; don't log it as unretrieved
+            raise
+        finally:
+            del self._calls[key]
+
+
+class UserReadCache:
+    def __init__(self, ttl_seconds: float = 5.0, max_users: int = 10000):
+        self.ttl = ttl_seconds
+        self.max_users = max_users
+        self.flight = SingleFlight()
+        # user_id -> (generation, {(route, params): (expires_at, value)})
+        self._users: "OrderedDict[str, Tuple[int, Dict[Tuple, Tuple[float, Any]]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _slot(self, user_id: str) -> Tuple[int, Dict]:
+        slot = self._users.get(user_id)
+        if slot is None:
+            slot = self._users[user_id] = (0, {})
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return slot
+
+    async def get(self, route: str, user_id: str, params: Tuple, fetch: Callable[[], Awaitable[Any]],
+                  ttl: Optional[float] = None) -> Any:
+        """`ttl` overrides the default for results that only a write can change."""
+        generation, entries = self._slot(user_id)
+        now = time.monotonic()
+        cached = entries.get((route, params))
+        if cached and cached[0] > now:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        result = await self.flight.do((route, user_id, params, generation), fetch)
+        current = self._users.get(user_id)
+        if current and current[0] == generation:
+            current[1][(route, params)] = (time.monotonic() + (self.ttl if ttl is None else ttl), result)
+        return result
+
+    def invalidate(self, user_id: str):
+        """Drop everything cached for a user. Call after any write to their data."""
+        slot = self._users.get(user_id)
+        if slot:
+            self._users[user_id] = (slot[0] + 1, {})
+            self.invalidations += 1
+
+    def clear(self):
+        """Drop everything, e.g. when invalidations from other workers may have been missed."""
+        for user_id, (generation, _) in list(self._users.items()):
+            self._users[user_id] = (generation + 1, {})
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "coalesced": self.flight.coalesced,
+            "queries": self.flight.leaders,
+            "invalidations": self.invalidations,
+        }
+
+
+class CachedValue:
+    """One cached value with a TTL, single-flight loading and a generation that
+    `invalidate` bumps."""
+
+    def __init__(self, fetch: Callable[[], Awaitable[Any]], ttl_seconds: float = 60.0):
+        self.fetch = fetch
+        self.ttl = ttl_seconds
+        self.flight = SingleFlight()
+        self._generation = 0
+        self._value: Optional[Tuple[float, Any]] = None
+
+    async def get(self, ttl: Optional[float] = None) -> Any:
+        if self._value and self._value[0] > time.monotonic():
+            return self._value[1]
+        generation = self._generation
+        result = await self.flight.do(generation, self.fetch)
+        if generation == self._generation:
+            self._value = (time.monotonic() + (self.ttl if ttl is None else ttl), result)
+        return result
+
+    def invalidate(self):
+        self._generation += 1
+        self._value = None
@@ -0,0 +1,440 @@
+"""
+Hydration and workout reminders.
+
+Users opt in through `reminder_settings` (one document per user: a time
+zone, water reminders every N minutes between two local times, and workout
+reminders at a local time on chosen weekdays). Each enabled reminder has one
+entry in a schedule keyed by `<user>:<kind>` holding only its next due time,
+so the scheduler never scans users: every minute the `reminders.tick` task
+takes the entries that are due, in batches, and per batch
+
+  - loads the owners' settings, today's water intake (in each user's local
+    day) and whether they already logged a workout today, in one query each;
+  - skips water reminders for users at their goal, workout reminders for
+    users who already trained, and anything more than `MAX_LATENESS` late;
+  - hands the rest to the sender in one call;
+  - writes every entry back with its next due time.
+
+Two schedule stores, like the task queue: `MongoReminderStore`
+(`reminder_schedule`, indexed by due time, with a TTL index so entries nobody
+processed for `STALE_AFTER` disappear) and `MemoryReminderStore`, a timer
+wheel of one-minute slots for single-process setups and benchmarks. A daily
+`reminders.reseed` task recreates entries that went missing (an outage longer
+than the TTL).
+
+Senders are pluggable (`make_sender`); `LogSender` is the local stub.
+"""
+import heapq
+import logging
+import math
+from bisect import bisect_right
+from collections import defaultdict, deque
+from datetime import datetime, time, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from pymongo import DeleteOne, UpdateOne
+
+from dates import to_day, utc_now
+from tracking import DEFAULT_WATER_GOAL
+
+logger = logging.getLogger(__name__)
+
+WATER, WORKOUT = "water", "workout"
+KINDS = (WATER, WORKOUT)
+TIME_PATTERN = r"^([01]\d|2[0-3]):[0-5]\d$"
+DEFAULT_SETTINGS = {
+    "timezone": "UTC",
+    WATER: {"enabled": False, "start": "09:00", "end": "21:00", "every_minutes": 120},
+    WORKOUT: {"enabled": False, "time": "18:00", "days": [0, 2, 4]},
+}
+MAX_LATENESS = timedelta(minutes=15)  # later than this, a reminder is skipped rather than sent
+STALE_AFTER = timedelta(days=1)  # schedule entries not processed for this long expire
+RESEED_INTERVAL = timedelta(days=1)
+BATCH_SIZE = 1000
+
+
+# --- Schedule computation ---
+def spread_days(days_per_week: int) -> List[int]:
+    """Weekdays (0 = Monday) for `days_per_week` workouts, spaced out: 3 -> Mon, Wed, Fri."""
+    days_per_week = max(1, min(7, days_per_week))
+    return sorted({math.floor(i * 7 / days_per_week) for i in range(days_per_week)})
+
+
+def parse_time(value: str) -> time:
+    """'18:30' -> time(18, 30). Raises ValueError."""
+    hours, minutes = value.split(":")
+    return time(int(hours), int(minutes))
+
+
+@lru_cache(maxsize=None)
+def zone(name: str) -> ZoneInfo:
+    """Raises ValueError for an unknown time zone."""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone '{name}'")
+
+
+@lru_cache(maxsize=4096)
+def _every(start: str, end: str, every_minutes: int) -> Tuple[int, ...]:
+    first, last = parse_time(start), parse_time(end)
+    return tuple(range(first.hour * 60 + first.minute, last.hour * 60 + last.minute + 1, max(1, every_minutes)))
+
+
+def local_minutes(settings: dict, kind: str, day) -> Sequence[int]:
+    """Local minutes of the day at which a reminder of `kind` fires on `day`, ascending."""
+    config = settings.get(kind) or {}
+    if kind == WATER:
+        return _every(config["start"], config["end"], int(config["every_minutes"]))
+    if day.weekday() not in config.get("days", []):
+        return ()
+    at = parse_time(config["time"])
+    return (at.hour * 60 + at.minute,)
+
+
+def next_due(settings: dict, kind: str, after: datetime) -> Optional[datetime]:
+    """First time (UTC) strictly after `after` that `kind` fires, or None if it never does."""
+    if not (settings.get(kind) or {}).get("enabled"):
+        return None
+    tz = zone(settings.get("timezone") or "UTC")
+    local = after.astimezone(tz)
+    today = local.date()
+    for offset in range(8):
+        day = today + timedelta(days=offset)
+        minutes = local_minutes(settings, kind, day)
+        # Skip the times already past; the check below still settles DST edges
+        first = bisect_right(minutes, local.hour * 60 + local.minute) if offset == 0 else 0
+        for minute in minutes[first:]:
+            due = datetime.combine(day, time(minute // 60, minute % 60), tzinfo=tz).astimezone(timezone.utc)
+            if due > after:
+                return due
+    return None
+
+
+def local_day(when: datetime, tz_name: str) -> str:
+    return when.astimezone(zone(tz_name)).date().isoformat()
+
+
+def entry_id(user_id: str, kind: str) -> str:
+    return f"{user_id}:{kind}"
+
+
+def make_entry(user_id: str, kind: str, due_at: datetime) -> dict:
+    return {"_id": entry_id(user_id, kind), "user_id": user_id, "kind": kind, "due_at": due_at,
+            "expire_at": due_at + STALE_AFTER}
+
+
+def decide(entries: List[dict], settings: Dict[str, dict], water: Dict[Tuple[str, str], dict],
+           worked_out: Set[Tuple[str, str]], now: datetime, counts: Dict[str, int]):
+    """Split a batch of due entries into (reminders to send, entries to reschedule,
+    ids to drop). `water` maps (user_id, local day) -> {glasses, goal};
+    `worked_out` holds (user_id, local day) pairs with a workout logged."""
+    send, reschedule, drop = [], [], []
+    for entry in entries:
+        user_id, kind, due = entry["user_id"], entry["kind"], entry["due_at"]
+        if due.tzinfo is None:
+            due = due.replace(tzinfo=timezone.utc)
+        config = settings.get(user_id)
+        following = next_due(config, kind, max(now, due)) if config else None
+        if following is None:
+            drop.append(entry["_id"])  # disabled, or the user is gone
+            continue
+        reschedule.append(make_entry(user_id, kind, following))
+        day = local_day(due, config.get("timezone") or "UTC")
+        if now - due > MAX_LATENESS:
+            counts["late"] += 1
+        elif kind == WATER and (intake := water.get((user_id, day))) and intake["glasses"] >= intake["goal"]:
+            counts["goal_met"] += 1
+        elif kind == WORKOUT and (user_id, day) in worked_out:
+            counts["worked_out"] += 1
+        else:
+            intake = water.get((user_id, day)) or {}
+            send.append({"user_id": user_id, "kind": kind, "due_at": due, "day": day,
+                         "glasses": intake.get("glasses", 0), "goal": intake.get("goal", DEFAULT_WATER_GOAL)})
+    return send, reschedule, drop
+
+
+# --- Stores ---
+class ReminderStore:
+    """Interface for the schedule: one entry per (user, kind) with its next due time."""
+
+    async def ensure_indexes(self):
+        pass
+
+    async def put(self, entries: Iterable[dict], only_missing: bool = False):
+        """Insert or move entries; with `only_missing`, leave existing ones alone."""
+        raise NotImplementedError
+
+    async def remove(self, ids: Iterable[str]):
+        raise NotImplementedError
+
+    async def due(self, now: datetime, limit: int) -> List[dict]:
+        """Up to `limit` entries due at or before `now`, earliest first. They stay
+        in the store until moved by `put` or removed."""
+        raise NotImplementedError
+
+    async def count(self) -> int:
+        raise NotImplementedError
+
+
+class MongoReminderStore(ReminderStore):
+    def __init__(self, collection):
+        self._col = collection
+
+    async def ensure_indexes(self):
+        await self._col.create_index("due_at")
+        await self._col.create_index("expire_at", expireAfterSeconds=0)
+        await self._col.create_index("user_id")
+
+    async def put(self, entries: Iterable[dict], only_missing: bool = False):
+        op = "$setOnInsert" if only_missing else "$set"
+        ops = [UpdateOne({"_id": e["_id"]}, {op: {k: v for k, v in e.items() if k != "_id"}}, upsert=True)
+               for e in entries]
+        if ops:
+            await self._col.bulk_write(ops, ordered=False)
+
+    async def remove(self, ids: Iterable[str]):
+        ops = [DeleteOne({"_id": i}) for i in ids]
+        if ops:
+            await self._col.bulk_write(ops, ordered=False)
+
+    async def due(self, now: datetime, limit: int) -> List[dict]:
+        return await self._col.find({"due_at": {"$lte": now}}).sort("due_at", 1).limit(limit).to_list(limit)
+
+    async def count(self) -> int:
+        return await self._col.estimated_document_count()
+
+
+class MemoryReminderStore(ReminderStore):
+    """Timer wheel: entries hashed into one-minute slots, with a heap of slot
+    numbers to find the earliest. Inserting or moving an entry is O(1) plus a
+    heap push when it opens a slot; taking due entries touches only due slots."""
+
+    def __init__(self):
+        self._slots: Dict[int, Dict[str, dict]] = {}
+        self._slot_of: Dict[str, int] = {}
+        self._heap: List[int] = []
+
+    @staticmethod
+    def _minute(when: datetime) -> int:
+        return int(when.timestamp() // 60)
+
+    def _discard(self, key: str):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            entries = self._slots[slot]
+            entries.pop(key, None)
+            if not entries:
+                del self._slots[slot]
+
+    async def put(self, entries: Iterable[dict], only_missing: bool = False):
+        for entry in entries:
+            key = entry["_id"]
+            if key in self._slot_of:
+                if only_missing:
+                    continue
+                self._discard(key)
+            slot = self._minute(entry["due_at"])
+            if slot not in self._slots:
+                self._slots[slot] = {}
+                heapq.heappush(self._heap, slot)
+            self._slots[slot][key] = entry
+            self._slot_of[key] = slot
+
+    async def remove(self, ids: Iterable[str]):
+        for key in ids:
+            self._discard(key)
+
+    async def due(self, now: datetime, limit: int) -> List[dict]:
+        now_slot, expired = self._minute(now), now - STALE_AFTER
+        slots = []
+        while self._heap and self._heap[0] <= now_slot:
+            slot = heapq.heappop(self._heap)
+            if slot in self._slots and slot not in slots:  # skip emptied slots and duplicates
+                slots.append(slot)
+        found, stale = [], []
+        for slot in slots:
+            for key, entry in self._slots[slot].items():
+                if len(found) >= limit:
+                    break
+                if entry["due_at"] < expired:
+                    stale.append(key)  # what the TTL index does for the Mongo store
+                elif entry["due_at"] <= now:
+                    found.append(entry)
+        for key in stale:
+            self._discard(key)
+        # Entries stay until they're moved or removed, so their slots stay on the heap
+        for slot in slots:
+            if slot in self._slots:
+                heapq.heappush(self._heap, slot)
+        return found
+
+    async def count(self) -> int:
+        return len(self._slot_of)
+
+
+# --- Senders ---
+class ReminderSender:
+    """Delivers a batch of reminders (push, email, ...). Returns how many went out."""
+
+    async def send(self, reminders: List[dict]) -> int:
+        raise NotImplementedError
+
+
+class LogSender(ReminderSender):
+    """Local stub: logs each batch and keeps the most recent reminders in memory."""
+
+    def __init__(self, keep: int = 1000):
+        self.recent = deque(maxlen=keep)
+
+    async def send(self, reminders: List[dict]) -> int:
+        self.recent.extend(reminders)
+        if reminders:
+            logger.info(f"Reminders: would send {len(reminders)} "
+                        f"({sum(r['kind'] == WATER for r in reminders)} water)")
+        return len(reminders)
+
+
+def make_sender(name: str) -> ReminderSender:
+    if name == "log":
+        return LogSender()
+    raise ValueError(f"Unknown REMINDER_SENDER '{name}' (expected 'log')")
+
+
+# --- Scheduler ---
+class Reminders:
+    def __init__(self, db, store: ReminderStore, sender: ReminderSender, tracking, queue=None,
+                 batch_size: int = BATCH_SIZE):
+        self.db = db
+        self.settings = db.reminder_settings
+        self.store = store
+        self.sender = sender
+        self.tracking = tracking
+        self.queue = queue
+        self.batch_size = batch_size
+        self.counts: Dict[str, int] = defaultdict(int)
+        if queue is not None:
+            queue.handler("reminders.tick")(self._tick_task)
+            queue.handler("reminders.reseed")(self._reseed_task)
+
+    async def ensure_indexes(self):
+        await self.settings.create_index("user_id", unique=True)
+        await self.store.ensure_indexes()
+
+    async def get_settings(self, user_id: str) -> dict:
+        saved = await self.settings.find_one({"user_id": user_id}, {"_id": 0, "user_id": 0})
+        return {**DEFAULT_SETTINGS, **(saved or {})}
+
+    async def update_settings(self, user_id: str, settings: dict, now: Optional[datetime] = None) -> dict:
+        """Save `settings` (validated here: time zone and times) and reschedule. Raises ValueError."""
+        settings = {**DEFAULT_SETTINGS, **settings}
+        zone(settings["timezone"])
+        for kind in KINDS:
+            settings[kind] = {**DEFAULT_SETTINGS[kind], **(settings[kind] or {})}
+        water = settings[WATER]
+        if parse_time(water["start"]) > parse_time(water["end"]):
+            raise ValueError("Water reminders must start before they end")
+        parse_time(settings[WORKOUT]["time"])
+        if any(day not in range(7) for day in settings[WORKOUT]["days"]):
+            raise ValueError("Workout days are weekday numbers, 0 (Monday) to 6")
+        await self.settings.update_one({"user_id": user_id}, {"$set": {"user_id": user_id, **settings}}, upsert=True)
+        await self._reschedule(user_id, settings, now or utc_now())
+        return settings
+
+    async def _reschedule(self, user_id: str, settings: dict, now: datetime, only_missing: bool = False):
+        entries, disabled = [], []
+        for kind in KINDS:
+            due = next_due(settings, kind, now)
+            if due is None:
+                disabled.append(entry_id(user_id, kind))
+            else:
+                entries.append(make_entry(user_id, kind, due))
+        await self.store.put(entries, only_missing=only_missing)
+        if not only_missing:
+            await self.store.remove(disabled)
+
+    async def _today(self, entries: List[dict], settings: Dict[str, dict]):
+        """Water intake and workout-logged flags for each entry's user on their local day."""
+        by_day: Dict[str, List[str]] = defaultdict(list)
+        for entry in entries:
+            config = settings.get(entry["user_id"])
+            if config:
+                due = entry["due_at"] if entry["due_at"].tzinfo else entry["due_at"].replace(tzinfo=timezone.utc)
+                by_day[local_day(due, config.get("timezone") or "UTC")].append(entry["user_id"])
+        water, worked_out = {}, set()
+        for day, user_ids in by_day.items():  # usually one or two days across time zones
+            user_ids = list(set(user_ids))
+            for user_id, intake in (await self.tracking.water_for_users(user_ids, day)).items():
+                water[(user_id, day)] = intake
+            logged = await self.db.workout_logs.distinct("user_id", {"user_id": {"$in": user_ids}, "date": to_day(day)})
+            worked_out.update((user_id, day) for user_id in logged)
+        return water, worked_out
+
+    async def tick(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Process every due entry. Returns this run's counts."""
+        now = now or utc_now()
+        counts: Dict[str, int] = defaultdict(int)
+        while True:
+            entries = await self.store.due(now, self.batch_size)
+            if not entries:
+                break
+            user_ids = list({e["user_id"] for e in entries})
+            settings = {s["user_id"]: s for s in await self.settings.find(
+                {"user_id": {"$in": user_ids}}, {"_id": 0}).to_list(None)}
+            water, worked_out = await self._today(entries, settings)
+            send, reschedule, drop = decide(entries, settings, water, worked_out, now, counts)
+            if send:
+                counts["sent"] += await self.sender.send(send)
+            await self.store.put(reschedule)
+            await self.store.remove(drop)
+            counts["dropped"] += len(drop)
+            counts["batches"] += 1
+            if len(entries) < self.batch_size:
+                break
+        for key, value in counts.items():
+            self.counts[key] += value
+        return dict(counts)
+
+    async def reseed(self, now: Optional[datetime] = None) -> int:
+        """Recreate missing schedule entries from the saved settings. Returns users scanned."""
+        now = now or utc_now()
+        scanned = 0
+        enabled = {"$or": [{f"{kind}.enabled": True} for kind in KINDS]}
+        async for settings in self.settings.find(enabled, {"_id": 0}).batch_size(self.batch_size):
+            await self._reschedule(settings["user_id"], settings, now, only_missing=True)
+            scanned += 1
+        return scanned
+
+    async def remove_user(self, user_id: str):
+        await self.store.remove(entry_id(user_id, kind) for kind in KINDS)
+
+    async def schedule(self):
+        """Start the tick and reseed chains (no-ops if they're already queued)."""
+        if self.queue is not None:
+            await self.queue.enqueue("reminders.tick", dedupe_key="reminders.tick")
+            await self.queue.enqueue("reminders.reseed", dedupe_key="reminders.reseed")
+
+    async def _tick_task(self, payload: dict):
+        try:
+            counts = await self.tick()
+            if counts.get("sent") or counts.get("late"):
+                logger.info(f"Reminder tick: {counts}")
+        except Exception as e:
+            # The chain must not break; the due entries are still there next minute
+            logger.error(f"Reminder tick failed: {e}")
+        now = utc_now()
+        await self.queue.enqueue("reminders.tick", delay=60 - now.second - now.microsecond / 1e6,
+                                 dedupe_key="reminders.tick")
+
+    async def _reseed_task(self, payload: dict):
+        try:
+            await self.reseed()
+        except Exception as e:
+            logger.error(f"Reminder reseed failed: {e}")
+        await self.queue.enqueue("reminders.reseed", delay=RESEED_INTERVAL.total_seconds(),
+                                 dedupe_key="reminders.reseed")
+
+    async def stats(self) -> dict:
+        return {"scheduled": await self.store.count(), **self.counts}
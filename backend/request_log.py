@@ -0,0 +1,285 @@
+"""
+Structured request logging.
+
+`setup_logging` routes every log record through a `QueueHandler`, so the
+event loop only pays for an in-memory enqueue; a `QueueListener` thread
+formats and writes the records (as one JSON object per line by default).
+
+`AccessLogMiddleware` gives each request an ID (a valid incoming
+`X-Request-ID` is kept, otherwise one is generated), echoes it on the
+response and, at the end of the request, logs one `access` record with the
+status, duration and per-request call counts and times for Mongo, S3 and
+bcrypt. Access records are sampled at `sample_rate`; server errors and
+requests slower than `slow_ms` are always logged.
+
+The counts are collected without touching the call sites:
+  - Mongo: `MongoCommandMonitor` is a pymongo command listener passed to the
+    Motor client. Motor runs commands in executor threads under a copy of the
+    caller's context, so the listener sees the current request. Commands
+    slower than `slow_ms` are logged with their query shape (literal values
+    replaced by "?").
+  - S3: `instrument_boto3` hooks botocore's before-call / after-call events.
+  - bcrypt (or anything else): wrap the call in `track("bcrypt")`.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from pymongo import monitoring
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+# Standard LogRecord attributes; anything else on a record was passed via `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class RequestStats:
+    """Per-request counters. Shared with executor threads, hence the lock."""
+    __slots__ = ("request_id", "calls", "_lock")
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.calls: Dict[str, list] = {}  # kind -> [count, total ms]
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, ms: float):
+        with self._lock:
+            entry = self.calls.setdefault(kind, [0, 0.0])
+            entry[0] += 1
+            entry[1] += ms
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {kind: {"count": n, "ms": round(ms, 2)} for kind, (n, ms) in self.calls.items()}
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    stats = _current.get()
+    return stats.request_id if stats else None
+
+
+@contextmanager
+def track(kind: str):
+    """Count and time a block against the current request (no-op outside one)."""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add(kind, (time.perf_counter() - start) * 1000)
+
+
+# --- Formatting and emission ---
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _RequestIdFilter(logging.Filter):
+    """Stamps the request ID on the record in the caller's context, before it
+    crosses to the listener thread."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "request_id", None) is None:
+            record.request_id = current_request_id()
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() folds the traceback into the message; keep it in
+        # exc_text instead so the JSON formatter can emit it as its own field.
+        record = logging.makeLogRecord(vars(record))
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: int = logging.INFO, fmt: str = "json") -> logging.handlers.QueueListener:
+    """Replace the root handlers with a queue-backed one. Returns the started
+    listener; stop it on shutdown to flush."""
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if fmt == "json" else
+                        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    handler = _QueueHandler(queue.SimpleQueue())
+    handler.addFilter(_RequestIdFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+# --- Mongo ---
+def query_shape(value, depth: int = 0):
+    """The structure of a filter / pipeline with every literal replaced by "?"."""
+    if depth > 8:
+        return "..."
+    if isinstance(value, dict):
+        return {k: query_shape(v, depth + 1) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        # $in lists and the like: one element is enough to show the shape
+        shapes = [query_shape(v, depth + 1) for v in value[:20]]
+        if all(s == "?" for s in shapes):
+            return ["?"] if shapes else []
+        return shapes
+    if isinstance(value, str) and value.startswith("$"):
+        return value  # a field path, not a literal
+    return "?"
+
+
+_SHAPE_FIELDS = ("filter", "sort", "projection", "pipeline", "hint", "query", "key")
+
+
+def command_shape(command_name: str, command: dict) -> dict:
+    shape = {"command": command_name}
+    target = command.get(command_name)
+    if isinstance(target, str):
+        shape["collection"] = target
+    for field in _SHAPE_FIELDS:
+        if field in command:
+            shape[field] = command[field] if field in ("sort", "projection", "hint") else query_shape(command[field])
+    for field, inner in (("updates", "q"), ("deletes", "q")):
+        ops = command.get(field)
+        if ops:
+            shape[field] = {"count": len(ops), "q": query_shape(ops[0].get(inner))}
+    if command_name == "getMore":
+        shape["collection"] = command.get("collection")
+    return shape
+
+
+class MongoCommandMonitor(monitoring.CommandListener):
+    """Counts commands against the current request and logs slow ones."""
+
+    def __init__(self, slow_ms: float = 100.0, logger: Optional[logging.Logger] = None):
+        self.slow_ms = slow_ms
+        self.logger = logger or logging.getLogger("mongo.slow")
+        self.slow_commands = 0
+        self._inflight: Dict[tuple, tuple] = {}
+
+    @staticmethod
+    def _key(event) -> tuple:
+        return event.connection_id, event.request_id
+
+    def started(self, event):
+        # Keep a reference only; the shape is computed if the command turns out slow
+        self._inflight[self._key(event)] = (event.command_name, event.command)
+
+    def _finished(self, event, failed: bool):
+        name, command = self._inflight.pop(self._key(event), (event.command_name, None))
+        ms = event.duration_micros / 1000
+        stats = _current.get()
+        if stats is not None:
+            stats.add("mongo", ms)
+        if ms >= self.slow_ms:
+            self.slow_commands += 1
+            self.logger.warning(
+                f"Slow Mongo command {name} ({ms:.1f} ms)",
+                extra={"duration_ms": round(ms, 2), "failed": failed or None,
+                       "shape": command_shape(name, command) if command is not None else {"command": name}},
+            )
+
+    def succeeded(self, event):
+        self._finished(event, failed=False)
+
+    def failed(self, event):
+        self._finished(event, failed=True)
+
+
+# --- S3 ---
+def instrument_boto3(client, kind: str = "s3"):
+    """Count and time every API call a boto3 client makes against the current request."""
+
+    def before(context, **_):
+        context["_request_log_start"] = time.perf_counter()
+
+    def after(context, **_):
+        stats = _current.get()
+        start = context.get("_request_log_start")
+        if stats is not None and start is not None:
+            stats.add(kind, (time.perf_counter() - start) * 1000)
+
+    client.meta.events.register("before-call.*.*", before)
+    client.meta.events.register("after-call.*.*", after)
+    return client
+
+
+# --- Access log ---
+class AccessLogMiddleware:
+    def __init__(self, app: ASGIApp, sample_rate: float = 1.0, slow_ms: float = 1000.0,
+                 logger: Optional[logging.Logger] = None):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.logger = logger or logging.getLogger("access")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = Headers(scope=scope).get(REQUEST_ID_HEADER)
+        request_id = incoming if incoming and _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        stats = RequestStats(request_id)
+        token = _current.set(stats)
+        status, sent = 500, 0
+        start = time.perf_counter()
+
+        async def send_logged(message: Message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(raw=message["headers"])[REQUEST_ID_HEADER] = request_id
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_logged)
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            _current.reset(token)
+            if status >= 500 or ms >= self.slow_ms or random.random() < self.sample_rate:
+                route = scope.get("route")
+                self.logger.info(
+                    f"{scope['method']} {scope['path']} {status} {ms:.1f}ms",
+                    extra={"request_id": request_id, "method": scope["method"], "path": scope["path"],
+                           "route": getattr(route, "path", None), "status": status,
+                           "duration_ms": round(ms, 2), "bytes": sent, "sample_rate": self.sample_rate,
+                           "calls": stats.summary()},
+                )
@@ -0,0 +1,80 @@
+"""
+Water and weight rollups for charts.
+
+`TrackingStore.daily_series` returns one row per logged day from a single
+aggregation; `summarize` folds those rows into per-day, per-week (Monday
+start) or per-month buckets plus range-wide totals and water-goal streaks.
+The fold is linear in the number of days, which the endpoint caps.
+"""
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from tracking import DEFAULT_WATER_GOAL
+
+PERIODS = ("day", "week", "month")
+MAX_RANGE_DAYS = 731
+
+
+def period_start(day: date, period: str) -> date:
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _goal_hit(row: Optional[dict]) -> bool:
+    return bool(row) and (row.get("glasses") or 0) >= (row.get("goal") or DEFAULT_WATER_GOAL)
+
+
+def _fold(days: List[date], rows: Dict[str, dict]) -> dict:
+    glasses = [rows[d.isoformat()]["glasses"] for d in days
+               if rows.get(d.isoformat(), {}).get("glasses") is not None]
+    weights = [rows[d.isoformat()]["weight"] for d in days
+               if rows.get(d.isoformat(), {}).get("weight") is not None]
+    hits = sum(1 for d in days if _goal_hit(rows.get(d.isoformat())))
+    return {
+        "start": days[0].isoformat(), "end": days[-1].isoformat(), "days": len(days),
+        "water_days": len(glasses),
+        "glasses_total": sum(glasses),
+        "glasses_avg": round(sum(glasses) / len(glasses), 2) if glasses else None,
+        "goal_hit_days": hits,
+        "goal_hit_rate": round(hits / len(days), 4),
+        "weight_entries": len(weights),
+        "weight_avg": round(sum(weights) / len(weights), 2) if weights else None,
+        "weight_min": min(weights) if weights else None,
+        "weight_max": max(weights) if weights else None,
+    }
+
+
+def _streaks(days: List[date], rows: Dict[str, dict]) -> dict:
+    longest = run = 0
+    for d in days:
+        run = run + 1 if _goal_hit(rows.get(d.isoformat())) else 0
+        longest = max(longest, run)
+    # The last day may still be in progress, so an unmet goal there doesn't break the streak
+    current = 0
+    tail = days[:-1] if days and not _goal_hit(rows.get(days[-1].isoformat())) else days
+    for d in reversed(tail):
+        if not _goal_hit(rows.get(d.isoformat())):
+            break
+        current += 1
+    return {"current": current, "longest": longest}
+
+
+def summarize(series: List[dict], start: date, end: date, period: str) -> dict:
+    rows = {row["date"]: row for row in series}
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+    buckets: List[List[date]] = []
+    for d in days:
+        if not buckets or period_start(d, period) != period_start(buckets[-1][0], period):
+            buckets.append([])
+        buckets[-1].append(d)
+
+    return {
+        "start": start.isoformat(), "end": end.isoformat(), "period": period,
+        "totals": _fold(days, rows),
+        "streaks": _streaks(days, rows),
+        "buckets": [_fold(b, rows) for b in buckets],
+    }
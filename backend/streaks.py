@@ -0,0 +1,628 @@
+"""
+Streaks and weekly leaderboards.
+
+Streak counters live in `streaks`, one document per (user, kind): the current
+run of consecutive active days, the longest run and the last active day. A
+workout day is a day with a log; a water day is a day at the water goal.
+`record_workout` / `record_water` fold a new day in with one read and one
+conditional write, so showing a streak never scans history. A day before the
+last one counted (a back-dated log) or a goal day taken back can't be folded
+forward, so that user's streaks are rebuilt from their logs on the task queue.
+
+The same calls move the user on this week's leaderboards (`workouts`: days
+with a workout log in the ISO week, so extra logs on one day don't score;
+`water`: days at the goal), one ranked board per `<kind>:<week>`.
+Players with the same score share a rank (1 + players with a higher score);
+within a score, whoever got there first is listed first. Players are shown by
+name only if they opted in (`show_name_on_leaderboards` on their profile).
+Two stores, like the reminder schedule:
+
+  - `MongoLeaderboardStore`: entries indexed by (board, score, reached_at), so
+    an update is one index write and top-K / around-me reads walk the index
+    from a point. A per-board score histogram turns a rank into a sum over the
+    distinct scores (a handful) instead of a count of the players ahead.
+  - `MemoryLeaderboardStore`: a `RankedSet` (indexable skip list) per board,
+    O(log n) for updates, ranks and positions; single process only.
+
+Incremental counts can drift (a lost write, a deleted account), so a nightly
+`leaderboards.reconcile` task recomputes the current and previous week from
+`workout_logs` and water intake and corrects the entries that differ.
+"""
+import logging
+import random
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import DeleteOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from dates import day_str, iso, to_day, utc_now
+from tracking import DEFAULT_WATER_GOAL
+
+logger = logging.getLogger(__name__)
+
+WORKOUTS, WATER = "workouts", "water"
+KINDS = (WORKOUTS, WATER)
+WEEK_PATTERN = r"^\d{4}-W\d{2}$"
+KEEP_WEEKS = 8  # boards expire this long after their week ends
+RECONCILE_WEEKS = 2  # the current week and the one before
+MAX_LIMIT = 100
+MAX_RADIUS = 25
+
+
+# --- Days and weeks ---
+def as_day(value) -> datetime:
+    """A stored day (datetime, naive datetime or 'YYYY-MM-DD') as midnight UTC."""
+    if isinstance(value, str):
+        return to_day(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def week_of(day) -> str:
+    """ISO week of a day: 2024-05-06 -> '2024-W19'."""
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def week_start(week: str) -> date:
+    """Monday of an ISO week. Raises ValueError."""
+    year, number = week.split("-W")
+    return date.fromisocalendar(int(year), int(number), 1)
+
+
+def board_id(kind: str, week: str) -> str:
+    return f"{kind}:{week}"
+
+
+def board_expiry(week: str) -> datetime:
+    start = week_start(week)
+    return datetime(start.year, start.month, start.day, tzinfo=timezone.utc) + timedelta(weeks=1 + KEEP_WEEKS)
+
+
+# --- Streak folding ---
+def new_streak() -> dict:
+    return {"current": 0, "longest": 0, "last_day": None}
+
+
+def extend(streak: dict, day: datetime) -> Optional[dict]:
+    """The streak after `day` became active. Returns the same dict if it already
+    counted, or None if `day` is before the last active day (needs a rebuild)."""
+    last = streak.get("last_day")
+    if last is not None:
+        last = as_day(last)
+        if day == last:
+            return streak
+        if day < last:
+            return None
+    current = streak["current"] + 1 if last is not None and day - last == timedelta(days=1) else 1
+    return {"current": current, "longest": max(streak["longest"], current), "last_day": day}
+
+
+def from_days(days: Iterable[datetime]) -> dict:
+    streak = new_streak()
+    for day in sorted(set(days)):
+        streak = extend(streak, day)
+    return streak
+
+
+def present(streak: Optional[dict], today: datetime) -> dict:
+    """API view: a streak whose last day is before yesterday is broken, so current is 0."""
+    streak = streak or new_streak()
+    last = as_day(streak["last_day"]) if streak.get("last_day") is not None else None
+    alive = last is not None and today - last <= timedelta(days=1)
+    return {"current": streak["current"] if alive else 0, "longest": streak["longest"], "last_day": day_str(last)}
+
+
+# --- Ranked set ---
+class _Node:
+    __slots__ = ("key", "next", "span")
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * level
+        self.span = [0] * level  # entries each link skips over
+
+
+class RankedSet:
+    """Members ordered by a tuple key (ties broken by member), with O(log n)
+    expected insert, remove, position of a member and member at a position: a
+    skip list whose links record how many entries they pass, as in Redis
+    sorted sets."""
+
+    MAX_LEVEL = 32
+    P = 0.25
+
+    def __init__(self, seed: Optional[int] = None):
+        self._head = _Node(None, self.MAX_LEVEL)
+        self._level = 1
+        self._keys: Dict[str, tuple] = {}
+        self._random = random.Random(seed)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, member) -> bool:
+        return member in self._keys
+
+    def members(self) -> List[str]:
+        return list(self._keys)
+
+    def key(self, member) -> Optional[tuple]:
+        return self._keys.get(member)
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVEL and self._random.random() < self.P:
+            level += 1
+        return level
+
+    def _path(self, key: tuple):
+        """The last node before `key` on every level, and each one's position."""
+        update = [self._head] * self.MAX_LEVEL
+        rank = [0] * self.MAX_LEVEL
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            rank[i] = rank[i + 1] if i < self._level - 1 else 0
+            while node.next[i] is not None and node.next[i].key < key:
+                rank[i] += node.span[i]
+                node = node.next[i]
+            update[i] = node
+        return update, rank
+
+    def add(self, member, key: tuple):
+        """Insert `member`, or move it if it's already there."""
+        self.discard(member)
+        full = (*key, member)
+        update, rank = self._path(full)
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                rank[i] = 0
+                update[i] = self._head
+                self._head.span[i] = len(self._keys)
+            self._level = level
+        node = _Node(full, level)
+        for i in range(level):
+            node.next[i] = update[i].next[i]
+            update[i].next[i] = node
+            node.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = rank[0] - rank[i] + 1
+        for i in range(level, self._level):
+            update[i].span[i] += 1
+        self._keys[member] = key
+
+    def discard(self, member) -> bool:
+        key = self._keys.pop(member, None)
+        if key is None:
+            return False
+        full = (*key, member)
+        update, _ = self._path(full)
+        node = update[0].next[0]
+        for i in range(self._level):
+            if update[i].next[i] is node:
+                update[i].span[i] += node.span[i] - 1
+                update[i].next[i] = node.next[i]
+            else:
+                update[i].span[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        return True
+
+    def count_before(self, key: tuple) -> int:
+        """Number of entries whose key sorts before `key` (a prefix counts as smaller)."""
+        count, node = 0, self._head
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                count += node.span[i]
+                node = node.next[i]
+        return count
+
+    def index(self, member) -> Optional[int]:
+        """0-based position of `member`, or None."""
+        key = self._keys.get(member)
+        return None if key is None else self.count_before((*key, member))
+
+    def slice(self, start: int, stop: int) -> List[Tuple[str, tuple]]:
+        """(member, key) pairs at positions start..stop-1."""
+        start, stop = max(0, start), min(stop, len(self._keys))
+        if start >= stop:
+            return []
+        traversed, node = 0, self._head
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and traversed + node.span[i] <= start:
+                traversed += node.span[i]
+                node = node.next[i]
+        found = []
+        node = node.next[0]
+        while node is not None and len(found) < stop - start:
+            found.append((node.key[-1], node.key[:-1]))
+            node = node.next[0]
+        return found
+
+
+# --- Stores ---
+def _entry(user_id: str, score: int, rank: int) -> dict:
+    return {"rank": rank, "user_id": user_id, "score": score}
+
+
+class LeaderboardStore:
+    """Interface for the ranked boards. Entries come back as {rank, user_id, score}, best first."""
+
+    async def ensure_indexes(self):
+        pass
+
+    async def change(self, board: str, user_id: str, delta: int, now: datetime, expire_at: datetime) -> int:
+        """Add `delta` to a player's score and return it; a player at 0 leaves the board."""
+        raise NotImplementedError
+
+    async def top(self, board: str, limit: int) -> List[dict]:
+        raise NotImplementedError
+
+    async def around(self, board: str, user_id: str, radius: int) -> List[dict]:
+        """The player's entry with up to `radius` neighbours on each side; [] if not on the board."""
+        raise NotImplementedError
+
+    async def size(self, board: str) -> int:
+        raise NotImplementedError
+
+    async def correct(self, board: str, scores: Dict[str, int], now: datetime, expire_at: datetime) -> int:
+        """Bring the board in line with recomputed `scores`. An entry that changes
+        while this runs is left for the next run. Returns entries corrected."""
+        raise NotImplementedError
+
+
+class MongoLeaderboardStore(LeaderboardStore):
+    """`leaderboard_entries`: {_id: "<board>:<user>", board, user_id, score, reached_at, expire_at}
+    `leaderboard_counts`:  {_id: "<board>", counts: {"<score>": players}, expire_at}"""
+
+    ORDER = [("score", -1), ("reached_at", 1), ("user_id", 1)]
+    FIELDS = {"_id": 0, "user_id": 1, "score": 1, "reached_at": 1}
+
+    def __init__(self, db):
+        self.entries = db.leaderboard_entries
+        self.counts = db.leaderboard_counts
+
+    async def ensure_indexes(self):
+        await self.entries.create_index([("board", 1), *self.ORDER])
+        await self.entries.create_index("user_id")
+        await self.entries.create_index("expire_at", expireAfterSeconds=0)
+        await self.counts.create_index("expire_at", expireAfterSeconds=0)
+
+    async def change(self, board: str, user_id: str, delta: int, now: datetime, expire_at: datetime) -> int:
+        key = f"{board}:{user_id}"
+        if delta > 0:
+            entry = await self.entries.find_one_and_update(
+                {"_id": key},
+                {"$inc": {"score": delta}, "$set": {"reached_at": now, "expire_at": expire_at},
+                 "$setOnInsert": {"board": board, "user_id": user_id}},
+                projection={"score": 1}, upsert=True, return_document=ReturnDocument.AFTER,
+            )
+        else:
+            entry = await self.entries.find_one_and_update(
+                {"_id": key}, {"$inc": {"score": delta}}, projection={"score": 1},
+                return_document=ReturnDocument.AFTER,
+            )
+            if entry is None:
+                return 0
+        score, old = entry["score"], entry["score"] - delta
+        histogram = {}
+        if old > 0:
+            histogram[f"counts.{old}"] = -1
+        if score > 0:
+            histogram[f"counts.{score}"] = 1
+        else:
+            await self.entries.delete_one({"_id": key, "score": {"$lte": 0}})
+        await self.counts.update_one({"_id": board}, {"$inc": histogram, "$set": {"expire_at": expire_at}},
+                                     upsert=True)
+        return max(score, 0)
+
+    async def _histogram(self, board: str) -> Dict[int, int]:
+        doc = await self.counts.find_one({"_id": board}) or {}
+        return {int(score): players for score, players in (doc.get("counts") or {}).items() if players > 0}
+
+    @staticmethod
+    def _rank(histogram: Dict[int, int], score: int) -> int:
+        return 1 + sum(players for s, players in histogram.items() if s > score)
+
+    def _ranked(self, docs: List[dict], histogram: Dict[int, int]) -> List[dict]:
+        return [_entry(d["user_id"], d["score"], self._rank(histogram, d["score"])) for d in docs]
+
+    async def top(self, board: str, limit: int) -> List[dict]:
+        docs = await self.entries.find({"board": board}, self.FIELDS).sort(self.ORDER).limit(limit).to_list(limit)
+        return self._ranked(docs, await self._histogram(board)) if docs else []
+
+    async def around(self, board: str, user_id: str, radius: int) -> List[dict]:
+        me = await self.entries.find_one({"_id": f"{board}:{user_id}"}, self.FIELDS)
+        if not me:
+            return []
+        score, reached_at = me["score"], me["reached_at"]
+        ahead = {"board": board, "$or": [
+            {"score": {"$gt": score}},
+            {"score": score, "reached_at": {"$lt": reached_at}},
+            {"score": score, "reached_at": reached_at, "user_id": {"$lt": user_id}},
+        ]}
+        behind = {"board": board, "$or": [
+            {"score": {"$lt": score}},
+            {"score": score, "reached_at": {"$gt": reached_at}},
+            {"score": score, "reached_at": reached_at, "user_id": {"$gt": user_id}},
+        ]}
+        reverse = [(field, -direction) for field, direction in self.ORDER]
+        above = await self.entries.find(ahead, self.FIELDS).sort(reverse).limit(radius).to_list(radius) if radius else []
+        below = await self.entries.find(behind, self.FIELDS).sort(self.ORDER).limit(radius).to_list(radius) if radius else []
+        return self._ranked([*reversed(above), me, *below], await self._histogram(board))
+
+    async def size(self, board: str) -> int:
+        return sum((await self._histogram(board)).values())
+
+    async def correct(self, board: str, scores: Dict[str, int], now: datetime, expire_at: datetime) -> int:
+        current = {e["user_id"]: e["score"] async for e in self.entries.find({"board": board}, self.FIELDS)}
+        ops = []
+        for user_id in current.keys() | scores.keys():
+            old, new = current.get(user_id), scores.get(user_id, 0)
+            key = f"{board}:{user_id}"
+            if old == new or (old is None and new <= 0):
+                continue
+            if old is None:
+                # Only if it's still missing; a live update in the meantime wins
+                ops.append(UpdateOne({"_id": key}, {"$setOnInsert": {
+                    "board": board, "user_id": user_id, "score": new, "reached_at": now, "expire_at": expire_at,
+                }}, upsert=True))
+            elif new <= 0:
+                ops.append(DeleteOne({"_id": key, "score": old}))
+            else:
+                ops.append(UpdateOne({"_id": key, "score": old}, {"$set": {"score": new, "expire_at": expire_at}}))
+        if ops:
+            await self.entries.bulk_write(ops, ordered=False)
+        rows = await self.entries.aggregate([
+            {"$match": {"board": board}},
+            {"$group": {"_id": "$score", "players": {"$sum": 1}}},
+        ]).to_list(None)
+        await self.counts.update_one({"_id": board}, {"$set": {
+            "counts": {str(r["_id"]): r["players"] for r in rows if r["_id"] > 0}, "expire_at": expire_at,
+        }}, upsert=True)
+        return len(ops)
+
+
+class MemoryLeaderboardStore(LeaderboardStore):
+    """One `RankedSet` per board keyed by (-score, reached_at); boards past their
+    expiry are dropped when the board set is next corrected."""
+
+    def __init__(self):
+        self._boards: Dict[str, RankedSet] = {}
+        self._expiry: Dict[str, datetime] = {}
+
+    def _board(self, board: str, expire_at: datetime) -> RankedSet:
+        self._expiry[board] = expire_at
+        if board not in self._boards:
+            self._boards[board] = RankedSet()
+        return self._boards[board]
+
+    async def change(self, board: str, user_id: str, delta: int, now: datetime, expire_at: datetime) -> int:
+        ranked = self._boards.get(board) if delta <= 0 else self._board(board, expire_at)
+        key = ranked.key(user_id) if ranked is not None else None
+        if key is None and delta <= 0:
+            return 0
+        score = (-key[0] if key else 0) + delta
+        if score <= 0:
+            ranked.discard(user_id)
+            return 0
+        # A lower score keeps the time the player first got there
+        ranked.add(user_id, (-score, now.timestamp() if delta > 0 else key[1]))
+        return score
+
+    @staticmethod
+    def _ranked(ranked: RankedSet, pairs: List[Tuple[str, tuple]]) -> List[dict]:
+        ranks: Dict[int, int] = {}
+        entries = []
+        for user_id, key in pairs:
+            if key[0] not in ranks:
+                ranks[key[0]] = ranked.count_before((key[0],)) + 1
+            entries.append(_entry(user_id, -key[0], ranks[key[0]]))
+        return entries
+
+    async def top(self, board: str, limit: int) -> List[dict]:
+        ranked = self._boards.get(board)
+        return self._ranked(ranked, ranked.slice(0, limit)) if ranked else []
+
+    async def around(self, board: str, user_id: str, radius: int) -> List[dict]:
+        ranked = self._boards.get(board)
+        position = ranked.index(user_id) if ranked else None
+        if position is None:
+            return []
+        return self._ranked(ranked, ranked.slice(position - radius, position + radius + 1))
+
+    async def size(self, board: str) -> int:
+        ranked = self._boards.get(board)
+        return len(ranked) if ranked else 0
+
+    async def correct(self, board: str, scores: Dict[str, int], now: datetime, expire_at: datetime) -> int:
+        for name in [b for b, expiry in self._expiry.items() if expiry <= now]:
+            self._boards.pop(name, None)
+            del self._expiry[name]
+        ranked = self._board(board, expire_at)
+        changed = 0
+        for user_id in set(ranked.members()) | scores.keys():
+            key, new = ranked.key(user_id), scores.get(user_id, 0)
+            if (-key[0] if key else 0) == new:
+                continue
+            if new <= 0:
+                ranked.discard(user_id)
+            else:
+                ranked.add(user_id, (-new, key[1] if key else now.timestamp()))
+            changed += 1
+        return changed
+
+
+# --- Service ---
+class Streaks:
+    def __init__(self, db, store: LeaderboardStore, tracking, queue=None, reconcile_hour: int = 3):
+        self.db = db
+        self.col = db.streaks
+        self.store = store
+        self.tracking = tracking
+        self.queue = queue
+        self.reconcile_hour = reconcile_hour
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.reconciled_at: Optional[datetime] = None
+        if queue is not None:
+            queue.handler("streaks.rebuild")(self._rebuild_task)
+            queue.handler("leaderboards.reconcile")(self._reconcile_task)
+
+    async def ensure_indexes(self):
+        await self.col.create_index([("user_id", 1), ("kind", 1)], unique=True)
+        # The nightly reconciliation reads one week of logs across all users
+        await self.db.workout_logs.create_index("date")
+        await self.store.ensure_indexes()
+
+    # --- Streaks ---
+    async def get(self, user_id: str, today: Optional[datetime] = None) -> dict:
+        today = as_day(today or utc_now())
+        docs = {d["kind"]: d async for d in self.col.find({"user_id": user_id}, {"_id": 0})}
+        return {kind: present(docs.get(kind), today) for kind in KINDS}
+
+    async def _extend(self, user_id: str, kind: str, day: datetime):
+        doc = await self.col.find_one({"user_id": user_id, "kind": kind}, {"_id": 0})
+        streak = doc or new_streak()
+        extended = extend(streak, day)
+        if extended is None:
+            await self.queue_rebuild(user_id)
+            return
+        if extended is streak:
+            return
+        try:
+            # Conditional on the day it was folded from, so concurrent folds can't both land
+            result = await self.col.update_one(
+                {"user_id": user_id, "kind": kind, "last_day": streak["last_day"]},
+                {"$set": {**extended, "updated_at": utc_now()}}, upsert=doc is None,
+            )
+            folded = result.matched_count or result.upserted_id is not None
+        except DuplicateKeyError:
+            folded = False
+        if folded:
+            self.counts["updates"] += 1
+        else:
+            await self.queue_rebuild(user_id)
+
+    async def _move(self, kind: str, user_id: str, day: datetime, delta: int, now: Optional[datetime]):
+        now, week = now or utc_now(), week_of(day)
+        expire_at = board_expiry(week)
+        if expire_at > now:  # logs for weeks whose board is gone don't bring it back
+            await self.store.change(board_id(kind, week), user_id, delta, now, expire_at)
+
+    async def record_workout(self, user_id: str, day, now: Optional[datetime] = None):
+        """After a workout log for `day` was saved. Only the day's first log scores."""
+        day = as_day(day)
+        await self._extend(user_id, WORKOUTS, day)
+        if await self.db.workout_logs.count_documents({"user_id": user_id, "date": day}, limit=2) == 1:
+            await self._move(WORKOUTS, user_id, day, 1, now)
+
+    async def record_water(self, user_id: str, intake: dict, delta: int, now: Optional[datetime] = None):
+        """After a glass was added (delta 1) or removed (-1): count the day when it
+        reaches the goal, take it back when it drops below."""
+        glasses, goal = intake.get("glasses", 0), intake.get("goal") or DEFAULT_WATER_GOAL
+        day = as_day(intake["date"])
+        if delta > 0 and glasses == goal:
+            await self._extend(user_id, WATER, day)
+            await self._move(WATER, user_id, day, 1, now)
+        elif delta < 0 and glasses == goal - 1:
+            await self._move(WATER, user_id, day, -1, now)
+            await self.queue_rebuild(user_id)
+
+    async def queue_rebuild(self, user_id: str):
+        if self.queue is not None:
+            await self.queue.enqueue("streaks.rebuild", {"user_id": user_id}, dedupe_key=f"streaks.rebuild:{user_id}")
+        else:
+            await self.rebuild_user(user_id)
+
+    async def rebuild_user(self, user_id: str) -> dict:
+        """Recompute both of a user's streaks from their full history."""
+        workout_days = [as_day(d) for d in await self.db.workout_logs.distinct("date", {"user_id": user_id})]
+        series = await self.tracking.daily_series(user_id, "1970-01-01", "9999-12-31")
+        water_days = [as_day(r["date"]) for r in series
+                      if r.get("glasses") is not None and r["glasses"] >= (r.get("goal") or DEFAULT_WATER_GOAL)]
+        streaks = {WORKOUTS: from_days(workout_days), WATER: from_days(water_days)}
+        now = utc_now()
+        await self.col.bulk_write([
+            UpdateOne({"user_id": user_id, "kind": kind}, {"$set": {**streak, "updated_at": now}}, upsert=True)
+            for kind, streak in streaks.items()
+        ], ordered=False)
+        self.counts["rebuilds"] += 1
+        return streaks
+
+    async def _rebuild_task(self, payload: dict):
+        await self.rebuild_user(payload["user_id"])
+
+    # --- Leaderboards ---
+    async def leaderboard(self, kind: str, week: str, user_id: str, limit: int, radius: int) -> dict:
+        board = board_id(kind, week)
+        top = await self.store.top(board, limit)
+        around = await self.store.around(board, user_id, radius)
+        names = {u["id"]: u.get("name") for u in await self.db.users.find(
+            {"id": {"$in": list({e["user_id"] for e in (*top, *around)})}, "show_name_on_leaderboards": True},
+            {"_id": 0, "id": 1, "name": 1},
+        ).to_list(None)}
+
+        def public(entries: List[dict]) -> List[dict]:
+            # Ids stay private and names are opt-in; the caller's own entry is flagged
+            return [{"rank": e["rank"], "name": names.get(e["user_id"]), "score": e["score"],
+                     "me": e["user_id"] == user_id} for e in entries]
+
+        me = next((e for e in around if e["user_id"] == user_id), None)
+        return {
+            "kind": kind, "week": week, "players": await self.store.size(board), "top": public(top),
+            "me": {"rank": me["rank"], "score": me["score"]} if me else None, "around": public(around),
+        }
+
+    async def _workouts_per_user(self, start: date, end: date) -> Dict[str, int]:
+        rows = await self.db.workout_logs.aggregate([
+            {"$match": {"date": {"$gte": to_day(start.isoformat()), "$lte": to_day(end.isoformat())}}},
+            {"$group": {"_id": {"user_id": "$user_id", "date": "$date"}}},
+            {"$group": {"_id": "$_id.user_id", "days": {"$sum": 1}}},
+        ]).to_list(None)
+        return {r["_id"]: r["days"] for r in rows}
+
+    async def reconcile(self, now: Optional[datetime] = None) -> int:
+        """Recompute the recent weekly boards from the raw logs. Returns entries corrected."""
+        now = now or utc_now()
+        changed = 0
+        for weeks_back in range(RECONCILE_WEEKS):
+            start = now.date() - timedelta(days=now.weekday(), weeks=weeks_back)
+            end = start + timedelta(days=6)
+            week = week_of(start)
+            recomputed = {
+                WORKOUTS: await self._workouts_per_user(start, end),
+                WATER: await self.tracking.water_goal_days(start.isoformat(), end.isoformat()),
+            }
+            for kind, scores in recomputed.items():
+                changed += await self.store.correct(board_id(kind, week), scores, now, board_expiry(week))
+        self.counts["reconciled"] += changed
+        self.reconciled_at = now
+        return changed
+
+    def _next_reconcile_delay(self, now: datetime) -> float:
+        at = now.replace(hour=self.reconcile_hour, minute=0, second=0, microsecond=0)
+        if at <= now:
+            at += timedelta(days=1)
+        return (at - now).total_seconds()
+
+    async def schedule(self):
+        """Start the nightly reconciliation chain with a run now (no-op if it's already queued)."""
+        if self.queue is not None:
+            await self.queue.enqueue("leaderboards.reconcile", dedupe_key="leaderboards.reconcile")
+
+    async def _reconcile_task(self, payload: dict):
+        try:
+            changed = await self.reconcile()
+            if changed:
+                logger.info(f"Leaderboard reconciliation corrected {changed} entries")
+        except Exception as e:
+            # The chain must not break; tomorrow's run covers the same weeks
+            logger.error(f"Leaderboard reconciliation failed: {e}")
+        await self.queue.enqueue("leaderboards.reconcile", delay=self._next_reconcile_delay(utc_now()),
+                                 dedupe_key="leaderboards.reconcile")
+
+    def stats(self) -> dict:
+        return {**self.counts, "reconciled_at": iso(self.reconciled_at)}
@@ -0,0 +1,356 @@
+"""
+Lightweight background job queue.
+
+Slow side effects (S3 deletes, account deletion, future thumbnailing) are
+enqueued by request handlers and executed by a worker, either inside the API
+process or standalone via `python worker.py`. Jobs are retried with
+exponential backoff and moved to a dead-letter state ("dead") once they run
+out of attempts. A running job holds a lease that the worker renews while the
+handler runs; if the worker dies the lease lapses and another worker takes the
+job over, and the old worker's late result is discarded (`finish` only applies
+to the attempt that still owns the job). Two stores are provided: `MongoJobStore` (shared, durable)
+and `MemoryJobStore` (in-process asyncio, for single-worker setups and tests).
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import uuid
+from collections import deque
+from datetime import datetime, timezone, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, DEAD = "queued", "running", "done", "dead"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _new_job(name: str, payload: dict, run_at: datetime, max_attempts: int, dedupe_key: Optional[str]) -> dict:
+    return {
+        "id": str(uuid.uuid4()), "name": name, "payload": payload, "status": QUEUED,
+        "attempts": 0, "max_attempts": max_attempts, "run_at": run_at,
+        "enqueued_at": _now(), "started_at": None, "finished_at": None,
+        "error": None, "dedupe_key": dedupe_key,
+    }
+
+
+# --- Stores ---
+class JobStore:
+    """Interface for job persistence."""
+
+    async def ensure_indexes(self):
+        pass
+
+    async def add(self, job: dict) -> dict:
+        raise NotImplementedError
+
+    async def claim(self, lease: timedelta) -> Optional[dict]:
+        """Atomically take the oldest due job (or one whose lease has expired)."""
+        raise NotImplementedError
+
+    async def renew(self, job: dict) -> bool:
+        """Extend the lease on a running job. Returns False if another worker took it over."""
+        raise NotImplementedError
+
+    async def finish(self, job: dict, status: str, error: Optional[str] = None,
+                     run_at: Optional[datetime] = None) -> bool:
+        """Record the outcome of this attempt. Returns False (and changes nothing)
+        if the job was taken over since it was claimed. A retry (QUEUED) is recorded
+        as DONE instead if another job with its dedupe_key was queued meanwhile."""
+        raise NotImplementedError
+
+    async def stats(self) -> dict:
+        raise NotImplementedError
+
+
+class MongoJobStore(JobStore):
+    def __init__(self, collection, keep_finished: timedelta = timedelta(days=7)):
+        self._col = collection
+        self._keep = keep_finished
+
+    async def ensure_indexes(self):
+        await self._col.create_index([("status", 1), ("run_at", 1)])
+        await self._col.create_index("dedupe_key", unique=True, partialFilterExpression={
+            "status": QUEUED, "dedupe_key": {"$type": "string"}})
+        await self._col.create_index("expire_at", expireAfterSeconds=0)
+
+    async def add(self, job: dict) -> dict:
+        try:
+            await self._col.insert_one(job.copy())
+        except DuplicateKeyError:
+            existing = await self._col.find_one({"dedupe_key": job["dedupe_key"], "status": QUEUED}, {"_id": 0})
+            return existing or job
+        return job
+
+    async def claim(self, lease: timedelta) -> Optional[dict]:
+        now = _now()
+        return await self._col.find_one_and_update(
+            {"$or": [
+                {"status": QUEUED, "run_at": {"$lte": now}},
+                {"status": RUNNING, "run_at": {"$lte": now - lease}},  # worker died mid-job
+            ]},
+            {"$set": {"status": RUNNING, "run_at": now, "started_at": now}, "$inc": {"attempts": 1}},
+            sort=[("run_at", 1)], projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+        )
+
+    async def renew(self, job: dict) -> bool:
+        result = await self._col.update_one({"id": job["id"], "attempts": job["attempts"], "status": RUNNING},
+                                            {"$set": {"run_at": _now()}})
+        return result.matched_count == 1
+
+    async def finish(self, job: dict, status: str, error: Optional[str] = None,
+                     run_at: Optional[datetime] = None) -> bool:
+        now = _now()
+        update = {"status": status, "error": error, "finished_at": now}
+        if status == QUEUED:
+            update["run_at"] = run_at
+        if status == DONE:
+            update["expire_at"] = now + self._keep
+        query = {"id": job["id"], "attempts": job["attempts"]}
+        try:
+            result = await self._col.update_one(query, {"$set": update})
+        except DuplicateKeyError:
+            # A job with the same dedupe_key was queued while this attempt ran; it does
+            # the same work, so this one is superseded instead of queued twice
+            logger.info(f"Task {job['name']} ({job['id']}) not retried: {job['dedupe_key']} is already queued")
+            update = {"status": DONE, "error": error, "finished_at": now, "expire_at": now + self._keep}
+            result = await self._col.update_one(query, {"$set": update})
+        return result.matched_count == 1
+
+    async def stats(self) -> dict:
+        depth = {s: 0 for s in (QUEUED, RUNNING, DEAD)}
+        async for row in self._col.aggregate([
+            {"$match": {"status": {"$in": list(depth)}}},
+            {"$group": {"_id": "$status", "n": {"$sum": 1}}},
+        ]):
+            depth[row["_id"]] = row["n"]
+        latency = await self._col.aggregate([
+            {"$match": {"status": DONE, "finished_at": {"$gte": _now() - timedelta(minutes=5)}}},
+            {"$group": {
+                "_id": None, "jobs": {"$sum": 1},
+                "wait_ms": {"$avg": {"$subtract": ["$started_at", "$enqueued_at"]}},
+                "run_ms": {"$avg": {"$subtract": ["$finished_at", "$started_at"]}},
+            }},
+        ]).to_list(1)
+        recent = latency[0] if latency else {"jobs": 0, "wait_ms": None, "run_ms": None}
+        return {"depth": depth, "last_5m": {k: recent[k] for k in ("jobs", "wait_ms", "run_ms")}}
+
+
+class MemoryJobStore(JobStore):
+    """In-process heap ordered by run_at. Jobs are lost on restart. Workers get a
+    copy of the job, so a stale attempt can be told apart from the current one."""
+
+    def __init__(self, keep_recent: int = 1000):
+        self._heap: List = []
+        self._seq = itertools.count()
+        self._dedupe: Dict[str, dict] = {}
+        self._running: Dict[str, dict] = {}
+        self._dead: List[dict] = []
+        self._recent: deque = deque(maxlen=keep_recent)
+
+    async def add(self, job: dict) -> dict:
+        key = job.get("dedupe_key")
+        if key and key in self._dedupe:
+            return self._dedupe[key]
+        if key:
+            self._dedupe[key] = job
+        heapq.heappush(self._heap, (job["run_at"], next(self._seq), job))
+        return job
+
+    async def claim(self, lease: timedelta) -> Optional[dict]:
+        now = _now()
+        if self._heap and self._heap[0][0] <= now:
+            _, _, job = heapq.heappop(self._heap)
+            self._dedupe.pop(job.get("dedupe_key"), None)
+        else:
+            # Worker hung or cancelled mid-job
+            job = next((j for j in self._running.values() if j["run_at"] <= now - lease), None)
+            if job is None:
+                return None
+        job.update(status=RUNNING, run_at=now, started_at=now, attempts=job["attempts"] + 1)
+        self._running[job["id"]] = job
+        return dict(job)
+
+    def _owned(self, job: dict) -> Optional[dict]:
+        current = self._running.get(job["id"])
+        return current if current is not None and current["attempts"] == job["attempts"] else None
+
+    async def renew(self, job: dict) -> bool:
+        current = self._owned(job)
+        if current is None:
+            return False
+        current["run_at"] = _now()
+        return True
+
+    async def finish(self, job: dict, status: str, error: Optional[str] = None,
+                     run_at: Optional[datetime] = None) -> bool:
+        job = self._owned(job)
+        if job is None:
+            return False
+        del self._running[job["id"]]
+        key = job.get("dedupe_key")
+        if status == QUEUED and key in self._dedupe:
+            # Superseded by a job with the same dedupe_key queued while this one ran
+            logger.info(f"Task {job['name']} ({job['id']}) not retried: {key} is already queued")
+            status = DONE
+        job.update(status=status, error=error, finished_at=_now())
+        if status == QUEUED:
+            job["run_at"] = run_at
+            if key:
+                self._dedupe[key] = job
+            heapq.heappush(self._heap, (run_at, next(self._seq), job))
+        elif status == DEAD:
+            self._dead.append(job)
+        else:
+            self._recent.append(job)
+        return True
+
+    async def stats(self) -> dict:
+        cutoff = _now() - timedelta(minutes=5)
+        recent = [j for j in self._recent if j["finished_at"] >= cutoff]
+
+        def avg_ms(pairs):
+            return sum((b - a).total_seconds() * 1000 for a, b in pairs) / len(pairs) if pairs else None
+
+        return {
+            "depth": {QUEUED: len(self._heap), RUNNING: len(self._running), DEAD: len(self._dead)},
+            "last_5m": {
+                "jobs": len(recent),
+                "wait_ms": avg_ms([(j["enqueued_at"], j["started_at"]) for j in recent]),
+                "run_ms": avg_ms([(j["started_at"], j["finished_at"]) for j in recent]),
+            },
+        }
+
+
+# --- Queue / Worker ---
+Handler = Callable[[dict], Awaitable[Any]]
+
+
+class TaskQueue:
+    def __init__(self, store: JobStore, concurrency: int = 4, max_attempts: int = 5,
+                 base_delay: float = 2.0, max_delay: float = 600.0, poll_interval: float = 1.0,
+                 lease: timedelta = timedelta(minutes=5)):
+        self.store = store
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.handlers: Dict[str, Handler] = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._runner: Optional[asyncio.Task] = None
+
+    def handler(self, name: str):
+        """Decorator registering an async handler that receives the job payload."""
+        def register(fn: Handler) -> Handler:
+            self.handlers[name] = fn
+            return fn
+        return register
+
+    async def enqueue(self, name: str, payload: Optional[dict] = None, delay: float = 0,
+                      dedupe_key: Optional[str] = None, max_attempts: Optional[int] = None) -> dict:
+        """Queue a job. While a job with the same `dedupe_key` is still queued, that job is returned instead."""
+        if name not in self.handlers:
+            raise ValueError(f"No handler registered for task '{name}'")
+        job = _new_job(name, payload or {}, _now() + timedelta(seconds=delay),
+                       max_attempts or self.max_attempts, dedupe_key)
+        job = await self.store.add(job)
+        self._wakeup.set()
+        return job
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _heartbeat(self, job: dict):
+        """Renew the job's lease every third of it. Returns once the lease is lost."""
+        while True:
+            await asyncio.sleep(self.lease.total_seconds() / 3)
+            try:
+                if not await self.store.renew(job):
+                    return
+            except Exception as e:
+                logger.warning(f"Task {job['name']} ({job['id']}) lease renewal failed: {e}")
+
+    async def _run_leased(self, handler: Handler, job: dict):
+        """Run the handler while holding the lease; cancel it if the lease is lost."""
+        run = asyncio.ensure_future(handler(job["payload"]))
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            await asyncio.wait({run, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            heartbeat.cancel()
+        if not run.done():
+            run.cancel()
+            raise RuntimeError("lease lost to another worker")
+        return run.result()
+
+    async def _finish(self, job: dict, status: str, **kwargs) -> bool:
+        if not await self.store.finish(job, status, **kwargs):
+            logger.warning(f"Task {job['name']} ({job['id']}) was taken over by another worker; "
+                           f"attempt {job['attempts']} result ({status}) discarded")
+            return False
+        return True
+
+    async def _execute(self, job: dict, slots: asyncio.Semaphore):
+        try:
+            handler = self.handlers.get(job["name"])
+            if handler is None:
+                raise RuntimeError(f"No handler registered for task '{job['name']}'")
+            await self._run_leased(handler, job)
+            await self._finish(job, DONE)
+        except Exception as e:
+            if job["attempts"] >= job["max_attempts"]:
+                if await self._finish(job, DEAD, error=str(e)):
+                    logger.error(f"Task {job['name']} ({job['id']}) dead after {job['attempts']} attempts: {e}")
+            else:
+                delay = self.backoff(job["attempts"])
+                if await self._finish(job, QUEUED, error=str(e), run_at=_now() + timedelta(seconds=delay)):
+                    logger.warning(f"Task {job['name']} ({job['id']}) failed, retrying in {delay:.1f}s: {e}")
+        finally:
+            slots.release()
+
+    async def run(self):
+        """Claim and execute jobs until `stop()` is called, at most `concurrency` at a time."""
+        slots = asyncio.Semaphore(self.concurrency)
+        running = set()
+        while not self._stopping:
+            await slots.acquire()
+            try:
+                job = await self.store.claim(self.lease)
+            except Exception as e:
+                logger.error(f"Task claim failed: {e}")
+                job = None
+            if job is None:
+                slots.release()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(self._execute(job, slots))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        if running:
+            await asyncio.wait(running)
+
+    def start(self):
+        self._stopping = False
+        self._runner = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._runner:
+            await self._runner
@@ -0,0 +1,68 @@
+"""
+Account deletion tests (in-process, Mongo mocked with mongomock-motor)
+Tests: the user is marked gone at request time, failed runs are retried by the task queue
+"""
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from account_deletion import MAX_ATTEMPTS, AccountDeleter
+from tasks import DEAD, MemoryJobStore, TaskQueue
+from users import UserRepository
+
+PREFIX = "https://bucket.s3.amazonaws.com/"
+
+
+class FlakyS3:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.deleted = []
+
+    def delete_objects(self, Bucket: str, Delete: dict):
+        if self.failures:
+            self.failures -= 1
+            return {"Errors": [{"Key": Delete["Objects"][0]["Key"], "Message": "SlowDown"}]}
+        self.deleted += [o["Key"] for o in Delete["Objects"]]
+        return {}
+
+
+async def delete_user(failures: int):
+    db = mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit
+    await db.users.insert_one({"id": "u1", "email": "u1@test.com", "name": "U"})
+    await db.progress_photos.insert_one({"id": "p1", "user_id": "u1", "photo_url": PREFIX + "progress-photos/p1.jpeg"})
+    queue = TaskQueue(MemoryJobStore(), base_delay=0.01, poll_interval=0.01)
+    s3 = FlakyS3(failures)
+    deleter = AccountDeleter(db, s3, "bucket", PREFIX, queue=queue)
+    users = UserRepository(db.users)
+
+    job = await deleter.request("u1")
+    assert await users.get_profile("u1") is None
+    queue.start()
+    for _ in range(300):
+        job = await deleter.status(job["id"], "u1")
+        if job["status"] in ("done", "failed"):
+            break
+        await asyncio.sleep(0.01)
+    await queue.stop()
+    dead = (await queue.store.stats())["depth"][DEAD]
+    return job, s3, dead, await db.users.count_documents({})
+
+
+class TestAccountDeletion:
+    """Deletion job + retry tests"""
+    
+    def test_failed_run_is_retried_from_checkpoint(self):
+        """Test a transient S3 failure is retried by the queue and the deletion completes"""
+        job, s3, dead, remaining = asyncio.run(delete_user(failures=2))
+        assert (job["status"], job["attempts"]) == ("done", 3)
+        assert s3.deleted == ["progress-photos/p1.jpeg"]
+        assert (dead, remaining) == (0, 0)
+    
+    def test_job_fails_after_max_attempts(self):
+        """Test the job is marked failed (and the user kept) once the queue's attempts are used up"""
+        job, s3, dead, remaining = asyncio.run(delete_user(failures=MAX_ATTEMPTS))
+        assert (job["status"], job["attempts"]) == ("failed", MAX_ATTEMPTS)
+        assert "SlowDown" in job["error"]
+        assert (dead, remaining) == (1, 1)
@@ -0,0 +1,105 @@
+"""
+Admission control tests (in-process, no server needed)
+Tests: priority shares of the limit, 503 + Retry-After, AIMD adjustments, baselines per route
+"""
+import asyncio
+
+from admission import AdaptiveLimit, AdmissionMiddleware, PriorityRoute, CRITICAL, NORMAL, SHEDDABLE, UNMATCHED_ROUTE
+
+ROUTES = [
+    PriorityRoute(CRITICAL, ("GET",), "/api/water-intake*"),
+    PriorityRoute(SHEDDABLE, ("POST",), "/api/auth/*"),
+]
+
+
+async def call(app, method: str, path: str) -> dict:
+    sent = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            sent["status"] = message["status"]
+            sent["headers"] = dict(message["headers"])
+
+    await app({"type": "http", "method": method, "path": path, "headers": []}, receive, send)
+    return sent
+
+
+class TestAdmission:
+    """Adaptive limit + middleware tests"""
+    
+    def test_classes_share_the_limit(self):
+        """Test sheddable requests are turned away first and critical ones last"""
+        limit = AdaptiveLimit(initial=10, min_limit=1)
+        admitted = [limit.try_acquire(SHEDDABLE) for _ in range(6)]
+        assert admitted.count(True) == 5
+        assert limit.try_acquire(NORMAL) and limit.try_acquire(NORMAL) and limit.try_acquire(NORMAL)
+        assert not limit.try_acquire(NORMAL)
+        assert limit.try_acquire(CRITICAL) and limit.try_acquire(CRITICAL)
+        assert not limit.try_acquire(CRITICAL)
+        assert limit.stats()["shed"] == {CRITICAL: 1, NORMAL: 1, SHEDDABLE: 1}
+    
+    def test_shed_request_gets_503_with_retry_after(self):
+        """Test a rejected request never reaches the app and carries Retry-After"""
+        reached = []
+
+        async def app(scope, receive, send):
+            reached.append(scope["path"])
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        limit = AdaptiveLimit(initial=2, min_limit=1)
+        middleware = AdmissionMiddleware(app, ROUTES, limit)
+        limit.inflight = 1  # half the limit in use: no room for sheddable requests
+        shed = asyncio.run(call(middleware, "POST", "/api/auth/login"))
+        assert shed["status"] == 503
+        assert int(shed["headers"][b"retry-after"]) >= 1
+        ok = asyncio.run(call(middleware, "GET", "/api/water-intake"))
+        assert ok["status"] == 200
+        assert reached == ["/api/water-intake"]
+        assert limit.inflight == 1
+        assert limit.stats()["admitted"][CRITICAL] == 1
+        assert limit.stats()["shed"][SHEDDABLE] == 1
+    
+    def test_limit_decreases_when_latency_rises(self):
+        """Test a window whose latency is well above the route baseline shrinks the limit"""
+        limit = AdaptiveLimit(initial=100, min_limit=10, window=20)
+        for _ in range(20):
+            limit.try_acquire(NORMAL)
+            limit.release("GET /api/dashboard", 0.005)
+        assert limit.limit >= 100
+        for _ in range(20):
+            limit.try_acquire(NORMAL)
+            limit.release("GET /api/dashboard", 0.050)
+        assert limit.limit < 100
+        assert limit.decreases == 1
+    
+    def test_slow_route_is_not_congestion(self):
+        """Test latency is judged per route, so slow logins don't shrink the limit"""
+        limit = AdaptiveLimit(initial=100, window=20)
+        for i in range(200):
+            limit.try_acquire(NORMAL)
+            if i % 2:
+                limit.release("POST /api/auth/login", 0.25)
+            else:
+                limit.release("GET /api/dashboard", 0.005)
+        assert limit.decreases == 0
+        assert limit.limit == 100
+    
+    def test_unmatched_paths_share_one_baseline(self):
+        """Test requests that match no route are keyed together, so scanning random paths can't grow the baselines"""
+        async def not_found(scope, receive, send):
+            await send({"type": "http.response.start", "status": 404, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        limit = AdaptiveLimit(initial=100)
+        middleware = AdmissionMiddleware(not_found, ROUTES, limit)
+
+        async def run():
+            for i in range(50):
+                await call(middleware, "GET", f"/api/scan-{i}")
+
+        asyncio.run(run())
+        assert list(limit._baselines) == [f"GET {UNMATCHED_ROUTE}"]
@@ -0,0 +1,73 @@
+"""
+Custom plan diff tests (in-process, no server needed)
+Tests: diff round trips, replaced exercises stored whole, old delta-only diffs, template cache TTL
+"""
+import asyncio
+import copy
+
+import pytest
+
+from custom_plans import CustomPlans, apply_diff, compute_diff
+
+TEMPLATE = {
+    "id": "t", "name": "Full Body", "days_per_week": 2, "days": [
+        {"day": 1, "name": "A", "exercises": [
+            {"name": "Barbell Squat", "sets": 3, "reps": "8-10", "weight_kg": 40, "notes": "Focus on form"},
+            {"name": "Bench Press", "sets": 3, "reps": "8-10", "weight_kg": 30, "equipment": "Barbell"},
+        ]},
+        {"day": 3, "name": "B", "exercises": [{"name": "Deadlift", "sets": 3, "reps": "5", "weight_kg": 60}]},
+    ],
+}
+
+
+class TestCustomPlanDiffs:
+    """compute_diff / apply_diff tests"""
+    
+    def test_edits_round_trip_as_deltas(self):
+        """Test changed fields of the same exercise are stored as a delta and applied back"""
+        plan = copy.deepcopy(TEMPLATE)
+        plan["days"][0]["exercises"][0]["weight_kg"] = 50
+        plan["days"][1]["exercises"].append({"name": "Plank", "sets": 3, "reps": "45s"})
+        diff = compute_diff(TEMPLATE, plan)
+        assert diff["days"]["1"] == {"exercises": {"0": {"weight_kg": 50}}}
+        assert apply_diff(TEMPLATE, diff) == plan
+    
+    def test_replaced_exercise_does_not_inherit_template_fields(self):
+        """Test a different exercise in a template slot, or one with fields removed, is stored whole"""
+        plan = copy.deepcopy(TEMPLATE)
+        plan["days"][0]["exercises"][1] = {"name": "Push-Up", "sets": 3, "reps": "10-15"}
+        del plan["days"][0]["exercises"][0]["notes"]
+        diff = compute_diff(TEMPLATE, plan)
+        assert diff["days"]["1"]["replaced"] == {
+            "0": {"name": "Barbell Squat", "sets": 3, "reps": "8-10", "weight_kg": 40},
+            "1": {"name": "Push-Up", "sets": 3, "reps": "10-15"},
+        }
+        resolved = apply_diff(TEMPLATE, diff)
+        assert resolved == plan
+        assert "weight_kg" not in resolved["days"][0]["exercises"][1]
+    
+    def test_stored_delta_diffs_still_apply(self):
+        """Test diffs saved before `replaced` existed resolve as before"""
+        diff = {"days": {"1": {"exercises": {"1": {"name": "Incline Press"}}}, "3": None}}
+        resolved = apply_diff(TEMPLATE, diff)
+        assert resolved["days"][0]["exercises"][1] == {
+            "name": "Incline Press", "sets": 3, "reps": "8-10", "weight_kg": 30, "equipment": "Barbell"}
+        assert [d["day"] for d in resolved["days"]] == [1]
+    
+    def test_template_cache_expires_without_invalidation(self):
+        """Test cached templates are reloaded once older than the TTL even if no change event arrives"""
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        db = mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit
+        ttl = [3600.0]
+        plans = CustomPlans(db, templates_ttl=lambda: ttl[0])
+
+        async def run():
+            await db.workout_plans.insert_one(copy.deepcopy(TEMPLATE))
+            assert (await plans.template("t"))["name"] == "Full Body"
+            # Edited by another worker; no cache_bus event reaches this one
+            await db.workout_plans.update_one({"id": "t"}, {"$set": {"name": "Full Body v2"}})
+            assert (await plans.template("t"))["name"] == "Full Body"
+            ttl[0] = 0.0
+            assert (await plans.template("t"))["name"] == "Full Body v2"
+
+        asyncio.run(run())
@@ -0,0 +1,43 @@
+"""
+Exercise index tests (in-process, Mongo mocked with mongomock-motor)
+Tests: template rows follow edited and newly seeded templates, unchanged templates aren't rebuilt
+"""
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from exercises import ExerciseIndex
+
+
+def template(plan_id: str, *names: str) -> dict:
+    return {"id": plan_id, "name": plan_id.title(), "level": "Beginner",
+            "days": [{"day": 1, "name": "Day 1",
+                      "exercises": [{"name": n, "muscle_group": "Chest", "sets": 3, "reps": "8-12"} for n in names]}]}
+
+
+class TestExerciseIndex:
+    """Template re-indexing tests"""
+    
+    def test_templates_reindexed_when_contents_change(self):
+        """Test startup rebuilds the template rows after a template is edited or added, and skips them otherwise"""
+        index = ExerciseIndex(mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit.exercise_index)
+
+        async def names():
+            return sorted(row["name"] for row in await index.search(q=""))
+
+        async def run():
+            plans = [template("starter", "Bench Press")]
+            assert await index.index_templates(plans) is True
+            assert await index.index_templates(plans) is False
+            # An owned plan isn't touched by a template rebuild
+            await index.index_plan(template("mine", "Dips"), owner_id="u1")
+
+            plans = [template("starter", "Incline Bench Press"), template("strength", "Deadlift")]
+            assert await index.index_templates(plans) is True
+            assert await names() == ["Deadlift", "Incline Bench Press"]
+            assert await index.index_templates(list(reversed(plans))) is False
+            assert len(await index.search(user_id="u1")) == 3
+
+        asyncio.run(run())
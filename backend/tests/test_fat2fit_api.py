@@ -6,6 +6,9 @@ import pytest
 import requests
 import os
 import uuid
+import json
+import time
+import hashlib
 from datetime import datetime
 from pathlib import Path
 
@@ -21,6 +24,24 @@ def load_backend_url():
 
 BASE_URL = load_backend_url()
 
+
+@pytest.fixture(scope="session", autouse=True)
+def wait_out_rate_limits():
+    """The API rate-limits each user and IP; wait out a 429's Retry-After instead of failing on it"""
+    send = requests.Session.send
+
+    def patient_send(self, request, **kwargs):
+        for _ in range(5):
+            response = send(self, request, **kwargs)
+            if response.status_code != 429:
+                break
+            time.sleep(float(response.headers.get("Retry-After", "1")))
+        return response
+
+    requests.Session.send = patient_send
+    yield
+    requests.Session.send = send
+
 class TestAuth:
     """Authentication flow tests"""
     
@@ -131,10 +152,29 @@ class TestWorkoutPlans:
         response = requests.get(f"{BASE_URL}/api/workout-plans/nonexistent-plan")
         assert response.status_code == 404
 
+    def test_search_exercises(self):
+        """Test filtering exercises by muscle group, level and equipment"""
+        response = requests.get(f"{BASE_URL}/api/workout-plans/search",
+            params={"muscle": "legs", "level": "beginner", "equipment": "barbell"}
+        )
+        assert response.status_code == 200
+        exercises = response.json()
+        assert len(exercises) > 0
+        assert all(e["plan_id"] == "beginner-full-body" for e in exercises)
+        assert "Barbell Squat" in [e["name"] for e in exercises]
+
+    def test_search_grouped_by_plan(self):
+        """Test grouping matches by plan"""
+        response = requests.get(f"{BASE_URL}/api/workout-plans/search", params={"q": "deadlift", "group_by": "plan"})
+        assert response.status_code == 200
+        plans = response.json()
+        assert {p["plan_id"] for p in plans} == {"beginner-full-body", "intermediate-ppl", "advanced-power"}
+        assert all(p["matches"] >= 1 for p in plans)
+
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def auth_token():
-    """Fixture to provide authentication token"""
+    """Fixture to provide authentication token (one login per run; logins are rate-limited per IP)"""
     response = requests.post(f"{BASE_URL}/api/auth/login", json={
         "email": "test@fat2fit.com",
         "password": "test123456"
@@ -277,6 +317,15 @@ class TestWaterIntake:
         assert response.status_code == 200
         after_count = response.json()["glasses"]
         assert after_count == before_count - 1
+    
+    def test_invalid_calendar_date_rejected(self, auth_token):
+        """Test dates that match YYYY-MM-DD but don't exist get a 422, not a 500"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        response = requests.post(f"{BASE_URL}/api/water-intake/add", headers=headers, json={"date": "2026-02-30"})
+        assert response.status_code == 422
+        assert requests.get(f"{BASE_URL}/api/water-intake?date=2026-13-01", headers=headers).status_code == 422
+        response = requests.post(f"{BASE_URL}/api/weight-entries", headers=headers, json={"weight": 80, "date": "2025-02-29"})
+        assert response.status_code == 422
 
 
 class TestWorkoutLogs:
@@ -407,6 +456,55 @@ class TestProgressPhotos:
             headers={"Authorization": f"Bearer {auth_token}"}
         )
         assert get_response.status_code == 404
+    
+    def test_identical_photos_share_storage(self, auth_token):
+        """Test identical images are stored once and survive deleting one of the photos"""
+        import base64
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        image = "data:image/jpeg;base64," + base64.b64encode(os.urandom(512)).decode()
+        first = requests.post(f"{BASE_URL}/api/progress-photos", headers=headers,
+            json={"photo_base64": image, "date": "2026-02-02", "note": "first"}).json()
+        second = requests.post(f"{BASE_URL}/api/progress-photos", headers=headers,
+            json={"photo_base64": image, "date": "2026-02-03", "note": "second"}).json()
+        assert first["photo_url"] == second["photo_url"]
+        assert "/sha256/" in first["photo_url"]
+        
+        requests.delete(f"{BASE_URL}/api/progress-photos/{first['id']}", headers=headers)
+        remaining = requests.get(f"{BASE_URL}/api/progress-photos/{second['id']}", headers=headers)
+        assert remaining.status_code == 200
+        assert remaining.json()["photo_url"]
+    
+    def test_photo_upload_requires_object_before_confirm(self, auth_token):
+        """Test a presigned upload is issued for a progress-photos/ key and can't be confirmed before the object exists"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        response = requests.post(f"{BASE_URL}/api/progress-photos/uploads", headers=headers,
+            json={"content_type": "image/png", "date": "2026-02-01", "note": "Direct upload",
+                  "sha256": hashlib.sha256(b"photo").hexdigest()})
+        assert response.status_code == 200
+        upload = response.json()
+        assert upload["url"].startswith("https://")
+        assert upload["fields"]["key"].startswith("progress-photos/")
+        assert upload["fields"]["key"].endswith(".png")
+        assert upload["fields"]["Content-Type"] == "image/png"
+        assert upload["fields"]["x-amz-checksum-algorithm"] == "SHA256"
+        
+        # The file's SHA-256 is required so S3 can check the upload against it
+        missing = requests.post(f"{BASE_URL}/api/progress-photos/uploads", headers=headers,
+            json={"content_type": "image/png", "date": "2026-02-01"})
+        assert missing.status_code == 422
+        
+        confirm = requests.post(f"{BASE_URL}/api/progress-photos/uploads/{upload['upload_id']}/confirm", headers=headers)
+        assert confirm.status_code == 409
+        
+        unknown = requests.post(f"{BASE_URL}/api/progress-photos/uploads/{uuid.uuid4()}/confirm", headers=headers)
+        assert unknown.status_code == 404
+    
+    def test_photo_upload_rejects_non_image(self, auth_token):
+        """Test only image content types can be uploaded"""
+        response = requests.post(f"{BASE_URL}/api/progress-photos/uploads",
+            headers={"Authorization": f"Bearer {auth_token}"},
+            json={"content_type": "application/pdf", "date": "2026-02-01", "sha256": hashlib.sha256(b"pdf").hexdigest()})
+        assert response.status_code == 400
 
 
 class TestProfile:
@@ -466,3 +564,366 @@ class TestDashboard:
         
         # Verify weight_history is a list
         assert isinstance(data["weight_history"], list)
+
+
+class TestIdempotency:
+    """Idempotency-Key replay tests"""
+    
+    def test_add_water_replayed_with_same_key(self, auth_token):
+        """Test retrying add water with the same key does not add a second glass"""
+        test_date = "2026-11-11"
+        headers = {"Authorization": f"Bearer {auth_token}", "Idempotency-Key": uuid.uuid4().hex}
+        
+        first = requests.post(f"{BASE_URL}/api/water-intake/add", headers=headers, json={"date": test_date})
+        assert first.status_code == 200
+        retry = requests.post(f"{BASE_URL}/api/water-intake/add", headers=headers, json={"date": test_date})
+        assert retry.status_code == 200
+        assert retry.json() == first.json()
+        
+        # Verify only one glass was counted
+        get_response = requests.get(f"{BASE_URL}/api/water-intake?date={test_date}",
+            headers={"Authorization": f"Bearer {auth_token}"}
+        )
+        assert get_response.json()["glasses"] == first.json()["glasses"]
+    
+    def test_key_reused_with_different_body(self, auth_token):
+        """Test reusing a key for a different request returns 422"""
+        headers = {"Authorization": f"Bearer {auth_token}", "Idempotency-Key": uuid.uuid4().hex}
+        requests.post(f"{BASE_URL}/api/water-intake/add", headers=headers, json={"date": "2026-11-12"})
+        response = requests.post(f"{BASE_URL}/api/water-intake/add", headers=headers, json={"date": "2026-11-13"})
+        assert response.status_code == 422
+
+
+class TestDataExport:
+    """Streaming data export tests"""
+    
+    def test_export_ndjson_and_resume(self, auth_token):
+        """Test NDJSON export ends with a done marker and resumes from a cursor"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        requests.post(f"{BASE_URL}/api/weight-entries", headers=headers, json={"weight": 80.0, "date": "2026-02-01"})
+        requests.post(f"{BASE_URL}/api/weight-entries", headers=headers, json={"weight": 79.5, "date": "2026-02-02"})
+        
+        response = requests.get(f"{BASE_URL}/api/export", headers=headers)
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert lines[-1] == {"done": True}
+        records = lines[:-1]
+        assert records[0]["collection"] == "users"
+        assert "password_hash" not in records[0]["record"]
+        
+        # Resume after the first record
+        resumed = requests.get(f"{BASE_URL}/api/export", headers=headers, params={"cursor": records[0]["cursor"]})
+        assert resumed.status_code == 200
+        resumed_records = [json.loads(line) for line in resumed.text.splitlines()][:-1]
+        assert [r["cursor"] for r in resumed_records] == [r["cursor"] for r in records[1:]]
+        
+        # The zipped CSV has no resume tokens, so a cursor is rejected rather than ignored
+        csv_resume = requests.get(f"{BASE_URL}/api/export", headers=headers,
+                                  params={"format": "csv", "cursor": records[0]["cursor"]})
+        assert csv_resume.status_code == 400
+
+
+class TestAccountDeletion:
+    """Account deletion job tests"""
+    
+    def test_delete_account(self):
+        """Test deleting a fresh account removes the user and reports progress"""
+        signup = requests.post(f"{BASE_URL}/api/auth/signup", json={
+            "name": "Delete Me",
+            "email": f"TEST_delete_{uuid.uuid4().hex[:8]}@test.com",
+            "password": "testpass123"
+        })
+        assert signup.status_code == 200
+        headers = {"Authorization": f"Bearer {signup.json()['token']}"}
+        requests.post(f"{BASE_URL}/api/weight-entries", headers=headers, json={"weight": 90.0, "date": "2026-03-01"})
+        
+        response = requests.delete(f"{BASE_URL}/api/account", headers=headers)
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        
+        # The token stops working for everything but following the deletion
+        water = requests.post(f"{BASE_URL}/api/water-intake/add", headers=headers, json={"date": "2026-03-01"})
+        assert water.status_code == 401
+        
+        # Poll until the background job finishes
+        for _ in range(50):
+            job = requests.get(f"{BASE_URL}/api/account/deletion/{job_id}", headers=headers).json()
+            if job["status"] in ("done", "failed"):
+                break
+            time.sleep(0.1)
+        assert job["status"] == "done"
+        assert job["deleted"]["weight_entries"] == 1
+        assert job["deleted"]["users"] == 1
+        
+        me = requests.get(f"{BASE_URL}/api/auth/me", headers=headers)
+        assert me.status_code == 401
+        assert requests.delete(f"{BASE_URL}/api/account", headers=headers).status_code == 404
+
+
+class TestRollups:
+    """Water and weight rollup tests"""
+    
+    def test_weekly_rollup_and_invalidation(self):
+        """Test weekly buckets, goal streaks and that a write refreshes cached rollups"""
+        signup = requests.post(f"{BASE_URL}/api/auth/signup", json={
+            "name": "Rollup User",
+            "email": f"TEST_rollup_{uuid.uuid4().hex[:8]}@test.com",
+            "password": "testpass123"
+        })
+        headers = {"Authorization": f"Bearer {signup.json()['token']}"}
+        # 2026-06-01 is a Monday; hit the goal on the 1st and 2nd
+        for day in ("2026-06-01", "2026-06-02"):
+            for _ in range(8):
+                requests.post(f"{BASE_URL}/api/water-intake/add", headers=headers, json={"date": day})
+        requests.post(f"{BASE_URL}/api/weight-entries", headers=headers, json={"weight": 82.0, "date": "2026-06-01"})
+        requests.post(f"{BASE_URL}/api/weight-entries", headers=headers, json={"weight": 81.0, "date": "2026-06-09"})
+        
+        params = {"start": "2026-06-01", "end": "2026-06-14", "period": "week"}
+        response = requests.get(f"{BASE_URL}/api/stats/rollups", headers=headers, params=params)
+        assert response.status_code == 200
+        data = response.json()
+        assert [b["start"] for b in data["buckets"]] == ["2026-06-01", "2026-06-08"]
+        assert data["buckets"][0]["glasses_total"] == 16
+        assert data["buckets"][0]["goal_hit_days"] == 2
+        assert data["totals"]["weight_min"] == 81.0
+        assert data["totals"]["weight_max"] == 82.0
+        assert data["streaks"]["longest"] == 2
+        
+        # A write is visible on the next read
+        requests.post(f"{BASE_URL}/api/water-intake/add", headers=headers, json={"date": "2026-06-10"})
+        data = requests.get(f"{BASE_URL}/api/stats/rollups", headers=headers, params=params).json()
+        assert data["buckets"][1]["glasses_total"] == 1
+    
+    def test_rollup_invalid_range(self, auth_token):
+        """Test start after end is rejected"""
+        response = requests.get(f"{BASE_URL}/api/stats/rollups",
+            headers={"Authorization": f"Bearer {auth_token}"},
+            params={"start": "2026-06-14", "end": "2026-06-01"}
+        )
+        assert response.status_code == 400
+
+
+class TestCustomPlans:
+    """Custom plan fork/edit tests"""
+    
+    def test_fork_edit_and_delete(self, auth_token):
+        """Test forking a template, editing one exercise and deleting the plan"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        template = requests.get(f"{BASE_URL}/api/workout-plans/beginner-full-body").json()
+        
+        response = requests.post(f"{BASE_URL}/api/custom-plans", headers=headers,
+            json={"template_id": "beginner-full-body", "name": "TEST_My Plan"})
+        assert response.status_code == 200
+        plan = response.json()
+        assert plan["name"] == "TEST_My Plan"
+        assert plan["days"] == template["days"]
+        
+        # Heavier squat, push-ups instead of bench press, drop the plank
+        days = plan["days"]
+        days[0]["exercises"][0]["weight_kg"] = 50
+        push_ups = {"name": "Push-Up", "sets": 3, "reps": "10-15", "muscle_group": "Chest"}
+        days[0]["exercises"][1] = push_ups
+        del days[0]["exercises"][4]
+        response = requests.put(f"{BASE_URL}/api/custom-plans/{plan['id']}", headers=headers, json={"days": days})
+        assert response.status_code == 200
+        
+        updated = requests.get(f"{BASE_URL}/api/custom-plans/{plan['id']}", headers=headers).json()
+        assert updated["days"][0]["exercises"][0]["weight_kg"] == 50
+        assert updated["days"][0]["exercises"][1] == push_ups
+        assert len(updated["days"][0]["exercises"]) == 4
+        assert updated["days"][1] == template["days"][1]
+        
+        # The custom plan is searchable by its owner only
+        search = requests.get(f"{BASE_URL}/api/workout-plans/search", headers=headers,
+            params={"q": "barbell squat", "group_by": "plan"}).json()
+        assert plan["id"] in [p["plan_id"] for p in search]
+        anonymous = requests.get(f"{BASE_URL}/api/workout-plans/search",
+            params={"q": "barbell squat", "group_by": "plan"}).json()
+        assert plan["id"] not in [p["plan_id"] for p in anonymous]
+        
+        response = requests.delete(f"{BASE_URL}/api/custom-plans/{plan['id']}", headers=headers)
+        assert response.status_code == 200
+        response = requests.get(f"{BASE_URL}/api/custom-plans/{plan['id']}", headers=headers)
+        assert response.status_code == 404
+
+
+class TestProgression:
+    """Progressive-overload suggestion tests"""
+    
+    def test_suggestions_follow_logged_sessions(self):
+        """Test reps are added within the rep range, then weight once the top is reached"""
+        signup = requests.post(f"{BASE_URL}/api/auth/signup", json={
+            "name": "Lifter",
+            "email": f"TEST_lifter_{uuid.uuid4().hex[:8]}@test.com",
+            "password": "testpass123"
+        })
+        headers = {"Authorization": f"Bearer {signup.json()['token']}"}
+        
+        def log(date, reps):
+            response = requests.post(f"{BASE_URL}/api/workout-logs", headers=headers, json={
+                "date": date, "plan_name": "Full Body Foundation", "day_name": "Full Body A",
+                "exercises": [{"name": "Barbell Squat", "muscle_group": "Legs",
+                               "sets": [{"reps": reps, "weight": 40}] * 3}],
+            })
+            assert response.status_code == 200
+        
+        # Beginner squat is prescribed at 8-10 reps
+        log("2026-04-01", 8)
+        suggestion = requests.get(f"{BASE_URL}/api/progression/suggestions", headers=headers).json()[0]["suggestion"]
+        assert suggestion == {"weight": 40.0, "reps": 9, "reason": "add_reps"}
+        
+        log("2026-04-03", 10)
+        state = requests.get(f"{BASE_URL}/api/progression/suggestions", headers=headers,
+            params={"exercise": "barbell squat"}).json()[0]
+        assert state["sessions"] == 2
+        assert state["last_date"] == "2026-04-03"
+        assert state["suggestion"] == {"weight": 45.0, "reps": 8, "reason": "add_weight"}
+
+
+class TestConditionalGet:
+    """Compression and ETag tests"""
+    
+    def test_workout_plans_compressed_and_cached(self):
+        """Test the plans list is compressed and revalidates with 304"""
+        response = requests.get(f"{BASE_URL}/api/workout-plans", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        etag = response.headers["ETag"]
+        
+        cached = requests.get(f"{BASE_URL}/api/workout-plans", headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+    
+    def test_weight_entries_etag_changes_on_write(self, auth_token):
+        """Test a weight write invalidates the weight list ETag"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        etag = requests.get(f"{BASE_URL}/api/weight-entries", headers=headers).headers["ETag"]
+        cached = requests.get(f"{BASE_URL}/api/weight-entries", headers={**headers, "If-None-Match": etag})
+        assert cached.status_code == 304
+        
+        requests.post(f"{BASE_URL}/api/weight-entries", headers=headers, json={"weight": 77.0, "date": "2026-05-05"})
+        fresh = requests.get(f"{BASE_URL}/api/weight-entries", headers={**headers, "If-None-Match": etag})
+        assert fresh.status_code == 200
+        assert fresh.headers["ETag"] != etag
+        assert any(e["date"] == "2026-05-05" for e in fresh.json())
+
+
+class TestRequestIds:
+    """Request ID tests"""
+    
+    def test_request_id_generated_and_echoed(self):
+        """Test every response carries a request ID and a client-supplied one is kept"""
+        response = requests.get(f"{BASE_URL}/api/workout-plans")
+        assert response.status_code == 200
+        assert response.headers.get("X-Request-ID")
+        
+        supplied = f"test-{uuid.uuid4().hex[:12]}"
+        echoed = requests.get(f"{BASE_URL}/api/workout-plans", headers={"X-Request-ID": supplied})
+        assert echoed.headers["X-Request-ID"] == supplied
+        
+        invalid = requests.get(f"{BASE_URL}/api/workout-plans", headers={"X-Request-ID": "bad id\twith spaces"})
+        assert invalid.headers["X-Request-ID"] != "bad id\twith spaces"
+
+
+class TestAdmission:
+    """Admission control tests"""
+    
+    def test_metrics_require_admin(self, auth_token):
+        """Test internal counters (admission, queues, query shapes) are hidden from anonymous and non-admin callers"""
+        assert requests.get(f"{BASE_URL}/api/metrics").status_code in (401, 403)
+        
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        assert requests.get(f"{BASE_URL}/api/metrics", headers=headers).status_code == 403
+
+
+class TestProfiler:
+    """Admin profiler tests"""
+    
+    def test_profile_requires_admin(self, auth_token):
+        """Test the profile endpoint rejects anonymous and non-admin callers"""
+        anonymous = requests.post(f"{BASE_URL}/api/admin/profile?seconds=0.1")
+        assert anonymous.status_code in (401, 403)
+        
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        user = requests.post(f"{BASE_URL}/api/admin/profile?seconds=0.1", headers=headers)
+        assert user.status_code == 403
+        
+        # The per-request header is ignored for non-admins
+        profiled = requests.get(f"{BASE_URL}/api/auth/me", headers={**headers, "X-Profile": "collapsed"})
+        assert profiled.status_code == 200
+        assert "email" in profiled.json()
+        assert "X-Profiled-Status" not in profiled.headers
+
+
+class TestReminders:
+    """Reminder settings tests"""
+    
+    def test_update_and_get_reminders(self, auth_token):
+        """Test reminder settings round-trip and report the next due times"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        response = requests.put(f"{BASE_URL}/api/reminders", headers=headers, json={
+            "timezone": "Europe/London",
+            "water": {"enabled": True, "start": "08:00", "end": "20:00", "every_minutes": 90},
+            "workout": {"enabled": True, "time": "07:30", "days_per_week": 3},
+        })
+        assert response.status_code == 200
+        data = response.json()
+        assert data["workout"]["days"] == [0, 2, 4]
+        assert data["next"]["water"] is not None
+        assert data["next"]["workout"] is not None
+        
+        fetched = requests.get(f"{BASE_URL}/api/reminders", headers=headers).json()
+        assert fetched["timezone"] == "Europe/London"
+        assert fetched["water"]["every_minutes"] == 90
+        
+        requests.put(f"{BASE_URL}/api/reminders", headers=headers, json={"timezone": "UTC"})
+        assert requests.get(f"{BASE_URL}/api/reminders", headers=headers).json()["next"] == {"water": None, "workout": None}
+    
+    def test_invalid_reminder_settings(self, auth_token):
+        """Test unknown time zones and bad times are rejected"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        assert requests.put(f"{BASE_URL}/api/reminders", headers=headers, json={"timezone": "Nowhere/City"}).status_code == 400
+        bad_time = requests.put(f"{BASE_URL}/api/reminders", headers=headers, json={"water": {"start": "25:00"}})
+        assert bad_time.status_code == 422
+
+
+class TestStreaks:
+    """Streak and leaderboard tests"""
+    
+    def test_workout_streak_and_leaderboard(self, auth_token):
+        """Test logging a workout today keeps a streak going and ranks the user on this week's board"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        today = datetime.utcnow().strftime("%Y-%m-%d")
+        response = requests.post(f"{BASE_URL}/api/workout-logs", headers=headers, json={
+            "plan_name": "Streak Plan", "day_name": "Day 1", "exercises": [], "date": today,
+        })
+        assert response.status_code == 200
+        
+        streaks = requests.get(f"{BASE_URL}/api/streaks", headers=headers).json()
+        assert streaks["workouts"]["current"] >= 1
+        assert streaks["workouts"]["last_day"] == today
+        assert streaks["workouts"]["longest"] >= streaks["workouts"]["current"]
+        
+        board = requests.get(f"{BASE_URL}/api/leaderboards/workouts?limit=5&around=1", headers=headers).json()
+        assert board["me"]["rank"] >= 1 and board["me"]["score"] >= 1
+        assert any(entry["me"] for entry in board["around"])
+        assert len(board["top"]) <= 5
+        assert all("user_id" not in entry for entry in board["top"])
+        
+        # Names are shown only after opting in
+        def mine(board):
+            return next(entry for entry in board["around"] if entry["me"])
+        
+        requests.put(f"{BASE_URL}/api/profile", headers=headers, json={"show_name_on_leaderboards": False})
+        board = requests.get(f"{BASE_URL}/api/leaderboards/workouts", headers=headers).json()
+        assert mine(board)["name"] is None
+        profile = requests.put(f"{BASE_URL}/api/profile", headers=headers, json={"show_name_on_leaderboards": True}).json()
+        assert profile["show_name_on_leaderboards"] is True
+        board = requests.get(f"{BASE_URL}/api/leaderboards/workouts", headers=headers).json()
+        assert mine(board)["name"] == profile["name"]
+    
+    def test_invalid_leaderboard_requests(self, auth_token):
+        """Test unknown boards and malformed weeks are rejected"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        assert requests.get(f"{BASE_URL}/api/leaderboards/steps", headers=headers).status_code == 400
+        assert requests.get(f"{BASE_URL}/api/leaderboards/water?week=2024-W60", headers=headers).status_code == 400
+        assert requests.get(f"{BASE_URL}/api/leaderboards/water?limit=0", headers=headers).status_code == 422
@@ -0,0 +1,73 @@
+"""
+Idempotency-Key tests (in-process, no server needed)
+Tests: replay, 409 while pending, takeover after the pending lease, body mismatch
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import idempotency
+from idempotency import Idempotency, MemoryIdempotencyStore, MongoIdempotencyStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def mongo_store(pending_seconds: float) -> MongoIdempotencyStore:
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return MongoIdempotencyStore(mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit.idempotency_keys,
+                                 pending_seconds=pending_seconds)
+
+
+class TestIdempotency:
+    """Pending lease + replay tests"""
+    
+    def test_crashed_request_is_taken_over(self, monkeypatch):
+        """Test a key left pending by a crashed worker answers 409 until its lease passes, then runs once more"""
+        clock = Clock()
+        monkeypatch.setattr(idempotency.time, "monotonic", clock)
+        runner = Idempotency(MemoryIdempotencyStore(pending_seconds=60))
+        runs = []
+
+        async def execute():
+            runs.append(1)
+            return {"id": len(runs)}
+
+        async def run():
+            # The first worker claimed the key and died before completing it
+            assert await runner.store.claim("u1:add_water:k", idempotency.fingerprint({"glasses": 1})) is None
+            with pytest.raises(HTTPException) as e:
+                await runner.run("k", "u1", "add_water", {"glasses": 1}, execute)
+            assert e.value.status_code == 409
+            clock.now += 61
+            with pytest.raises(HTTPException) as e:
+                await runner.run("k", "u1", "add_water", {"glasses": 2}, execute)
+            assert e.value.status_code == 422
+            assert await runner.run("k", "u1", "add_water", {"glasses": 1}, execute) == {"id": 1}
+            assert await runner.run("k", "u1", "add_water", {"glasses": 1}, execute) == {"id": 1}
+
+        asyncio.run(run())
+        assert runs == [1]
+        assert runner.replayed == 1
+    
+    def test_mongo_pending_lease(self):
+        """Test the Mongo store hands a pending key over only once its lease has passed"""
+        async def run():
+            held = mongo_store(pending_seconds=60)
+            assert await held.claim("k", "fp") is None
+            assert (await held.claim("k", "fp"))["status"] == "pending"
+
+            expired = mongo_store(pending_seconds=0)
+            assert await expired.claim("k", "fp") is None
+            assert (await expired.claim("k", "other"))["fingerprint"] == "fp"
+            assert await expired.claim("k", "fp") is None
+            await expired.complete("k", {"id": 1})
+            assert (await expired.claim("k", "fp"))["body"] == {"id": 1}
+
+        asyncio.run(run())
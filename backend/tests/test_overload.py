@@ -0,0 +1,90 @@
+"""
+Progressive-overload tests (in-process, Mongo mocked with mongomock-motor)
+Tests: logs fold forward, a concurrent fold of the same exercise is caught and rebuilt, rep range cache TTL
+"""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from overload import ProgressionEngine
+
+DAY = datetime(2024, 5, 6, tzinfo=timezone.utc)
+
+
+def bench_log(reps: int, weight: float = 60.0) -> dict:
+    return {"date": DAY, "exercises": [{"name": "Bench Press", "sets": [{"reps": reps, "weight": weight}]}]}
+
+
+async def save_log(db, engine: ProgressionEngine, log: dict) -> bool:
+    await db.workout_logs.insert_one({**log, "user_id": "u1", "created_at": datetime.now(timezone.utc)})
+    return await engine.record("u1", log)
+
+
+class TestProgression:
+    """State folding + concurrent log tests"""
+    
+    def test_logs_fold_forward(self):
+        """Test each saved log adds one session to the exercise's state"""
+        db = mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit
+        engine = ProgressionEngine(db)
+
+        async def run():
+            await engine.ensure_indexes()
+            assert await save_log(db, engine, bench_log(8)) is True
+            assert await save_log(db, engine, bench_log(12)) is True
+            return await db.exercise_progress.find_one({"user_id": "u1", "exercise": "bench press"})
+
+        state = asyncio.run(run())
+        assert (state["sessions"], state["suggestion"]["reason"]) == (2, "add_weight")
+        assert engine.conflicts == 0
+    
+    def test_concurrent_logs_both_counted(self, monkeypatch):
+        """Test two logs folded from the same read don't lose one: the second write misses and a rebuild replays both"""
+        db = mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit
+        engine = ProgressionEngine(db)
+        fold = engine._fold
+
+        async def run():
+            await engine.ensure_indexes()
+            await save_log(db, engine, bench_log(8))
+            read = asyncio.Event()
+            folds = []
+
+            async def interleaved_fold(*args):
+                # Both requests read the state before either writes
+                folds.append(1)
+                if len(folds) == 2:
+                    read.set()
+                await read.wait()
+                await fold(*args)
+
+            monkeypatch.setattr(engine, "_fold", interleaved_fold)
+            first, second = bench_log(10), bench_log(11)
+            for log in (first, second):
+                await db.workout_logs.insert_one({**log, "user_id": "u1", "created_at": datetime.now(timezone.utc)})
+            results = await asyncio.gather(engine.record("u1", first), engine.record("u1", second))
+            return results, await db.exercise_progress.find_one({"user_id": "u1", "exercise": "bench press"})
+
+        results, state = asyncio.run(run())
+        assert sorted(results) == [False, True]
+        assert engine.conflicts == 1
+        assert state["sessions"] == 3
+    
+    def test_rep_ranges_expire_without_invalidation(self):
+        """Test cached rep ranges are reloaded once older than the TTL even if no change event arrives"""
+        db = mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit
+        ttl = [3600.0]
+        engine = ProgressionEngine(db, rep_ranges_ttl=lambda: ttl[0])
+
+        async def run():
+            await db.workout_plans.insert_one({"id": "p", "days": [{"exercises": [{"name": "Bench Press", "reps": "8-10"}]}]})
+            assert await engine.rep_range("Bench Press") == (8, 10)
+            await db.workout_plans.update_one({"id": "p"}, {"$set": {"days.0.exercises.0.reps": "5"}})
+            assert await engine.rep_range("Bench Press") == (8, 10)
+            ttl[0] = 0.0
+            assert await engine.rep_range("Bench Press") == (5, 5)
+
+        asyncio.run(run())
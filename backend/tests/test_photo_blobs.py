@@ -0,0 +1,112 @@
+"""
+Content-addressed photo blob tests (in-process, Mongo mocked with mongomock-motor)
+Tests: dedupe against live blobs, collection after the last release, acquire racing a collect, failed uploads
+"""
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from photo_blobs import PhotoBlobs, content_key
+
+KEY = content_key("ab" * 32, "jpeg")
+
+
+class RecordingS3:
+    def __init__(self):
+        self.deleted = []
+
+    def delete_object(self, Bucket: str, Key: str):
+        self.deleted.append(Key)
+
+
+class Uploads:
+    def __init__(self, fail: bool = False):
+        self.calls = 0
+        self.fail = fail
+
+    async def __call__(self):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("S3 unavailable")
+
+
+def make_blobs() -> PhotoBlobs:
+    return PhotoBlobs(mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit.photo_blobs, RecordingS3(), "bucket")
+
+
+class TestPhotoBlobs:
+    """Reference counting + collection tests"""
+    
+    def test_upload_deduplicated_against_live_blob(self):
+        """Test a second acquire of the same content takes a reference without uploading"""
+        blobs, put = make_blobs(), Uploads()
+
+        async def run():
+            assert await blobs.acquire(KEY, put, size=10) is True
+            assert await blobs.acquire(KEY, put, size=10) is False
+            assert put.calls == 1
+            blob = await blobs.col.find_one({"_id": KEY})
+            assert blob["refs"] == 2 and "pending" not in blob
+
+        asyncio.run(run())
+        assert blobs.deduplicated == 1
+    
+    def test_last_release_collects(self):
+        """Test only the last release reports the blob, and collecting deletes object and document"""
+        blobs, put = make_blobs(), Uploads()
+
+        async def run():
+            await blobs.acquire(KEY, put)
+            await blobs.acquire(KEY, put)
+            assert await blobs.release_many([KEY]) == []
+            assert blobs.s3.deleted == []
+            assert await blobs.release(KEY) is True
+            await blobs.schedule_collect([KEY])
+            assert blobs.s3.deleted == [KEY]
+            assert await blobs.col.find_one({"_id": KEY}) is None
+            # A stray release or a retried collect does nothing
+            assert await blobs.release(KEY) is False
+            assert await blobs.collect(KEY) is False
+
+        asyncio.run(run())
+    
+    def test_acquire_waits_for_collect(self):
+        """Test an acquire that finds the blob locked by a collect waits and re-uploads once it is gone"""
+        blobs, put = make_blobs(), Uploads()
+
+        async def run():
+            await blobs.acquire(KEY, put)
+            await blobs.release(KEY)
+            # Lock it the way collect does, and hold it while the acquire retries
+            await blobs.col.update_one({"_id": KEY}, {"$set": {"refs": -1}})
+            acquiring = asyncio.create_task(blobs.acquire(KEY, put))
+            await asyncio.sleep(0.2)
+            assert not acquiring.done()
+            assert put.calls == 1
+            await blobs.col.delete_one({"_id": KEY, "refs": -1})
+            assert await acquiring is True
+            assert put.calls == 2
+            assert (await blobs.col.find_one({"_id": KEY}))["refs"] == 1
+            # The locked blob can't be re-acquired, and a live one can't be collected
+            assert await blobs.collect(KEY) is False
+
+        asyncio.run(run())
+    
+    def test_failed_put_releases_reference(self):
+        """Test a failed upload drops its reference and collects the blob it created"""
+        blobs = make_blobs()
+
+        async def run():
+            with pytest.raises(RuntimeError):
+                await blobs.acquire(KEY, Uploads(fail=True))
+            assert await blobs.col.find_one({"_id": KEY}) is None
+            assert blobs.s3.deleted == [KEY]
+            # Another photo's reference survives someone else's failed upload of a pending blob
+            await blobs.col.insert_one({"_id": KEY, "refs": 1, "pending": True})
+            with pytest.raises(RuntimeError):
+                await blobs.acquire(KEY, Uploads(fail=True))
+            assert (await blobs.col.find_one({"_id": KEY}))["refs"] == 1
+
+        asyncio.run(run())
@@ -0,0 +1,169 @@
+"""
+Direct-to-S3 photo upload tests (S3 mocked with moto)
+Tests: presigned POST conditions, HEAD verification on confirm, S3 checksums, concurrent confirms, sweeping
+"""
+import asyncio
+import hashlib
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+import requests
+
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+
+from dates import utc_now
+from photo_blobs import PhotoBlobs
+from photo_uploads import PhotoUploads, UploadError, presigned_post, s3_checksum, verify_object
+
+BUCKET = "fat2fit-test-photos"
+MAX_BYTES = 1024
+
+
+@pytest.fixture
+def s3():
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1", aws_access_key_id="test", aws_secret_access_key="test")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def upload(post: dict, body: bytes, content_type: str) -> requests.Response:
+    return requests.post(post["url"], data=post["fields"], files={"file": ("photo", body, content_type)})
+
+
+def put_checked(s3, key: str, body: bytes, content_type: str = "image/jpeg"):
+    """Store `body` the way a checksummed POST leaves it: S3 has verified its SHA-256."""
+    s3.put_object(Bucket=BUCKET, Key=key, Body=body, ContentType=content_type, ChecksumAlgorithm="SHA256")
+
+
+class TestPresignedUploads:
+    """Presigned POST + confirm tests"""
+    
+    def test_presigned_post_is_scoped_to_key_and_type(self, s3):
+        """Test the POST policy names the key, content type and the file's SHA-256"""
+        sha256 = hashlib.sha256(b"photo").hexdigest()
+        post = presigned_post(s3, BUCKET, "progress-photos/a.jpeg", "image/jpeg", MAX_BYTES, 60, sha256)
+        assert post["fields"]["key"] == "progress-photos/a.jpeg"
+        assert post["fields"]["Content-Type"] == "image/jpeg"
+        assert post["fields"]["x-amz-checksum-algorithm"] == "SHA256"
+        assert post["fields"]["x-amz-checksum-sha256"] == s3_checksum(sha256)
+        assert "policy" in post["fields"]
+    
+    def test_uploaded_object_verifies(self, s3):
+        """Test an object uploaded with the presigned POST passes the HEAD check"""
+        post = presigned_post(s3, BUCKET, "progress-photos/b.jpeg", "image/jpeg", MAX_BYTES, 60)
+        assert upload(post, b"\xff\xd8" + b"x" * 100, "image/jpeg").status_code in (200, 204)
+        assert verify_object(s3, BUCKET, "progress-photos/b.jpeg", "image/jpeg", MAX_BYTES) == (102, None)
+    
+    def test_checksum_comes_from_s3(self, s3):
+        """Test the HEAD check returns the checksum S3 verified and rejects one that isn't the upload's"""
+        body = b"\xff\xd8" + b"y" * 100
+        put_checked(s3, "progress-photos/e.jpeg", body)
+        sha256 = hashlib.sha256(body).hexdigest()
+        assert verify_object(s3, BUCKET, "progress-photos/e.jpeg", "image/jpeg", MAX_BYTES, sha256) == (102, sha256)
+        with pytest.raises(UploadError) as e:
+            verify_object(s3, BUCKET, "progress-photos/e.jpeg", "image/jpeg", MAX_BYTES, hashlib.sha256(b"z").hexdigest())
+        assert e.value.status == 400
+    
+    def test_missing_object_is_not_confirmed(self, s3):
+        """Test confirming before the upload reports 409"""
+        with pytest.raises(UploadError) as e:
+            verify_object(s3, BUCKET, "progress-photos/missing.jpeg", "image/jpeg", MAX_BYTES)
+        assert e.value.status == 409
+    
+    def test_oversized_or_mistyped_object_is_rejected(self, s3):
+        """Test the HEAD check enforces size and type even if the policy was bypassed"""
+        s3.put_object(Bucket=BUCKET, Key="progress-photos/big.jpeg", Body=b"x" * (MAX_BYTES + 1), ContentType="image/jpeg")
+        with pytest.raises(UploadError) as e:
+            verify_object(s3, BUCKET, "progress-photos/big.jpeg", "image/jpeg", MAX_BYTES)
+        assert e.value.status == 400
+        
+        s3.put_object(Bucket=BUCKET, Key="progress-photos/c.jpeg", Body=b"x" * 10, ContentType="text/html")
+        with pytest.raises(UploadError) as e:
+            verify_object(s3, BUCKET, "progress-photos/c.jpeg", "image/jpeg", MAX_BYTES)
+        assert e.value.status == 400
+    
+    def test_confirm_never_downloads_the_photo(self, s3, monkeypatch):
+        """Test confirm moves the upload to the content key of its S3 checksum without reading the body"""
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        db = mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit
+        uploads = PhotoUploads(db, s3, BUCKET, "https://photos/", max_bytes=MAX_BYTES,
+                               blobs=PhotoBlobs(db.photo_blobs, s3, BUCKET))
+        body = b"\xff\xd8" + b"f" * 10
+        sha256 = hashlib.sha256(body).hexdigest()
+
+        def no_get_object(**kwargs):
+            raise AssertionError("confirm downloaded the photo")
+
+        monkeypatch.setattr(s3, "get_object", no_get_object)
+
+        async def run():
+            created = await uploads.create("u1", "image/jpeg", "2026-02-01", sha256=sha256)
+            put_checked(s3, created["fields"]["key"], body)
+            return created, await uploads.confirm("u1", created["upload_id"])
+
+        created, photo = asyncio.run(run())
+        key = f"progress-photos/sha256/{sha256}.jpeg"
+        assert photo["photo_url"] == "https://photos/" + key
+        assert s3.head_object(Bucket=BUCKET, Key=key)["ContentLength"] == len(body)
+        assert not s3.list_objects_v2(Bucket=BUCKET, Prefix=created["fields"]["key"]).get("KeyCount")
+    
+    def test_concurrent_confirms_return_one_photo(self, s3, monkeypatch):
+        """Test a confirm that loses the race to copy the upload returns the winner's photo"""
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        db = mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit
+        uploads = PhotoUploads(db, s3, BUCKET, "https://photos/", max_bytes=MAX_BYTES,
+                               blobs=PhotoBlobs(db.photo_blobs, s3, BUCKET))
+        body = b"x" * 10
+        put_checked(s3, "progress-photos/d.jpeg", body)
+
+        # The second copy starts only after the first confirm has deleted the uploaded object
+        copy_object, copying = uploads._copy_object, threading.Lock()
+
+        def slow_second_copy(source, key):
+            if not copying.acquire(blocking=False):
+                for _ in range(100):
+                    if not s3.list_objects_v2(Bucket=BUCKET, Prefix=source).get("KeyCount"):
+                        break
+                    time.sleep(0.05)
+            return copy_object(source, key)
+
+        monkeypatch.setattr(uploads, "_copy_object", slow_second_copy)
+
+        async def run():
+            await db.photo_uploads.insert_one({
+                "id": "d", "user_id": "u1", "key": "progress-photos/d.jpeg", "content_type": "image/jpeg",
+                "sha256": hashlib.sha256(body).hexdigest(),
+                "date": utc_now(), "note": "", "expires_at": utc_now() + timedelta(minutes=5),
+            })
+            return await asyncio.gather(uploads.confirm("u1", "d"), uploads.confirm("u1", "d"))
+
+        first, second = asyncio.run(run())
+        assert first == second
+        assert first["photo_url"].startswith("https://photos/progress-photos/sha256/")
+    
+    def test_sweep_deletes_staging_objects_no_photo_points_at(self, s3):
+        """Test the sweep keeps only staging objects a confirmed photo still uses"""
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        db = mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit
+        uploads = PhotoUploads(db, s3, BUCKET, "https://photos/", max_bytes=MAX_BYTES)
+        expired = utc_now() - timedelta(days=1)
+
+        async def run():
+            for upload_id in ("never", "moved", "kept"):
+                key = f"progress-photos/{upload_id}.jpeg"
+                put_checked(s3, key, b"x")
+                await db.photo_uploads.insert_one({"id": upload_id, "user_id": "u1", "key": key, "expires_at": expired})
+            # Confirmed, interrupted before the staging object was deleted
+            await db.progress_photos.insert_many([
+                {"id": "moved", "user_id": "u1", "photo_url": "https://photos/progress-photos/sha256/ab.jpeg"},
+                {"id": "kept", "user_id": "u1", "photo_url": "https://photos/progress-photos/kept.jpeg"},
+            ])
+            return await uploads.sweep()
+
+        assert asyncio.run(run()) == 3
+        remaining = [o["Key"] for o in s3.list_objects_v2(Bucket=BUCKET).get("Contents", [])]
+        assert remaining == ["progress-photos/kept.jpeg"]
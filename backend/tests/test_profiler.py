@@ -0,0 +1,61 @@
+"""
+Sampling profiler tests (in-process, no server needed)
+Tests: collapsed / speedscope output, overhead cap, per-task sampling
+"""
+import asyncio
+import time
+from collections import Counter
+
+from profiler import AWAIT_FRAME, Profile, Profiler, Sampler
+
+
+class TestProfiler:
+    """Profiler output + sampling tests"""
+    
+    def test_collapsed_and_speedscope(self):
+        """Test both formats carry the same stacks and weights"""
+        stacks = Counter({("main", "handler", "bcrypt"): 3, ("main", "handler"): 1})
+        profile = Profile(stacks, interval=0.01, duration=0.04, samples=4, overhead=0.001, name="test")
+        assert profile.collapsed() == "main;handler;bcrypt 3\nmain;handler 1\n"
+        speedscope = profile.speedscope()
+        frames = [f["name"] for f in speedscope["shared"]["frames"]]
+        assert frames == ["main", "handler", "bcrypt"]
+        sampled = speedscope["profiles"][0]
+        assert sampled["samples"] == [[0, 1, 2], [0, 1]]
+        assert abs(sum(sampled["weights"]) - 0.04) < 1e-9
+    
+    def test_overhead_is_capped(self):
+        """Test an expensive sample stretches the interval instead of exceeding the cap"""
+
+        def take():
+            end = time.perf_counter() + 0.002
+            while time.perf_counter() < end:
+                pass
+            return [("busy",)]
+
+        sampler = Sampler(take, interval=0.0001, max_overhead=0.05, max_seconds=5)
+        sampler.start()
+        time.sleep(0.4)
+        profile = sampler.stop().profile("cap")
+        assert profile.samples > 0
+        assert profile.overhead < 0.08
+    
+    def test_task_profile_shows_awaits(self):
+        """Test a suspended request task is sampled through its chain of awaits"""
+        profiler = Profiler(request_interval=0.001, max_overhead=0.5)
+
+        async def handler():
+            await asyncio.sleep(0.1)
+
+        async def run():
+            task = asyncio.current_task()
+            sampler = profiler.start_task(task)
+            await handler()
+            return profiler.finish(sampler, "request")
+
+        profile = asyncio.run(run())
+        assert profile.samples > 0
+        top = profile.stacks.most_common(1)[0][0]
+        assert top[-1] == AWAIT_FRAME
+        assert any("handler" in frame for frame in top)
+        assert not profiler.stats()["running"]
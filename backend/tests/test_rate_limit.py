@@ -0,0 +1,119 @@
+"""
+Rate limiter tests (in-process, no server needed)
+Tests: token-bucket burst and refill, 429 + Retry-After before the body is read, per-IP vs per-user keys
+"""
+import asyncio
+
+import rate_limit
+from rate_limit import Limit, MemoryBucketStore, RateLimitMiddleware, Rule, per_minute
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def call(app, method: str, path: str, ip: str = "10.0.0.1", token: str = None) -> dict:
+    sent = {"body_read": False}
+
+    async def receive():
+        sent["body_read"] = True
+        return {"type": "http.request", "body": b"{}", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            sent["status"] = message["status"]
+            sent["headers"] = dict(message["headers"])
+
+    headers = [(b"authorization", f"Bearer {token}".encode())] if token else []
+    await app({"type": "http", "method": method, "path": path, "headers": headers, "client": (ip, 1234)},
+              receive, send)
+    return sent
+
+
+async def reads_body(scope, receive, send):
+    await receive()
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+class TestRateLimit:
+    """Token bucket + middleware tests"""
+    
+    def test_bucket_burst_then_refill(self, monkeypatch):
+        """Test a full bucket allows `burst` requests, then refills at `rate` per second"""
+        clock = Clock()
+        monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+        store, limit = MemoryBucketStore(), Limit(rate=2.0, burst=3)
+
+        async def run():
+            assert [await store.take("k", limit) for _ in range(3)] == [0.0, 0.0, 0.0]
+            assert await store.take("k", limit) == 0.5  # one token at 2/s
+            clock.now += 0.5
+            assert await store.take("k", limit) == 0.0
+            assert await store.take("k", limit) > 0
+            # Refill never exceeds the burst
+            clock.now += 60
+            assert [await store.take("k", limit) for _ in range(4)].count(0.0) == 3
+
+        asyncio.run(run())
+    
+    def test_rejection_before_body_is_read(self):
+        """Test a rejected request gets 429 with Retry-After and its body is never read"""
+        middleware = RateLimitMiddleware(reads_body, [Rule("login", ("POST",), "/api/auth/login", per_ip=per_minute(2))])
+
+        async def run():
+            assert (await call(middleware, "POST", "/api/auth/login"))["status"] == 200
+            assert (await call(middleware, "POST", "/api/auth/login"))["status"] == 200
+            rejected = await call(middleware, "POST", "/api/auth/login")
+            assert rejected["status"] == 429
+            assert int(rejected["headers"][b"retry-after"]) >= 1
+            assert not rejected["body_read"]
+            # Other routes and other clients are unaffected
+            assert (await call(middleware, "GET", "/api/dashboard"))["status"] == 200
+            assert (await call(middleware, "POST", "/api/auth/login", ip="10.0.0.2"))["status"] == 200
+
+        asyncio.run(run())
+        assert middleware.rejected == 1
+    
+    def test_per_user_and_per_ip_keys(self):
+        """Test per-user budgets follow the token across IPs while per-IP budgets follow the address"""
+        rules = [Rule("photos", ("POST",), "/api/progress-photos", per_ip=per_minute(3), per_user=per_minute(2))]
+        middleware = RateLimitMiddleware(reads_body, rules, identify_user=lambda token: {"t1": "u1", "t2": "u2"}.get(token))
+
+        async def run():
+            assert (await call(middleware, "POST", "/api/progress-photos", ip="1.1.1.1", token="t1"))["status"] == 200
+            assert (await call(middleware, "POST", "/api/progress-photos", ip="2.2.2.2", token="t1"))["status"] == 200
+            # u1 is out of budget from any address
+            assert (await call(middleware, "POST", "/api/progress-photos", ip="3.3.3.3", token="t1"))["status"] == 429
+            # u2 shares 1.1.1.1 with u1 and still has its own budget, until the IP budget runs out
+            assert (await call(middleware, "POST", "/api/progress-photos", ip="1.1.1.1", token="t2"))["status"] == 200
+            assert (await call(middleware, "POST", "/api/progress-photos", ip="1.1.1.1", token="t2"))["status"] == 200
+            assert (await call(middleware, "POST", "/api/progress-photos", ip="1.1.1.1"))["status"] == 429
+
+        asyncio.run(run())
+    
+    def test_concurrency_cap(self):
+        """Test max_concurrent rejects requests beyond the cap while others are in flight"""
+        release = asyncio.Event()
+
+        async def slow(scope, receive, send):
+            await release.wait()
+            await reads_body(scope, receive, send)
+
+        middleware = RateLimitMiddleware(slow, [Rule("export", ("GET",), "/api/export", max_concurrent=1)],
+                                         identify_user=lambda token: "u1")
+
+        async def run():
+            first = asyncio.create_task(call(middleware, "GET", "/api/export", token="t"))
+            await asyncio.sleep(0)
+            second = await call(middleware, "GET", "/api/export", token="t")
+            release.set()
+            assert (await first)["status"] == 200
+            assert second["status"] == 429
+            assert (await call(middleware, "GET", "/api/export", token="t"))["status"] == 200
+
+        asyncio.run(run())
@@ -0,0 +1,73 @@
+"""
+Reminder scheduler tests (in-process, no server needed)
+Tests: next due times across time zones, timer wheel store, skip rules
+"""
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from reminders import (MAX_LATENESS, WATER, WORKOUT, MemoryReminderStore, decide, make_entry, next_due,
+                       spread_days)
+
+SETTINGS = {
+    "user_id": "u1", "timezone": "America/New_York",
+    WATER: {"enabled": True, "start": "09:00", "end": "21:00", "every_minutes": 120},
+    WORKOUT: {"enabled": True, "time": "18:00", "days": [0, 2, 4]},
+}
+MONDAY = datetime(2024, 5, 6, 12, 0, tzinfo=timezone.utc)  # 08:00 in New York
+
+
+class TestReminders:
+    """Schedule + batch decision tests"""
+    
+    def test_next_due_in_local_time(self):
+        """Test reminders fire at the user's local times and skip off days"""
+        assert next_due(SETTINGS, WATER, MONDAY) == datetime(2024, 5, 6, 13, 0, tzinfo=timezone.utc)
+        assert next_due(SETTINGS, WATER, datetime(2024, 5, 6, 13, 0, tzinfo=timezone.utc)) == \
+            datetime(2024, 5, 6, 15, 0, tzinfo=timezone.utc)
+        # After the last water reminder (21:00 local) comes tomorrow's first
+        assert next_due(SETTINGS, WATER, datetime(2024, 5, 7, 1, 0, tzinfo=timezone.utc)) == \
+            datetime(2024, 5, 7, 13, 0, tzinfo=timezone.utc)
+        # Monday 18:00 local, then Wednesday
+        assert next_due(SETTINGS, WORKOUT, MONDAY) == datetime(2024, 5, 6, 22, 0, tzinfo=timezone.utc)
+        assert next_due(SETTINGS, WORKOUT, datetime(2024, 5, 6, 22, 0, tzinfo=timezone.utc)) == \
+            datetime(2024, 5, 8, 22, 0, tzinfo=timezone.utc)
+        assert next_due({**SETTINGS, WATER: {**SETTINGS[WATER], "enabled": False}}, WATER, MONDAY) is None
+        assert spread_days(3) == [0, 2, 4]
+        assert spread_days(7) == list(range(7))
+    
+    def test_timer_wheel_store(self):
+        """Test the memory store hands out due entries in order and honours moves and removals"""
+        store = MemoryReminderStore()
+
+        async def run():
+            await store.put([make_entry("a", WATER, MONDAY + timedelta(minutes=5)),
+                             make_entry("b", WATER, MONDAY + timedelta(minutes=1)),
+                             make_entry("c", WATER, MONDAY + timedelta(hours=2))])
+            assert await store.due(MONDAY, 10) == []
+            due = await store.due(MONDAY + timedelta(minutes=10), 10)
+            assert [e["user_id"] for e in due] == ["b", "a"]
+            assert len(await store.due(MONDAY + timedelta(minutes=10), 1)) == 1
+            await store.put([make_entry("b", WATER, MONDAY + timedelta(hours=3))])
+            await store.put([make_entry("a", WATER, MONDAY + timedelta(hours=4))], only_missing=True)
+            await store.remove(["c:water"])
+            due = await store.due(MONDAY + timedelta(hours=2, minutes=30), 10)
+            assert [e["user_id"] for e in due] == ["a"]
+            assert await store.count() == 2
+
+        asyncio.run(run())
+    
+    def test_decide_skips_goal_met_trained_and_late(self):
+        """Test a batch sends only the reminders that are still useful and reschedules all of them"""
+        due = datetime(2024, 5, 6, 22, 0, tzinfo=timezone.utc)  # Monday 18:00 in New York
+        users = ["sent", "goal", "trained", "late", "gone"]
+        settings = {u: {**SETTINGS, "user_id": u} for u in users if u != "gone"}
+        entries = [make_entry(u, WATER if u != "trained" else WORKOUT, due) for u in users]
+        entries[3] = make_entry("late", WATER, due - MAX_LATENESS - timedelta(minutes=1))
+        water = {("goal", "2024-05-06"): {"glasses": 8, "goal": 8}, ("sent", "2024-05-06"): {"glasses": 3, "goal": 8}}
+        counts = defaultdict(int)
+        send, reschedule, drop = decide(entries, settings, water, {("trained", "2024-05-06")}, due, counts)
+        assert [(r["user_id"], r["glasses"]) for r in send] == [("sent", 3)]
+        assert drop == ["gone:water"]
+        assert len(reschedule) == 4 and all(e["due_at"] > due for e in reschedule)
+        assert dict(counts) == {"goal_met": 1, "worked_out": 1, "late": 1}
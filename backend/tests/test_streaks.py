@@ -0,0 +1,106 @@
+"""
+Streak and leaderboard tests (in-process, no server needed)
+Tests: streak folding, ranked skip list, memory leaderboard ranks and corrections, workout-day scoring
+"""
+import asyncio
+import bisect
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from streaks import (WORKOUTS, MemoryLeaderboardStore, RankedSet, Streaks, board_id, extend, from_days, present,
+                     week_of, week_start)
+
+MONDAY = datetime(2024, 5, 6, tzinfo=timezone.utc)
+
+
+def day(offset: int) -> datetime:
+    return MONDAY + timedelta(days=offset)
+
+
+class TestStreaks:
+    """Streak + leaderboard structure tests"""
+    
+    def test_streak_folding(self):
+        """Test consecutive days extend a streak, gaps restart it and back-dated days need a rebuild"""
+        streak = from_days([day(0), day(1), day(2), day(5), day(6)])
+        assert (streak["current"], streak["longest"], streak["last_day"]) == (2, 3, day(6))
+        assert extend(streak, day(6)) is streak
+        assert extend(streak, day(7))["current"] == 3
+        assert extend(streak, day(3)) is None
+        # Alive through the day after the last active day, broken after that
+        assert present(streak, day(7))["current"] == 2
+        assert present(streak, day(8)) == {"current": 0, "longest": 3, "last_day": "2024-05-12"}
+        assert week_of(MONDAY) == "2024-W19"
+        assert week_start("2024-W19") == MONDAY.date()
+    
+    def test_ranked_set_matches_sorted_list(self):
+        """Test positions, slices and counts against a plain sorted list under random updates"""
+        rng = random.Random(5)
+        ranked, keys = RankedSet(seed=1), {}
+        for step in range(3000):
+            member = f"u{rng.randrange(200)}"
+            if rng.random() < 0.3:
+                assert ranked.discard(member) == (member in keys)
+                keys.pop(member, None)
+            else:
+                keys[member] = (-rng.randrange(8), rng.random())
+                ranked.add(member, keys[member])
+            if step % 100 == 0:
+                order = sorted((*key, member) for member, key in keys.items())
+                assert len(ranked) == len(order)
+                assert [(*key, member) for member, key in ranked.slice(0, len(order))] == order
+                start = rng.randrange(len(order) + 1)
+                assert [m for m, _ in ranked.slice(start, start + 5)] == [f[-1] for f in order[start:start + 5]]
+                assert all(ranked.index(f[-1]) == i for i, f in enumerate(order[:20]))
+                score = -rng.randrange(8)
+                assert ranked.count_before((score,)) == bisect.bisect_left(order, (score,))
+    
+    def test_memory_leaderboard(self):
+        """Test shared ranks for ties, around-me windows and reconciliation"""
+        store = MemoryLeaderboardStore()
+        expire_at = MONDAY + timedelta(weeks=9)
+
+        async def run():
+            for i, score in enumerate([5, 3, 3, 1]):
+                for _ in range(score):
+                    await store.change("b", f"u{i}", 1, MONDAY + timedelta(minutes=i), expire_at)
+            top = await store.top("b", 3)
+            assert [(e["user_id"], e["rank"], e["score"]) for e in top] == [("u0", 1, 5), ("u1", 2, 3), ("u2", 2, 3)]
+            assert [e["user_id"] for e in await store.around("b", "u3", 1)] == ["u2", "u3"]
+            assert await store.change("b", "u3", -1, MONDAY, expire_at) == 0
+            assert await store.around("b", "u3", 1) == []
+            assert await store.correct("b", {"u0": 5, "u1": 4, "u2": 3, "u4": 2}, MONDAY, expire_at) == 2
+            assert [(e["user_id"], e["rank"]) for e in await store.top("b", 10)] == \
+                [("u0", 1), ("u1", 2), ("u2", 3), ("u4", 4)]
+            # Boards past their expiry go at the next correction
+            await store.correct("c", {}, expire_at, expire_at + timedelta(weeks=9))
+            assert await store.size("b") == 0
+
+        asyncio.run(run())
+    
+    def test_workouts_score_distinct_days(self):
+        """Test extra logs on one day don't score, live or when reconciled, and names need an opt-in"""
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        db = mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit
+        streaks = Streaks(db, MemoryLeaderboardStore(), tracking=None)
+        board = board_id(WORKOUTS, week_of(MONDAY))
+
+        async def log(user_id: str, offset: int):
+            await db.workout_logs.insert_one({"user_id": user_id, "date": day(offset)})
+            await streaks.record_workout(user_id, day(offset), now=MONDAY)
+
+        async def run():
+            await db.users.insert_many([{"id": "u1", "name": "Spammer"},
+                                        {"id": "u2", "name": "Regular", "show_name_on_leaderboards": True}])
+            for _ in range(5):
+                await log("u1", 0)
+            await log("u2", 0)
+            await log("u2", 1)
+            assert [(e["user_id"], e["score"]) for e in await streaks.store.top(board, 5)] == [("u2", 2), ("u1", 1)]
+            assert await streaks._workouts_per_user(MONDAY.date(), day(6).date()) == {"u1": 1, "u2": 2}
+            entries = (await streaks.leaderboard(WORKOUTS, week_of(MONDAY), "u1", 5, 1))["top"]
+            assert [(e["name"], e["me"]) for e in entries] == [("Regular", False), (None, True)]
+
+        asyncio.run(run())
@@ -0,0 +1,231 @@
+"""
+Background task queue tests (in-process, no server needed)
+Tests: retry with backoff, dead-lettering, dedupe (also of retries), lease renewal and takeover
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from tasks import DEAD, DONE, QUEUED, RUNNING, MemoryJobStore, MongoJobStore, TaskQueue
+
+
+def mongo_store() -> MongoJobStore:
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return MongoJobStore(mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit.jobs)
+
+
+async def run_until(queue: TaskQueue, done, timeout: float = 5.0):
+    queue.start()
+    try:
+        for _ in range(int(timeout / 0.01)):
+            reached = done()
+            if asyncio.iscoroutine(reached):
+                reached = await reached
+            if reached:
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError("queue did not get there in time")
+    finally:
+        await queue.stop()
+
+
+class TestTaskQueue:
+    """Queue + job store tests"""
+    
+    def test_retry_with_backoff(self):
+        """Test a failing job is retried after a growing, jittered delay until it succeeds"""
+        store = MemoryJobStore()
+        queue = TaskQueue(store, base_delay=0.02, max_delay=0.05, poll_interval=0.01)
+        runs = []
+
+        @queue.handler("flaky")
+        async def flaky(payload):
+            runs.append(payload["n"])
+            if len(runs) < 3:
+                raise RuntimeError("not yet")
+
+        async def run():
+            job = await queue.enqueue("flaky", {"n": 1})
+            await run_until(queue, lambda: job["status"] == DONE)
+            return job
+
+        job = asyncio.run(run())
+        assert runs == [1, 1, 1]
+        assert job["attempts"] == 3
+        # Delays double per attempt up to max_delay, scaled by 0.5-1.0 jitter
+        assert all(0.01 <= queue.backoff(1) <= 0.02 for _ in range(20))
+        assert all(0.025 <= queue.backoff(6) <= 0.05 for _ in range(20))
+    
+    def test_dead_letter_after_max_attempts(self):
+        """Test a job that keeps failing is parked as dead with its last error"""
+        store = MemoryJobStore()
+        queue = TaskQueue(store, max_attempts=2, base_delay=0.01, poll_interval=0.01)
+
+        @queue.handler("broken")
+        async def broken(payload):
+            raise ValueError("bad payload")
+
+        async def run():
+            job = await queue.enqueue("broken")
+            await run_until(queue, lambda: job["status"] == DEAD)
+            return job, await store.stats()
+
+        job, stats = asyncio.run(run())
+        assert (job["attempts"], job["error"]) == (2, "bad payload")
+        assert stats["depth"] == {QUEUED: 0, RUNNING: 0, DEAD: 1}
+    
+    def test_dedupe_while_queued(self):
+        """Test enqueueing with a queued job's dedupe key returns that job, and a claimed one frees the key"""
+        store = MemoryJobStore()
+        queue = TaskQueue(store)
+        queue.handler("sweep")(lambda payload: asyncio.sleep(0))
+
+        async def run():
+            first = await queue.enqueue("sweep", dedupe_key="sweep")
+            assert (await queue.enqueue("sweep", dedupe_key="sweep"))["id"] == first["id"]
+            claimed = await store.claim(queue.lease)
+            assert claimed["id"] == first["id"]
+            second = await queue.enqueue("sweep", dedupe_key="sweep")
+            assert second["id"] != first["id"]
+            assert (await store.stats())["depth"][QUEUED] == 1
+
+        asyncio.run(run())
+    
+    def test_lease_takeover_discards_stale_result(self):
+        """Test an expired lease lets another worker take the job and the first worker's finish is ignored"""
+        store = MemoryJobStore()
+        queue = TaskQueue(store)
+        queue.handler("account.delete")(lambda payload: asyncio.sleep(0))
+
+        async def run():
+            job = await queue.enqueue("account.delete", {"user_id": "u1"})
+            stale = await store.claim(timedelta(minutes=5))
+            assert await store.claim(timedelta(minutes=5)) is None
+            # Lease of zero: the running job counts as abandoned
+            current = await store.claim(timedelta(0))
+            assert (current["id"], current["attempts"]) == (stale["id"], 2)
+            assert await store.renew(stale) is False
+            assert await store.finish(stale, DEAD, error="stale") is False
+            assert job["status"] == RUNNING
+            assert await store.renew(current) is True
+            assert await store.finish(current, DONE) is True
+            assert (job["status"], job["error"]) == (DONE, None)
+
+        asyncio.run(run())
+    
+    def test_mongo_writes_are_conditional_on_the_attempt(self):
+        """Test the Mongo store only renews and finishes the attempt that owns the job, and dedupes queued jobs"""
+        store = mongo_store()
+
+        async def run():
+            await store.ensure_indexes()
+            first = await store.add({"id": "j1", "status": QUEUED, "attempts": 0, "dedupe_key": "sweep"})
+            assert (await store.add({"id": "j2", "status": QUEUED, "attempts": 0, "dedupe_key": "sweep"}))["id"] == "j1"
+            # Taken over: attempt 2 owns the job now
+            await store._col.update_one({"id": "j1"}, {"$set": {"status": RUNNING, "attempts": 2}})
+            assert await store.renew({**first, "attempts": 1}) is False
+            assert await store.finish({**first, "attempts": 1}, QUEUED, error="stale") is False
+            assert (await store._col.find_one({"id": "j1"}))["status"] == RUNNING
+            assert await store.renew({**first, "attempts": 2}) is True
+            assert await store.finish({**first, "attempts": 2}, DONE) is True
+            assert (await store._col.find_one({"id": "j1"}))["status"] == DONE
+
+        asyncio.run(run())
+    
+    def test_heartbeat_keeps_long_job(self):
+        """Test a job running longer than its lease is renewed and never claimed twice"""
+        store = MemoryJobStore()
+        queue = TaskQueue(store, poll_interval=0.01, lease=timedelta(seconds=0.3))
+        runs = []
+
+        @queue.handler("reconcile")
+        async def reconcile(payload):
+            runs.append(1)
+            await asyncio.sleep(1.0)
+
+        async def run():
+            job = await queue.enqueue("reconcile")
+            await run_until(queue, lambda: job["status"] == DONE)
+            return job
+
+        job = asyncio.run(run())
+        assert runs == [1]
+        assert job["attempts"] == 1
+    
+    def test_lost_lease_cancels_handler(self):
+        """Test a worker that can no longer renew its lease stops the handler and leaves the job to its new owner"""
+        store = MemoryJobStore()
+        queue = TaskQueue(store, poll_interval=0.01, lease=timedelta(seconds=0.15))
+        cancelled = []
+
+        @queue.handler("reconcile")
+        async def reconcile(payload):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        async def run():
+            job = await queue.enqueue("reconcile")
+            await asyncio.sleep(0)
+            queue.start()
+            await asyncio.sleep(0.02)
+            # Another worker takes the job over
+            taken = await store.claim(timedelta(0))
+            # The next renewal (every lease / 3) fails; stop before the new lease lapses too
+            await asyncio.sleep(0.1)
+            await queue.stop()
+            return job, taken
+
+        job, taken = asyncio.run(run())
+        assert cancelled == [1]
+        assert (job["status"], job["attempts"]) == (RUNNING, taken["attempts"])
+    
+    def test_retry_superseded_by_queued_duplicate(self):
+        """Test a failed attempt whose dedupe key was queued again meanwhile is finished instead of queued twice"""
+        store = mongo_store()
+
+        async def run():
+            await store.ensure_indexes()
+            running = {"id": "j1", "name": "streaks.rebuild", "status": RUNNING, "attempts": 1,
+                       "dedupe_key": "streaks.rebuild:u1"}
+            await store._col.insert_one(dict(running))
+            await store.add({"id": "j2", "name": "streaks.rebuild", "status": QUEUED, "attempts": 0,
+                             "dedupe_key": "streaks.rebuild:u1"})
+            assert await store.finish(running, QUEUED, error="boom", run_at=datetime.now(timezone.utc)) is True
+            return {j["id"]: j["status"] async for j in store._col.find({}, {"_id": 0})}
+
+        assert asyncio.run(run()) == {"j1": DONE, "j2": QUEUED}
+
+        # Same through the queue with the memory store
+        queue = TaskQueue(MemoryJobStore(), base_delay=0.01, poll_interval=0.01)
+        started, runs = asyncio.Event(), []
+
+        @queue.handler("streaks.rebuild")
+        async def rebuild(payload):
+            runs.append(payload["n"])
+            if len(runs) == 1:
+                started.set()
+                await asyncio.sleep(0.05)
+                raise RuntimeError("boom")
+
+        async def run_memory():
+            first = await queue.enqueue("streaks.rebuild", {"n": 1}, dedupe_key="streaks.rebuild:u1")
+            queue.start()
+            await started.wait()
+            # Still queued when the first attempt fails
+            second = await queue.enqueue("streaks.rebuild", {"n": 2}, delay=0.3, dedupe_key="streaks.rebuild:u1")
+            assert second["id"] != first["id"]
+            for _ in range(100):
+                if second["status"] == DONE:
+                    break
+                await asyncio.sleep(0.01)
+            await queue.stop()
+            return first
+
+        first = asyncio.run(run_memory())
+        assert runs == [1, 2]
+        assert first["error"] == "boom"
+        assert asyncio.run(queue.store.stats())["depth"] == {QUEUED: 0, RUNNING: 0, DEAD: 0}
@@ -0,0 +1,135 @@
+"""
+Tracking layout tests (in-process, Mongo mocked with mongomock-motor)
+Tests: both stores answer the same reads for the same writes, the bucket migration
+"""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+import mongomock.aggregate
+
+from migrate_tracking import bucket_tracking
+from tracking import BucketedTrackingStore, DocumentTrackingStore
+
+
+def _union_with(in_collection, database, options):
+    other = database.get_collection(options["coll"])
+    return list(in_collection) + list(mongomock.aggregate.process_pipeline(
+        list(other.find()), database, options.get("pipeline", []), None))
+
+
+def _path(doc: dict, path: str):
+    for part in path.split("."):
+        doc = (doc or {}).get(part)
+    return doc
+
+
+def _merge(in_collection, database, options):
+    """$merge on `_id` whose whenMatched pipeline $sets fields to $mergeObjects of field paths
+    (the only form migrate_tracking uses)."""
+    target = database.get_collection(options["into"])
+    for new in in_collection:
+        existing = target.find_one({"_id": new["_id"]})
+        if existing is None:
+            target.insert_one(new)
+            continue
+        for stage in options["whenMatched"]:
+            for field, expr in stage["$set"].items():
+                parts = [_path(new, p[len("$$new."):]) if p.startswith("$$new.") else _path(existing, p[1:])
+                         for p in expr["$mergeObjects"]]
+                existing[field] = {k: v for part in parts for k, v in (part or {}).items()}
+        target.replace_one({"_id": new["_id"]}, existing)
+    return []
+
+
+@pytest.fixture(autouse=True)
+def mongomock_stages(monkeypatch):
+    # mongomock implements neither $unionWith nor $merge
+    monkeypatch.setitem(mongomock.aggregate._PIPELINE_HANDLERS, "$unionWith", _union_with)
+    monkeypatch.setitem(mongomock.aggregate._PIPELINE_HANDLERS, "$merge", _merge)
+
+
+def new_db():
+    return mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit
+
+
+async def log_history(store):
+    await store.ensure_indexes()
+    await store.save_weight("u1", "2024-05-03", 81.0)
+    await store.save_weight("u1", "2024-05-03", 80.5)  # overwrites the day
+    await store.save_weight("u1", "2024-06-01", 79.0)
+    for _ in range(8):
+        await store.add_water("u1", "2024-05-03")
+    await store.add_water("u1", "2024-05-04")
+    await store.add_water("u1", "2024-05-04")
+    assert (await store.remove_water("u1", "2024-05-04"))["glasses"] == 1
+    assert await store.remove_water("u1", "2024-05-05") is None
+    for _ in range(9):
+        await store.add_water("u2", "2024-05-31")
+    await store.add_water("u2", "2024-06-01")
+
+
+async def reads(store) -> dict:
+    return {
+        "weights": [(w["date"], w["weight"]) for w in await store.list_weights("u1", 10)],
+        "latest": [w["date"] for w in await store.list_weights("u1", 1)],
+        "water": [{k: (await store.get_water(u, d) or {}).get(k) for k in ("date", "glasses", "goal")}
+                  for u, d in (("u1", "2024-05-03"), ("u1", "2024-05-04"), ("u1", "2024-05-05"))],
+        "series": await store.daily_series("u1", "2024-05-01", "2024-06-30"),
+        "may": await store.daily_series("u1", "2024-05-04", "2024-05-31"),
+        "goal_days": await store.water_goal_days("2024-05-01", "2024-05-31"),
+        "users": await store.water_for_users(["u1", "u2"], "2024-05-04"),
+    }
+
+
+class TestTrackingLayouts:
+    """Document vs bucketed layout tests"""
+    
+    def test_layouts_answer_the_same(self):
+        """Test the same writes through both stores give the same weights, water, series and goal days"""
+        async def run():
+            db = new_db()
+            documents, buckets = DocumentTrackingStore(db), BucketedTrackingStore(db)
+            await log_history(documents)
+            await log_history(buckets)
+            return await reads(documents), await reads(buckets)
+
+        documents, buckets = asyncio.run(run())
+        assert documents == buckets
+        assert documents["weights"] == [("2024-06-01", 79.0), ("2024-05-03", 80.5)]
+        assert documents["series"] == [
+            {"date": "2024-05-03", "glasses": 8, "goal": 8, "weight": 80.5},
+            {"date": "2024-05-04", "glasses": 1, "goal": 8, "weight": None},
+            {"date": "2024-06-01", "glasses": None, "goal": None, "weight": 79.0},
+        ]
+        assert documents["goal_days"] == {"u1": 1, "u2": 1}
+        assert documents["users"] == {"u1": {"glasses": 1, "goal": 8}}
+    
+    def test_migration_buckets_existing_history(self):
+        """Test the migration copies per-day documents into buckets that read back the same, keeping newer bucket days"""
+        async def run():
+            db = new_db()
+            documents = DocumentTrackingStore(db)
+            await log_history(documents)
+            # Written through the bucketed store after the switch, before the migration ran
+            buckets = BucketedTrackingStore(db)
+            await buckets.add_water("u1", "2024-05-20")
+            await buckets.add_water("u1", "2024-05-04")
+            await buckets.add_water("u1", "2024-05-04")
+            await bucket_tracking(db)
+            await bucket_tracking(db)  # safe to re-run
+            counts = (await db.water_buckets.count_documents({}), await db.weight_buckets.count_documents({}))
+            return await reads(documents), await reads(buckets), counts
+
+        documents, buckets, counts = asyncio.run(run())
+        # mongomock doesn't evaluate the [$weight, $created_at] array expression, so compare the days only
+        assert [d for d, _ in buckets["weights"]] == [d for d, _ in documents["weights"]]
+        assert buckets["goal_days"] == documents["goal_days"]
+        assert buckets["water"][0] == documents["water"][0]
+        assert [(r["date"], r["glasses"], r["goal"]) for r in buckets["series"]] == [
+            ("2024-05-03", 8, 8), ("2024-05-04", 2, 8), ("2024-05-20", 1, 8), ("2024-06-01", None, None)]
+        assert counts == (3, 2)
+        assert (documents["water"][1]["glasses"], buckets["water"][1]["glasses"]) == (1, 2)  # the bucket's own day wins
+        assert (buckets["may"][-1]["date"], buckets["may"][-1]["glasses"]) == ("2024-05-20", 1)
@@ -0,0 +1,119 @@
+"""
+User repository tests (in-process, Mongo mocked with mongomock-motor)
+Tests: profile cache hits and LRU eviction, invalidation, loads racing a write or clear() are not cached
+"""
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from users import UserRepository
+
+
+async def make_users(*ids: str, **kwargs) -> UserRepository:
+    col = mongomock_motor.AsyncMongoMockClient(tz_aware=True).fat2fit.users
+    for user_id in ids:
+        await col.insert_one({"id": user_id, "name": user_id.upper(), "email": f"{user_id}@test.com",
+                              "password_hash": "secret"})
+    return UserRepository(col, **kwargs)
+
+
+class SlowLoads:
+    """Holds every profile read until `release` is set."""
+
+    def __init__(self, users: UserRepository):
+        self.release = asyncio.Event()
+        self.started = asyncio.Event()
+        find_one = users.col.find_one
+
+        async def slow_find_one(*args, **kwargs):
+            self.started.set()
+            await self.release.wait()
+            return await find_one(*args, **kwargs)
+
+        users.col.find_one = slow_find_one
+
+
+class TestUserRepository:
+    """Profile cache tests"""
+    
+    def test_cache_hits_and_invalidate(self):
+        """Test a loaded profile serves later reads until invalidated, and deleted users load as missing"""
+        async def run():
+            users = await make_users("u1", "u2")
+            profile = await users.get_profile("u1")
+            assert profile.to_dict()["name"] == "U1" and not hasattr(profile, "password_hash")
+            assert await users.get_profile("u1") is profile
+            await users.col.update_one({"id": "u1"}, {"$set": {"name": "Renamed"}})
+            assert (await users.get_profile("u1")).name == "U1"
+            users.invalidate("u1")
+            assert (await users.get_profile("u1")).name == "Renamed"
+
+            assert (await users.update_profile("u2", {"goal": "strength"})).goal == "strength"
+            assert (await users.get_profile("u2")).goal == "strength"
+            await users.col.update_one({"id": "u2"}, {"$set": {"deleted_at": "now"}})
+            users.invalidate("u2")
+            assert await users.get_profile("u2") is None
+            assert await users.update_profile("u2", {"goal": "cut"}) is None
+            return users.stats()
+
+        stats = asyncio.run(run())
+        assert (stats["hits"], stats["misses"]) == (3, 3)
+    
+    def test_lru_eviction(self):
+        """Test the least recently used profile is evicted first, and a hit counts as a use"""
+        async def run():
+            users = await make_users("a", "b", "c", max_entries=2)
+            await users.get_profile("a")
+            await users.get_profile("b")
+            await users.get_profile("a")
+            await users.get_profile("c")
+            return users
+
+        users = asyncio.run(run())
+        assert list(users._cache) == ["a", "c"]
+        assert users.stats()["cached"] == 2
+    
+    def test_load_racing_a_write_is_not_cached(self):
+        """Test a profile read that started before an invalidate is returned but not cached"""
+        async def run():
+            users = await make_users("u1")
+            slow = SlowLoads(users)
+            loading = asyncio.create_task(users.get_profile("u1"))
+            await slow.started.wait()
+            await users.col.update_one({"id": "u1"}, {"$set": {"name": "Renamed"}})
+            users.invalidate("u1")
+            slow.release.set()
+            await loading
+            assert "u1" not in users._cache
+            assert (await users.get_profile("u1")).name == "Renamed"
+            assert "u1" in users._cache
+
+        asyncio.run(run())
+    
+    def test_load_racing_clear_is_not_cached(self):
+        """Test a profile read that started before clear() (or a version-map reset) is not cached"""
+        async def run():
+            users = await make_users("u1", "u2", max_entries=1)
+            slow = SlowLoads(users)
+            loading = asyncio.create_task(users.get_profile("u1"))
+            await slow.started.wait()
+            users.clear()
+            slow.release.set()
+            await loading
+            assert "u1" not in users._cache
+
+            # Enough invalidations to reset the version map mid-load
+            slow.release.clear()
+            users.invalidate("u1")
+            loading = asyncio.create_task(users.get_profile("u1"))
+            await asyncio.sleep(0)
+            for user_id in ("x", "y", "z"):
+                users.invalidate(user_id)
+            users.invalidate("u1")
+            slow.release.set()
+            await loading
+            assert "u1" not in users._cache
+
+        asyncio.run(run())
@@ -0,0 +1,299 @@
+"""
+Storage layouts for daily water intake and weight history.
+
+`DocumentTrackingStore` is the original layout: one document per user per day
+in `water_intake` / `weight_entries`. `BucketedTrackingStore` keeps one
+document per user per month in `water_buckets` / `weight_buckets`, holding a
+compact day -> value map, which cuts document and index-entry counts ~30x and
+turns a range read into a handful of point lookups. The API endpoints read and
+write through whichever store is configured (TRACKING_LAYOUT); run
+`migrate_tracking.py` before switching an existing deployment to buckets.
+"""
+import re
+import uuid
+from typing import Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from dates import iso, to_api, to_day, utc_now
+
+DEFAULT_WATER_GOAL = 8
+DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+
+
+class TrackingStore:
+    """Interface used by the weight, water and dashboard endpoints."""
+
+    async def ensure_indexes(self):
+        pass
+
+    async def list_weights(self, user_id: str, limit: int) -> List[dict]:
+        """Most recent weight entries first."""
+        raise NotImplementedError
+
+    async def save_weight(self, user_id: str, date: str, weight: float) -> dict:
+        """Create or overwrite the entry for `date`."""
+        raise NotImplementedError
+
+    async def delete_weight(self, user_id: str, entry_id: str) -> bool:
+        raise NotImplementedError
+
+    async def get_water(self, user_id: str, date: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def add_water(self, user_id: str, date: str) -> dict:
+        raise NotImplementedError
+
+    async def remove_water(self, user_id: str, date: str) -> Optional[dict]:
+        """Remove one glass. Returns None when there was nothing to remove."""
+        raise NotImplementedError
+
+    async def water_for_users(self, user_ids: List[str], date: str) -> Dict[str, dict]:
+        """{user_id: {glasses, goal}} for the users with water logged on `date`, in one query."""
+        raise NotImplementedError
+
+    async def daily_series(self, user_id: str, start: str, end: str) -> List[dict]:
+        """Per-day {date, glasses, goal, weight} for start..end inclusive, oldest first,
+        from one aggregation. Days with neither water nor weight are omitted."""
+        raise NotImplementedError
+
+    async def water_goal_days(self, start: str, end: str) -> Dict[str, int]:
+        """{user_id: days at the water goal} over start..end inclusive, for every user
+        with such a day, from one aggregation."""
+        raise NotImplementedError
+
+
+# Merges the water and weight rows of each day once $unionWith has combined them.
+_BY_DAY = [
+    {"$group": {"_id": "$date", "glasses": {"$max": "$glasses"}, "goal": {"$max": "$goal"},
+                "weight": {"$max": "$weight"}}},
+    {"$sort": {"_id": 1}},
+    {"$project": {"_id": 0, "date": "$_id", "glasses": 1, "goal": 1, "weight": 1}},
+]
+
+
+class DocumentTrackingStore(TrackingStore):
+    """`date` is a BSON date. The compound indexes carry every field the list and
+    lookup queries return, so those queries are answered from the index alone."""
+
+    WEIGHT_FIELDS = {"_id": 0, "id": 1, "user_id": 1, "date": 1, "weight": 1, "created_at": 1}
+    WATER_FIELDS = {"_id": 0, "id": 1, "user_id": 1, "date": 1, "glasses": 1, "goal": 1}
+
+    def __init__(self, db):
+        self.weights = db.weight_entries
+        self.water = db.water_intake
+
+    async def ensure_indexes(self):
+        await self.weights.create_index([("user_id", 1), ("date", -1), ("weight", 1), ("created_at", 1), ("id", 1)])
+        await self.water.create_index([("user_id", 1), ("date", 1), ("glasses", 1), ("goal", 1), ("id", 1)])
+        # water_goal_days (streak reconciliation) filters on the date range across all users
+        await self.water.create_index("date")
+
+    async def list_weights(self, user_id: str, limit: int) -> List[dict]:
+        entries = await self.weights.find({"user_id": user_id}, self.WEIGHT_FIELDS).sort("date", -1).limit(limit).to_list(limit)
+        return [to_api(e) for e in entries]
+
+    async def save_weight(self, user_id: str, date: str, weight: float) -> dict:
+        day = to_day(date)
+        existing = await self.weights.find_one({"user_id": user_id, "date": day})
+        now = utc_now()
+        if existing:
+            await self.weights.update_one(
+                {"user_id": user_id, "date": day},
+                {"$set": {"weight": weight, "created_at": now}}
+            )
+            return to_api(await self.weights.find_one({"user_id": user_id, "date": day}, self.WEIGHT_FIELDS))
+        entry = {"id": str(uuid.uuid4()), "user_id": user_id, "weight": weight, "date": day, "created_at": now}
+        await self.weights.insert_one(entry)
+        return to_api({k: v for k, v in entry.items() if k != "_id"})
+
+    async def delete_weight(self, user_id: str, entry_id: str) -> bool:
+        result = await self.weights.delete_one({"id": entry_id, "user_id": user_id})
+        return result.deleted_count > 0
+
+    async def get_water(self, user_id: str, date: str) -> Optional[dict]:
+        return to_api(await self.water.find_one({"user_id": user_id, "date": to_day(date)}, self.WATER_FIELDS))
+
+    async def add_water(self, user_id: str, date: str) -> dict:
+        day = to_day(date)
+        intake = await self.water.find_one({"user_id": user_id, "date": day})
+        if intake:
+            await self.water.update_one(
+                {"user_id": user_id, "date": day},
+                {"$set": {"glasses": intake.get("glasses", 0) + 1}}
+            )
+            return to_api(await self.water.find_one({"user_id": user_id, "date": day}, self.WATER_FIELDS))
+        new_intake = {"id": str(uuid.uuid4()), "user_id": user_id, "date": day, "glasses": 1, "goal": DEFAULT_WATER_GOAL}
+        await self.water.insert_one(new_intake)
+        return to_api({k: v for k, v in new_intake.items() if k != "_id"})
+
+    async def remove_water(self, user_id: str, date: str) -> Optional[dict]:
+        day = to_day(date)
+        intake = await self.water.find_one({"user_id": user_id, "date": day})
+        if not intake or intake.get("glasses", 0) <= 0:
+            return None
+        await self.water.update_one(
+            {"user_id": user_id, "date": day},
+            {"$set": {"glasses": intake["glasses"] - 1}}
+        )
+        return to_api(await self.water.find_one({"user_id": user_id, "date": day}, self.WATER_FIELDS))
+
+    async def water_for_users(self, user_ids: List[str], date: str) -> Dict[str, dict]:
+        docs = await self.water.find({"user_id": {"$in": user_ids}, "date": to_day(date)},
+                                     {"_id": 0, "user_id": 1, "glasses": 1, "goal": 1}).to_list(None)
+        return {d["user_id"]: {"glasses": d.get("glasses", 0), "goal": d.get("goal", DEFAULT_WATER_GOAL)} for d in docs}
+
+    async def daily_series(self, user_id: str, start: str, end: str) -> List[dict]:
+        in_range = {"user_id": user_id, "date": {"$gte": to_day(start), "$lte": to_day(end)}}  # (user_id, date) indexes
+        day = {"$dateToString": {"date": "$date", "format": "%Y-%m-%d"}}
+        return await self.water.aggregate([
+            {"$match": in_range},
+            {"$project": {"_id": 0, "date": day, "glasses": 1, "goal": 1}},
+            {"$unionWith": {"coll": self.weights.name, "pipeline": [
+                {"$match": in_range},
+                {"$project": {"_id": 0, "date": day, "weight": 1}},
+            ]}},
+            *_BY_DAY,
+        ]).to_list(None)
+
+    async def water_goal_days(self, start: str, end: str) -> Dict[str, int]:
+        rows = await self.water.aggregate([
+            {"$match": {"date": {"$gte": to_day(start), "$lte": to_day(end)}}},
+            {"$match": {"$expr": {"$gte": ["$glasses", {"$ifNull": ["$goal", DEFAULT_WATER_GOAL]}]}}},
+            {"$group": {"_id": "$user_id", "days": {"$sum": 1}}},
+        ]).to_list(None)
+        return {r["_id"]: r["days"] for r in rows}
+
+
+class BucketedTrackingStore(TrackingStore):
+    """One document per (user, month):
+
+        water_buckets:  {_id: "<user>:2024-05", user_id, month: "2024-05", goal: 8, days: {"03": 5, ...}}
+        weight_buckets: {_id: "<user>:2024-05", user_id, month: "2024-05", days: {"03": [81.2, <created_at>], ...}}
+
+    A weight entry's id is its date, since a user has at most one entry per day.
+    """
+
+    def __init__(self, db):
+        self.weights = db.weight_buckets
+        self.water = db.water_buckets
+
+    async def ensure_indexes(self):
+        await self.weights.create_index([("user_id", 1), ("month", -1)])
+        await self.water.create_index([("user_id", 1), ("month", -1)])
+        # water_goal_days (streak reconciliation) filters on the month range across all users
+        await self.water.create_index("month")
+
+    @staticmethod
+    def _split(date: str):
+        return date[:7], date[8:10]
+
+    async def list_weights(self, user_id: str, limit: int) -> List[dict]:
+        entries = []
+        cursor = self.weights.find({"user_id": user_id}, {"month": 1, "days": 1}).sort("month", -1)
+        async for bucket in cursor:
+            for day in sorted(bucket.get("days", {}), reverse=True):
+                weight, created_at = bucket["days"][day]
+                date = f"{bucket['month']}-{day}"
+                entries.append({"id": date, "user_id": user_id, "weight": weight, "date": date, "created_at": iso(created_at)})
+                if len(entries) >= limit:
+                    return entries
+        return entries
+
+    async def save_weight(self, user_id: str, date: str, weight: float) -> dict:
+        month, day = self._split(date)
+        now = utc_now()
+        await self.weights.update_one(
+            {"_id": f"{user_id}:{month}"},
+            {"$set": {f"days.{day}": [weight, now]}, "$setOnInsert": {"user_id": user_id, "month": month}},
+            upsert=True,
+        )
+        return {"id": date, "user_id": user_id, "weight": weight, "date": date, "created_at": iso(now)}
+
+    async def delete_weight(self, user_id: str, entry_id: str) -> bool:
+        if not re.match(DATE_PATTERN, entry_id):
+            return False
+        month, day = self._split(entry_id)
+        result = await self.weights.update_one(
+            {"_id": f"{user_id}:{month}", f"days.{day}": {"$exists": True}},
+            {"$unset": {f"days.{day}": ""}},
+        )
+        return result.modified_count > 0
+
+    def _water_doc(self, user_id: str, date: str, bucket: Optional[dict]) -> Optional[dict]:
+        day = self._split(date)[1]
+        if not bucket or day not in bucket.get("days", {}):
+            return None
+        return {"id": date, "user_id": user_id, "date": date, "glasses": bucket["days"][day],
+                "goal": bucket.get("goal", DEFAULT_WATER_GOAL)}
+
+    async def get_water(self, user_id: str, date: str) -> Optional[dict]:
+        month, day = self._split(date)
+        bucket = await self.water.find_one({"_id": f"{user_id}:{month}"}, {f"days.{day}": 1, "goal": 1})
+        return self._water_doc(user_id, date, bucket)
+
+    async def add_water(self, user_id: str, date: str) -> dict:
+        month, day = self._split(date)
+        bucket = await self.water.find_one_and_update(
+            {"_id": f"{user_id}:{month}"},
+            {"$inc": {f"days.{day}": 1},
+             "$setOnInsert": {"user_id": user_id, "month": month, "goal": DEFAULT_WATER_GOAL}},
+            projection={f"days.{day}": 1, "goal": 1}, upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        return self._water_doc(user_id, date, bucket)
+
+    async def remove_water(self, user_id: str, date: str) -> Optional[dict]:
+        month, day = self._split(date)
+        bucket = await self.water.find_one_and_update(
+            {"_id": f"{user_id}:{month}", f"days.{day}": {"$gt": 0}},
+            {"$inc": {f"days.{day}": -1}},
+            projection={f"days.{day}": 1, "goal": 1}, return_document=ReturnDocument.AFTER,
+        )
+        return self._water_doc(user_id, date, bucket)
+
+    async def water_for_users(self, user_ids: List[str], date: str) -> Dict[str, dict]:
+        month, day = self._split(date)
+        buckets = await self.water.find({"_id": {"$in": [f"{u}:{month}" for u in user_ids]}},
+                                        {"user_id": 1, "goal": 1, f"days.{day}": 1}).to_list(None)
+        return {b["user_id"]: {"glasses": b["days"][day], "goal": b.get("goal", DEFAULT_WATER_GOAL)}
+                for b in buckets if day in b.get("days", {})}
+
+    @staticmethod
+    def _days(user_id: str, start: str, end: str, fields: dict) -> List[dict]:
+        """Pipeline stages flattening the (user_id, month) buckets in range into one row per day."""
+        return [
+            {"$match": {"user_id": user_id, "month": {"$gte": start[:7], "$lte": end[:7]}}},
+            {"$project": {"_id": 0, "month": 1, "goal": 1, "day": {"$objectToArray": "$days"}}},
+            {"$unwind": "$day"},
+            {"$project": {"date": {"$concat": ["$month", "-", "$day.k"]}, **fields}},
+            {"$match": {"date": {"$gte": start, "$lte": end}}},
+        ]
+
+    async def daily_series(self, user_id: str, start: str, end: str) -> List[dict]:
+        return await self.water.aggregate([
+            *self._days(user_id, start, end, {"glasses": "$day.v", "goal": 1}),
+            {"$unionWith": {"coll": self.weights.name, "pipeline": self._days(
+                user_id, start, end, {"weight": {"$arrayElemAt": ["$day.v", 0]}})}},
+            *_BY_DAY,
+        ]).to_list(None)
+
+    async def water_goal_days(self, start: str, end: str) -> Dict[str, int]:
+        rows = await self.water.aggregate([
+            {"$match": {"month": {"$gte": start[:7], "$lte": end[:7]}}},
+            {"$project": {"_id": 0, "user_id": 1, "month": 1, "goal": {"$ifNull": ["$goal", DEFAULT_WATER_GOAL]},
+                          "day": {"$objectToArray": "$days"}}},
+            {"$unwind": "$day"},
+            {"$project": {"user_id": 1, "date": {"$concat": ["$month", "-", "$day.k"]},
+                          "hit": {"$gte": ["$day.v", "$goal"]}}},
+            {"$match": {"date": {"$gte": start, "$lte": end}, "hit": True}},
+            {"$group": {"_id": "$user_id", "days": {"$sum": 1}}},
+        ]).to_list(None)
+        return {r["_id"]: r["days"] for r in rows}
+
+
+def make_tracking_store(db, layout: str) -> TrackingStore:
+    if layout == "bucketed":
+        return BucketedTrackingStore(db)
+    if layout == "documents":
+        return DocumentTrackingStore(db)
+    raise ValueError(f"Unknown TRACKING_LAYOUT '{layout}' (expected 'documents' or 'bucketed')")
@@ -0,0 +1,112 @@
+"""
+User loading shared by the profile, auth and dashboard routes.
+
+`UserRepository.get_profile` keeps a small per-process TTL + LRU cache of slim
+`Profile` objects (password hash and unknown fields are never loaded), so one
+Mongo read serves many requests. Profile updates go through
+`find_one_and_update` and put the returned document straight into the cache;
+`invalidate` drops a user after any other write to their document. Users
+whose account deletion has started (`deleted_at` set) load as missing.
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from dates import iso
+from read_cache import SingleFlight
+
+
+class Profile:
+    __slots__ = ("id", "name", "email", "height_cm", "weight_kg", "age", "gender", "goal",
+                 "show_name_on_leaderboards", "created_at")
+
+    def __init__(self, doc: dict):
+        for field in self.__slots__:
+            setattr(self, field, doc.get(field))
+        self.show_name_on_leaderboards = bool(self.show_name_on_leaderboards)
+        self.created_at = iso(self.created_at)
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+PROFILE_FIELDS = {"_id": 0, **{field: 1 for field in Profile.__slots__}}
+
+
+class UserRepository:
+    def __init__(self, collection, ttl_seconds: float = 30.0, max_entries: int = 50000):
+        self.col = collection
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.flight = SingleFlight()
+        self._cache: "OrderedDict[str, Tuple[float, Profile]]" = OrderedDict()
+        # Bumped on every write so a load that started before it is not cached
+        self._versions: Dict[str, int] = {}
+        self._epoch = 0  # bumped by clear()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, user_id: str, profile: Profile):
+        self._cache[user_id] = (time.monotonic() + self.ttl, profile)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def get_profile(self, user_id: str) -> Optional[Profile]:
+        cached = self._cache.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            self.hits += 1
+            self._cache.move_to_end(user_id)
+            return cached[1]
+
+        self.misses += 1
+        version = (self._epoch, self._versions.get(user_id, 0))
+
+        async def load():
+            return await self.col.find_one({"id": user_id, "deleted_at": None}, PROFILE_FIELDS)
+        doc = await self.flight.do(("profile", user_id, version), load)
+        if not doc:
+            return None
+        profile = Profile(doc)
+        if (self._epoch, self._versions.get(user_id, 0)) == version:
+            self._store(user_id, profile)
+        return profile
+
+    async def update_profile(self, user_id: str, fields: dict) -> Optional[Profile]:
+        """Apply `fields` and return the updated profile in one round trip."""
+        if not fields:
+            return await self.get_profile(user_id)
+        doc = await self.col.find_one_and_update(
+            {"id": user_id, "deleted_at": None}, {"$set": fields},
+            projection=PROFILE_FIELDS, return_document=ReturnDocument.AFTER,
+        )
+        self.invalidate(user_id)
+        if not doc:
+            return None
+        profile = Profile(doc)
+        self._store(user_id, profile)
+        return profile
+
+    def invalidate(self, user_id: str):
+        if len(self._versions) > 2 * self.max_entries:
+            # Restarting the counts could match a load's old version; the epoch bump rules that out
+            self._versions.clear()
+            self._epoch += 1
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        self._cache.pop(user_id, None)
+
+    def clear(self):
+        self._epoch += 1
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "coalesced": self.flight.coalesced,
+        }
@@ -0,0 +1,21 @@
+import asyncio
+import signal
+from main import task_queue, client, logger
+
+async def run_worker():
+    """
+    Consumes the background task queue outside the API process.
+    Set TASK_WORKER_IN_PROCESS=0 on the web process when running this.
+    """
+    await task_queue.store.ensure_indexes()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: asyncio.ensure_future(task_queue.stop()))
+
+    logger.info(f"Task worker started (handlers: {', '.join(sorted(task_queue.handlers))})")
+    await task_queue.run()
+    client.close()
+    logger.info("Task worker stopped")
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())